@@ -2,7 +2,9 @@ from collections import defaultdict
 
 import networkx as nx
 
-from typing import Optional, Dict
+from typing import Optional, Dict, Set, Tuple
+
+from trust.csr_graph import NodeStrengths
 
 
 class WorkGraphStorage:
@@ -10,10 +12,16 @@ class WorkGraphStorage:
     def __init__(self):
         self.G = nx.DiGraph()
 
-        self.min_work_graph = nx.DiGraph()
+        # The version counter lets trust functions reuse structures frozen from the min work graph
+        self.min_work_graph = nx.DiGraph(version=0)
+        # Weighted in/out strengths of the min work graph, read by the trust functions instead of its adjacency
+        self.strengths = NodeStrengths.attach(self.min_work_graph)
 
         self.fresh_coef = defaultdict(lambda: 1)
 
+        # Edges of the min work graph changed since the last pop_changed_edges call
+        self.changed_edges = set()
+
     def add(self,
             from_id: str,
             to_id: str,
@@ -22,8 +30,16 @@ class WorkGraphStorage:
         # Update the min work graph
         weight = min(self.get(from_id, to_id).get('total_received', 0),
                      self.get(from_id, to_id).get('total_sent', 0))
-        if weight > 0:
+        old_weight = self.min_work_graph.get_edge_data(from_id, to_id, {}).get('weight')
+        if weight > 0 and old_weight != weight:
             self.min_work_graph.add_edge(from_id, to_id, weight=weight)
+            self.min_work_graph.graph['version'] += 1
+            self.strengths.add_weight(from_id, to_id, weight - (old_weight or 0))
+            self.changed_edges.add((from_id, to_id))
+
+    def pop_changed_edges(self) -> Set[Tuple[str, str]]:
+        changed_edges, self.changed_edges = self.changed_edges, set()
+        return changed_edges
 
     def get(self,
             from_id: str,
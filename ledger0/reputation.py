@@ -1,3 +1,4 @@
+import inspect
 from collections import defaultdict
 
 from ledger0.common import TRUST_STORE, WORK_GRAPH
@@ -5,8 +6,9 @@ from ledger0.graph_storage import WorkGraphStorage
 from p2psimpy import BaseRunner, Storage
 
 import networkx as nx
+from typing import Dict, Optional, Set
 
-from trust import BoundedBarterCast, WBPPR
+from trust import BoundedBarterCast
 
 
 class ReputationStorage:
@@ -14,17 +16,32 @@ class ReputationStorage:
     def __init__(self, my_peer_id: str, trust_function=BoundedBarterCast, **kwargs) -> None:
         self.trust = trust_function
         self.params = kwargs
+        # update_graph can only patch walks that were kept, otherwise the walk based trust functions forget their seeds
+        if 'retain_walks' in inspect.signature(trust_function).parameters:
+            self.params.setdefault('retain_walks', True)
         self.seed_node = my_peer_id
 
         self._trust_val = None
         self.local_reputation = defaultdict(float)
 
-    def update_graph(self, G: nx.DiGraph) -> None:
-        self._trust_val = self.trust(G, **self.params)
+    def update_graph(self, G: nx.DiGraph, changed_edges: Optional[Set] = None) -> None:
+        """Prepare the trust function for the current graph.
+        Trust functions that support it are updated with the changed edges instead of being rebuilt.
+        """
+        if changed_edges is not None and self._trust_val is not None and self._trust_val.graph is G \
+                and hasattr(self._trust_val, 'update'):
+            self._trust_val.update(changed_edges)
+        else:
+            self._trust_val = self.trust(G, **self.params)
 
     def get_reputation(self, target_node: str) -> float:
         return self._trust_val.compute(self.seed_node, target_node)
 
+    def get_reputations(self) -> Dict[str, float]:
+        """Reputation of every node of the graph, computed in one batch with compute_all."""
+        nodes = self._trust_val.node_index()
+        return dict(zip(nodes, self._trust_val.compute_all(self.seed_node).tolist()))
+
 
 class ReputationService(BaseRunner):
 
@@ -58,11 +75,9 @@ class ReputationService(BaseRunner):
 
     def update_reputation(self) -> None:
         # Choose min value from the edge weight
-        self.reputation.update_graph(self.work_graph.min_work_graph)
+        self.reputation.update_graph(self.work_graph.min_work_graph, self.work_graph.pop_changed_edges())
         # Write to the peer store
-        reps = {}
-        for n in self.work_graph.min_work_graph.nodes():
-            reps[n] = self.reputation.get_reputation(n)
+        reps = self.reputation.get_reputations()
         self.peer.store(TRUST_STORE, self.env.now, reps)
 
     def run(self) -> None:
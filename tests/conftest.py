@@ -0,0 +1,49 @@
+"""Graph builders and fixtures shared by the tests."""
+import random
+from concurrent.futures import ProcessPoolExecutor
+
+import networkx as nx
+import pytest
+
+BACKENDS = ['networkx', 'igraph', 'scipy', 'incremental']
+
+
+def random_graph(seed: int = 0, nodes: int = 12, edges: int = 40, integer: bool = True,
+                 version=None) -> nx.DiGraph:
+    """Random directed graph with integer weights in [1, 20], or fractional ones in [0.1, 20]."""
+    rng = random.Random(seed)
+    graph = nx.gnm_random_graph(nodes, edges, seed=seed, directed=True)
+    for u, v in graph.edges():
+        graph[u][v]['weight'] = rng.randint(1, 20) if integer else rng.uniform(0.1, 20)
+    if version is not None:
+        graph.graph['version'] = version
+    return graph
+
+
+def two_path_graph(version=None) -> nx.DiGraph:
+    """Two paths from s to t, the maxflow is 4 and 8 after swap_weights."""
+    graph = nx.DiGraph()
+    graph.add_weighted_edges_from([('s', 'a', 2), ('a', 't', 6), ('s', 'b', 6), ('b', 't', 2)])
+    if version is not None:
+        graph.graph['version'] = version
+    return graph
+
+
+def swap_weights(graph: nx.DiGraph) -> None:
+    # Same number of nodes, edges and total weight, only the maxflow changes
+    graph['a']['t']['weight'], graph['b']['t']['weight'] = 2, 6
+
+
+def ring_graph(n: int = 12) -> nx.DiGraph:
+    """Every node links to the next one and to the one five ahead."""
+    graph = nx.DiGraph()
+    for i in range(n):
+        graph.add_edge(i, (i + 1) % n, weight=1 + i % 3)
+        graph.add_edge(i, (i + 5) % n, weight=2)
+    return graph
+
+
+@pytest.fixture(scope='session')
+def executor():
+    with ProcessPoolExecutor(2) as pool:
+        yield pool
@@ -0,0 +1,61 @@
+import networkx as nx
+import numpy as np
+import pytest
+
+from trust import AllPairsScores, MaxFlow, PersonalizedPageRank
+
+
+def small_graph() -> nx.DiGraph:
+    graph = nx.DiGraph()
+    graph.add_weighted_edges_from([(0, 1, 2), (1, 2, 3), (2, 0, 1), (2, 3, 4), (3, 1, 2), (4, 0, 1)])
+    return graph
+
+
+def test_matrix_matches_compute_all(tmp_path):
+    graph = small_graph()
+    matrix = AllPairsScores(graph, MaxFlow, str(tmp_path / 'scores'), tile_size=2, cache=None).compute()
+    trust = MaxFlow(graph, cache=None)
+    assert np.array(matrix) == pytest.approx(np.array([trust.compute_all(seed_node) for seed_node in graph]))
+
+
+def test_resume_with_unfinished_tiles(tmp_path):
+    graph = small_graph()
+    scores = AllPairsScores(graph, PersonalizedPageRank, str(tmp_path / 'scores'), tile_size=2)
+    expected = np.array(scores.compute())
+
+    # Interrupted after the first tile
+    finished = np.load(scores.tiles_path)
+    finished[1:] = 0
+    scores._mark_finished(finished, 0, finished[0])
+    resumed = AllPairsScores(graph, PersonalizedPageRank, str(tmp_path / 'scores'), tile_size=2)
+    assert resumed.pending_tiles() == [1, 2]
+    assert np.array(resumed.compute()) == pytest.approx(expected)
+    assert resumed.pending_tiles() == []
+
+
+@pytest.mark.parametrize('change', ['params', 'trust_function', 'tile_size', 'graph'])
+def test_refuses_to_resume_another_computation(tmp_path, change):
+    graph = small_graph()
+    path = str(tmp_path / 'scores')
+    AllPairsScores(graph, MaxFlow, path, tile_size=2, alpha=1.0).compute()
+
+    params = dict(graph=graph, trust_function=MaxFlow, path=path, tile_size=2, alpha=1.0)
+    if change == 'params':
+        params['alpha'] = 2.0
+    elif change == 'trust_function':
+        params['trust_function'] = PersonalizedPageRank
+        del params['alpha']
+    elif change == 'tile_size':
+        params['tile_size'] = 3
+    else:
+        graph[0][1]['weight'] = 5
+    with pytest.raises(ValueError, match=change):
+        AllPairsScores(**params).compute()
+
+
+def test_refuses_to_overwrite_other_files(tmp_path):
+    path = tmp_path / 'scores'
+    path.write_bytes(b'not a score matrix')
+    with pytest.raises(ValueError):
+        AllPairsScores(small_graph(), MaxFlow, str(path)).compute()
+    assert path.read_bytes() == b'not a score matrix'
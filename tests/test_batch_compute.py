@@ -0,0 +1,64 @@
+import networkx as nx
+import numpy as np
+import pytest
+
+from trust import (BarterCast, BiasedPHT, BiasedRSBHittingTime, BoundedBarterCast, ForwardPushPageRank, MaxFlow,
+                   PenaltyCast, PersonalizedHittingTime, PersonalizedPageRank, RawBarterCast, ReciprocalScaledPageRank,
+                   RSBHittingTime, SBPPageRank, TrustRank, WBPPageRank)
+from trust.maxflow_backends import get_maxflow_backend
+from trust.maxflow_based import maxflow_values
+
+TRUST_FUNCTIONS = {
+    'MaxFlow': MaxFlow,
+    'BarterCast': BarterCast,
+    'RawBarterCast': RawBarterCast,
+    'BoundedBarterCast': BoundedBarterCast,
+    'PenaltyCast': PenaltyCast,
+    'PersonalizedPageRank': lambda graph: PersonalizedPageRank(graph, seed_node='s'),
+    'ForwardPushPageRank': ForwardPushPageRank,
+    'PersonalizedHittingTime': lambda graph: PersonalizedHittingTime(graph, number_random_walks=100),
+    'BiasedPHT': lambda graph: BiasedPHT(graph, seed_node='s', number_random_walks=100),
+    'TrustRank': lambda graph: TrustRank(graph, number_random_walks=100),
+    'ReciprocalScaledPageRank': ReciprocalScaledPageRank,
+    'WBPPageRank': WBPPageRank,
+    'SBPPageRank': SBPPageRank,
+    'RSBHittingTime': RSBHittingTime,
+    'BiasedRSBHittingTime': BiasedRSBHittingTime,
+}
+
+
+def seedless_graph() -> nx.DiGraph:
+    graph = nx.DiGraph()
+    graph.add_weighted_edges_from([(0, 1, 2), (1, 0, 1), (1, 2, 3)])
+    return graph
+
+
+@pytest.mark.parametrize('name', TRUST_FUNCTIONS)
+def test_compute_all_on_empty_graph(name):
+    assert TRUST_FUNCTIONS[name](nx.DiGraph()).compute_all('s').shape == (0,)
+
+
+@pytest.mark.parametrize('name', TRUST_FUNCTIONS)
+def test_compute_all_without_the_seed(name):
+    # The seed of a new peer is not part of its work graph before the first interaction
+    scores = TRUST_FUNCTIONS[name](seedless_graph()).compute_all('s')
+    assert (scores == np.zeros(3)).all()
+
+
+def test_maxflow_values_without_the_source():
+    values, avoided = maxflow_values(seedless_graph(), 's', [0, 1, 2], get_maxflow_backend('networkx'))
+    assert values == {0: 0.0, 1: 0.0, 2: 0.0}
+    assert avoided == 3
+
+
+def test_pagerank_vector_follows_the_graph_version():
+    graph = seedless_graph()
+    graph.graph['version'] = 0
+    trust = PersonalizedPageRank(graph, seed_node=0)
+    trust.compute_all(0)
+    graph[0][1]['weight'] = 0
+    graph.add_edge(0, 2, weight=5)
+    graph.graph['version'] += 1
+    rank = nx.pagerank(graph, personalization={0: 1.0})
+    assert trust.compute_all(0) == pytest.approx([rank[x] for x in graph], abs=1.0e-5)
+    assert trust.compute(0, 2) == pytest.approx(rank[2], abs=1.0e-5)
@@ -0,0 +1,170 @@
+import random
+
+import networkx as nx
+import numpy as np
+import pytest
+
+from conftest import BACKENDS, ring_graph, swap_weights, two_path_graph
+from ledger0.graph_storage import WorkGraphStorage
+from trust import BarterCast, ForwardPushPageRank, MaxFlow, RandomWalks, TrustRank
+from trust.csr_graph import (CSRGraph, FenwickRows, NetContribMixin, graph_version, in_strength, node_strengths,
+                             out_strength)
+
+
+def test_unversioned_graph_has_no_version():
+    assert graph_version(two_path_graph()) is None
+    assert graph_version(two_path_graph(version=3)) == 3
+
+
+def test_unversioned_snapshot_sees_in_place_changes():
+    graph = two_path_graph()
+    before = CSRGraph.frozen(graph)
+    swap_weights(graph)
+    after = CSRGraph.frozen(graph)
+    a, t = after.index['a'], after.index['t']
+    assert after is not before
+    assert after.forward.weights[after.forward.offsets[a]:after.forward.offsets[a + 1]][
+        list(after.forward.neighbors(a)).index(t)] == 2
+
+
+def test_versioned_snapshot_is_shared_until_the_version_changes():
+    graph = two_path_graph(version=0)
+    snapshot = CSRGraph.frozen(graph)
+    assert CSRGraph.frozen(graph) is snapshot
+    graph.graph['version'] += 1
+    assert CSRGraph.frozen(graph) is not snapshot
+
+
+@pytest.mark.parametrize('backend', BACKENDS)
+def test_backends_see_in_place_changes_of_unversioned_graphs(backend):
+    graph = two_path_graph()
+    assert MaxFlow(graph, backend=backend).compute('s', 't') == 4
+    swap_weights(graph)
+    assert MaxFlow(graph, backend=backend).compute('s', 't') == 8
+
+
+@pytest.mark.parametrize('max_hops', [1, 2])
+def test_two_hop_flow_of_unversioned_graphs(max_hops):
+    graph, versioned = two_path_graph(), two_path_graph(version=0)
+    for seed, target in [('s', 't'), ('t', 's'), ('s', 'a'), ('a', 's')]:
+        assert BarterCast(graph, max_hops=max_hops, cache=None).compute(seed, target) == \
+               BarterCast(versioned, max_hops=max_hops, cache=None).compute(seed, target)
+    swap_weights(graph)
+    assert MaxFlow(graph, max_hops=max_hops).compute('s', 't') == (0 if max_hops == 1 else 8)
+
+
+def test_walks_see_in_place_changes_of_unversioned_graphs():
+    graph = two_path_graph()
+    random_walks = RandomWalks(graph)
+    random_walks.run('s', 200, 0.5)
+    assert random_walks.get_number_of_hits('s', 'a') > 0
+    graph['s']['a']['weight'] = 0
+    random_walks.run('s', 200, 0.5)
+    assert random_walks.get_number_of_hits('s', 'a') == 0
+
+
+@pytest.fixture
+def snapshots(monkeypatch):
+    """Number of CSR snapshots built during the test."""
+    built = []
+    frozen = CSRGraph.frozen.__func__
+    monkeypatch.setattr(CSRGraph, 'frozen', classmethod(lambda cls, graph: built.append(graph) or frozen(cls, graph)))
+    return built
+
+
+def test_single_walks_of_unversioned_graphs_use_the_dicts(snapshots):
+    graph = ring_graph()
+    random_walks = RandomWalks(graph, random_seed=3)
+    walks = [random_walks.run_one_walk(0, 0.2) for _ in range(3000)]
+    assert snapshots == []
+    # 0 links to 1 with weight 1 and to 5 with weight 2
+    first_steps = [walk[1] for walk in walks if len(walk) > 1]
+    assert first_steps.count(1) / len(first_steps) == pytest.approx(1 / 3, abs=0.03)
+    assert sum(random_walks.num_edge_walks.values()) == sum(len(walk) - 1 for walk in walks)
+    assert list(random_walks.random_walks[0]) == walks
+
+
+def test_forward_push_of_unversioned_graphs_does_not_freeze(snapshots):
+    graph = ring_graph()
+    versioned = ring_graph()
+    versioned.graph['version'] = 0
+    plain, frozen = ForwardPushPageRank(graph, epsilon=1.0e-9), ForwardPushPageRank(versioned, epsilon=1.0e-9)
+    for target in graph:
+        assert plain.compute(0, target) == pytest.approx(frozen.compute(0, target))
+    assert plain.compute_all(3) == pytest.approx(frozen.compute_all(3))
+    assert all(snapshot is versioned for snapshot in snapshots)
+
+
+def test_bidirectional_batch_shares_one_snapshot(snapshots):
+    trust = TrustRank(ring_graph(), number_random_walks=2000, random_seed=1, bidirectional=True)
+    trust.compute_many(0, list(range(1, 12)))
+    # One snapshot for the forward and one for the reverse estimates
+    assert len(snapshots) == 2
+
+
+def test_row_cumsum_restarts_at_every_row():
+    graph = ring_graph()
+    graph.add_node('isolated')
+    graph.add_edge(3, 'dangling', weight=0)
+    adj = CSRGraph.frozen(graph).forward
+    cum_weights = adj.row_cumsum(adj.weights)
+    for u in range(len(adj.offsets) - 1):
+        start, end = adj.offsets[u], adj.offsets[u + 1]
+        assert cum_weights[start:end] == pytest.approx(np.cumsum(adj.weights[start:end]))
+
+
+def test_fenwick_rows_find_like_searchsorted():
+    rng = np.random.default_rng(4)
+    offsets = np.array([0, 5, 5, 6, 19])
+    weights = rng.integers(0, 4, size=19).astype(np.float64)
+    rows = FenwickRows(offsets, weights.copy())
+    for _ in range(200):
+        node = int(rng.choice([0, 2, 3]))
+        start, end = offsets[node], offsets[node + 1]
+        rows.set(node, int(rng.integers(start, end)), float(rng.integers(0, 4)))
+        row = rows.weights[start:end]
+        assert rows.has_weight(node) == (row > 0).any()
+        assert rows.totals[node] == pytest.approx(row.sum())
+        if rows.has_weight(node):
+            value = rng.uniform(0, 1) * rows.totals[node]
+            assert rows.find(node, value) == start + np.searchsorted(np.cumsum(row), value)
+
+
+def test_node_strengths_follow_the_work_graph():
+    storage = WorkGraphStorage()
+    graph = storage.min_work_graph
+    rng = random.Random(6)
+    for _ in range(300):
+        u, v = rng.sample(['p%d' % i for i in range(10)], 2)
+        # Edge data grows or shrinks, the min work graph keeps min(received, sent) of every positive edge
+        storage.add(u, v, total_sent=rng.randint(0, 20), total_received=rng.randint(0, 20))
+        nodes = list(graph) + ['unknown']
+        expected_out = [graph.out_degree(x, weight='weight') if x in graph else 0.0 for x in nodes]
+        expected_in = [graph.in_degree(x, weight='weight') if x in graph else 0.0 for x in nodes]
+        out_strengths, in_strengths = node_strengths(graph, nodes)
+        assert out_strengths == pytest.approx(expected_out)
+        assert in_strengths == pytest.approx(expected_in)
+        assert [out_strength(graph, x) for x in nodes] == pytest.approx(expected_out)
+        assert [in_strength(graph, x) for x in nodes] == pytest.approx(expected_in)
+
+    # A copy shares the graph attributes but not the strengths, they are summed over its own edges
+    copy = graph.copy()
+    edge = next(iter(copy.edges()))
+    copy.remove_edge(*edge)
+    assert node_strengths(copy, [edge[0]])[0][0] == pytest.approx(copy.out_degree(edge[0], weight='weight'))
+
+
+def test_net_contrib_formula_is_required():
+    class Unscaled(NetContribMixin):
+        pass
+
+    class Scaled(NetContribMixin):
+        graph = two_path_graph()
+
+        def _net_contrib(self, out_deg, in_deg):
+            return out_deg - in_deg
+
+    with pytest.raises(TypeError):
+        Unscaled()
+    assert Scaled().net_contrib('a') == 4
+    assert list(Scaled().net_contribs(['s', 't'])) == [8, -8]
@@ -0,0 +1,83 @@
+import pickle
+import random
+
+import networkx as nx
+import pytest
+
+from conftest import BACKENDS, random_graph
+from trust.maxflow_backends import IncrementalBackend, MaxflowBackend, ScipyBackend, get_maxflow_backend
+
+
+def expected_value(graph: nx.DiGraph, source, sink) -> float:
+    return nx.maximum_flow_value(graph, source, sink, capacity='weight')
+
+
+@pytest.mark.parametrize('backend', BACKENDS)
+@pytest.mark.parametrize('integer', [True, False], ids=['integer', 'fractional'])
+def test_backend_matches_networkx(backend, integer):
+    backend = get_maxflow_backend(backend)
+    for seed in range(3):
+        graph = random_graph(seed, nodes=15, edges=50, integer=integer)
+        for source, sink in [(0, 1), (2, 7), (5, 3), (14, 0)]:
+            # Fractional weights are rounded to 1/1000 by scipy, by at most 0.5 / 1000 for each of the 50 edges
+            tolerance = 1.0e-6 if integer or backend.name != 'scipy' else 50 * 0.5 / 1000
+            assert backend.maxflow_value(graph, source, sink) == \
+                   pytest.approx(expected_value(graph, source, sink), abs=tolerance)
+
+
+@pytest.mark.parametrize('backend', BACKENDS)
+def test_backend_flow_matches_its_value(backend):
+    backend = get_maxflow_backend(backend)
+    graph = random_graph(0, nodes=15, edges=50)
+    value, flow = backend.maximum_flow(graph, 0, 1)
+    assert value == pytest.approx(expected_value(graph, 0, 1))
+    assert sum(flow.values()) >= value - 1.0e-6
+
+
+@pytest.mark.parametrize('weight, scale', [(3.0e9, None), (2.5e6 + 0.5, None), (3.0e3, 1.0e6)])
+def test_scipy_rejects_capacities_beyond_int32(weight, scale):
+    graph = nx.DiGraph()
+    graph.add_weighted_edges_from([(0, 1, weight), (1, 2, weight)])
+    with pytest.raises(ValueError, match='int32'):
+        ScipyBackend(scale).maxflow_value(graph, 0, 2)
+
+
+
+@pytest.mark.parametrize('integer', [True, False], ids=['integer', 'fractional'])
+def test_incremental_backend_follows_weight_changes(integer):
+    backend = IncrementalBackend()
+    graph = random_graph(4, nodes=15, edges=50, integer=integer, version=0)
+    pairs = [(0, 1), (2, 7), (5, 3), (14, 0)]
+    rng = random.Random(4)
+    for step in range(30):
+        for source, sink in pairs:
+            assert backend.maxflow_value(graph, source, sink) == pytest.approx(expected_value(graph, source, sink))
+        u, v = rng.sample(range(15), 2)
+        if step % 3 == 2 and graph.has_edge(u, v):
+            graph[u][v]['weight'] = rng.uniform(0, graph[u][v]['weight'])
+        else:
+            graph.add_edge(u, v, weight=graph.get_edge_data(u, v, {'weight': 0})['weight'] + rng.randint(1, 10))
+        graph.graph['version'] += 1
+
+    for source, sink in pairs:
+        assert backend.maxflow_value(graph, source, sink) == pytest.approx(expected_value(graph, source, sink))
+
+    # Increases keep every flow, only new augmenting paths are searched
+    kept = {pair: backend._states[graph].flows[pair] for pair in pairs}
+    for u, v in graph.edges():
+        graph[u][v]['weight'] += 1
+    graph.graph['version'] += 1
+    for source, sink in pairs:
+        assert backend.maxflow_value(graph, source, sink) == pytest.approx(expected_value(graph, source, sink))
+        assert backend._states[graph].flows[(source, sink)] is kept[(source, sink)]
+
+
+def test_backends_must_implement_maximum_flow():
+    class ValueOnly(MaxflowBackend):
+        name = 'value-only'
+
+    with pytest.raises(TypeError):
+        ValueOnly()
+    for name in BACKENDS:
+        backend = pickle.loads(pickle.dumps(get_maxflow_backend(name)))
+        assert backend.maxflow_value(random_graph(), 0, 1) == pytest.approx(expected_value(random_graph(), 0, 1))
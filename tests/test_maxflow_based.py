@@ -0,0 +1,129 @@
+import networkx as nx
+import numpy as np
+import pytest
+
+from conftest import BACKENDS, random_graph
+from trust import BarterCast, BoundedBarterCast, MaxFlow, Netflow, PenaltyCast, RawBarterCast
+from trust.maxflow_based import hop_bounded_maxflow, parallel_maxflow_values
+from trust.maxflow_backends import get_maxflow_backend
+
+MAXFLOW_FUNCTIONS = [MaxFlow, BarterCast, RawBarterCast, BoundedBarterCast, PenaltyCast]
+
+
+@pytest.mark.parametrize('backend', BACKENDS)
+@pytest.mark.parametrize('version', [None, 0])
+def test_parallel_maxflow_values(executor, backend, version):
+    graph = random_graph(version=version)
+    backend = get_maxflow_backend(backend)
+    pairs = [(s, t) for s in range(3) for t in range(12) if s != t]
+    expected = [nx.maximum_flow_value(graph, s, t, capacity='weight') for s, t in pairs]
+    assert parallel_maxflow_values(executor, graph, pairs, backend) == pytest.approx(expected)
+    # The workers keep the graph of the snapshot, an in-place change makes a new one
+    graph[0][next(iter(graph.succ[0]))]['weight'] += 50
+    if version is not None:
+        graph.graph['version'] += 1
+    expected = [nx.maximum_flow_value(graph, s, t, capacity='weight') for s, t in pairs]
+    assert parallel_maxflow_values(executor, graph, pairs, backend, chunk_size=5) == pytest.approx(expected)
+
+
+def test_parallel_maxflow_values_of_missing_nodes(executor):
+    with pytest.raises(nx.NetworkXError):
+        parallel_maxflow_values(executor, random_graph(), [(0, 'missing')], get_maxflow_backend('networkx'))
+
+
+@pytest.mark.parametrize('trust_function', MAXFLOW_FUNCTIONS)
+def test_compute_all_on_executor(executor, trust_function):
+    graph = random_graph(version=0)
+    local = trust_function(graph, cache=None)
+    parallel = trust_function(graph, cache=None, executor=executor)
+    for seed_node in range(4):
+        assert parallel.compute_all(seed_node) == pytest.approx(local.compute_all(seed_node))
+        assert parallel.compute_all(seed_node) == pytest.approx(np.array([local.compute(seed_node, t)
+                                                                          for t in graph]))
+
+
+def netflow_scores(graph: nx.DiGraph, seed_node, alpha: float) -> list:
+    """Maxflows from the seed on the graph where the out-edges of the seed are divided by alpha."""
+    scaled = graph.copy()
+    for _, v, data in scaled.out_edges(seed_node, data=True):
+        data['weight'] /= alpha
+    return [0 if node == seed_node else nx.maximum_flow_value(scaled, seed_node, node, capacity='weight')
+            for node in graph]
+
+
+@pytest.mark.parametrize('backend', BACKENDS)
+def test_netflow_matches_maxflows_of_the_scaled_graph(backend):
+    graph = random_graph(seed=2)
+    # The scipy backend rounds the fractional capacities of the seed to thousandths
+    tolerance = dict(abs=0.01) if backend == 'scipy' else {}
+    trust = Netflow(graph, seed_node=0, alpha=3, backend=backend)
+    assert trust.compute_many(0, list(graph)) == pytest.approx(netflow_scores(graph, 0, 3), **tolerance)
+    assert trust.compute_all(4) == pytest.approx(netflow_scores(graph, 4, 3), **tolerance)
+
+    for u, v in [(4, 1), (4, 7), (5, 4)]:
+        graph.add_edge(u, v, weight=graph.get_edge_data(u, v, {'weight': 0})['weight'] + 9)
+    trust.update([(4, 1), (4, 7), (5, 4)])
+    assert trust.compute_many(4, list(graph)) == pytest.approx(netflow_scores(graph, 4, 3), **tolerance)
+
+
+def penalized_copy(trust: PenaltyCast, seed_node, penalized_nodes: list) -> nx.DiGraph:
+    """Copy of the graph with the out-edges of the seed lowered by the penalties of the given in-neighbors."""
+    aux = trust.graph.copy()
+    for k in penalized_nodes:
+        w = trust.graph[k][seed_node]['weight']
+        for i, v in trust.path_counts(seed_node, k).items():
+            if i in aux[seed_node]:
+                aux[seed_node][i]['weight'] -= v * w / trust.alpha
+    for _, _, data in aux.out_edges(seed_node, data=True):
+        data['weight'] = max(data['weight'], 0)
+    return aux
+
+
+def penalty_scores(trust: PenaltyCast, seed_node, aux: nx.DiGraph) -> list:
+    return [1.0 if t == seed_node else nx.maximum_flow_value(aux, seed_node, t, capacity='weight')
+            - nx.maximum_flow_value(trust.graph, t, seed_node, capacity='weight') for t in trust.graph]
+
+
+@pytest.mark.parametrize('backend', BACKENDS)
+@pytest.mark.parametrize('version', [None, 0])
+def test_penalty_cast_overlay_matches_a_penalized_copy(backend, version):
+    graph = random_graph(seed=3, version=version)
+    seed_node = max(graph, key=graph.in_degree)
+    in_neighbors = list(graph.pred[seed_node])
+    # The scipy backend rounds the fractional capacities of the overlay to thousandths
+    tolerance = dict(abs=0.01) if backend == 'scipy' else {}
+    trust = PenaltyCast(graph, backend=backend, cache=None)
+    aux = penalized_copy(trust, seed_node, in_neighbors)
+    assert trust.compute_many(seed_node, list(graph)) == pytest.approx(penalty_scores(trust, seed_node, aux),
+                                                                       **tolerance)
+
+    # Every recalculation adds the penalties of the neighbor once more
+    trust.recalc_penalites(seed_node, in_neighbors[0])
+    trust.recalc_penalites(seed_node, in_neighbors[-1])
+    aux = penalized_copy(trust, seed_node, in_neighbors + [in_neighbors[0], in_neighbors[-1]])
+    assert trust.compute_all(seed_node) == pytest.approx(penalty_scores(trust, seed_node, aux), **tolerance)
+    assert trust.compute(seed_node, in_neighbors[0]) == \
+           pytest.approx(penalty_scores(trust, seed_node, aux)[list(graph).index(in_neighbors[0])], **tolerance)
+
+    if version is not None:
+        # On a new graph version the aux graph is rebuilt with the penalties of the new graph, once per neighbor
+        graph[in_neighbors[0]][seed_node]['weight'] += 10
+        graph.graph['version'] += 1
+        trust.recalc_penalites(seed_node, in_neighbors[0])
+        aux = penalized_copy(trust, seed_node, in_neighbors)
+        assert trust.compute_all(seed_node) == pytest.approx(penalty_scores(trust, seed_node, aux), **tolerance)
+
+
+@pytest.mark.parametrize('backend', BACKENDS)
+def test_hop_bounded_maxflow_runs_on_the_backend(monkeypatch, backend):
+    graph = random_graph(seed=5, version=0)
+    backend = get_maxflow_backend(backend)
+    calls = []
+    maxflow = backend.maxflow_value
+    monkeypatch.setattr(backend, 'maxflow_value', lambda *args: calls.append(args) or maxflow(*args))
+    bounded, unbounded = MaxFlow(graph, max_hops=3, backend=backend), MaxFlow(graph, max_hops=12, backend=backend)
+    for target in range(1, 12):
+        assert bounded.compute(0, target) == pytest.approx(hop_bounded_maxflow(graph, 0, target, 3))
+        assert unbounded.compute(0, target) == pytest.approx(nx.maximum_flow_value(graph, 0, target,
+                                                                                    capacity='weight'))
+    assert calls
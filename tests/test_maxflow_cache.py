@@ -0,0 +1,52 @@
+import networkx as nx
+
+from conftest import swap_weights, two_path_graph
+from trust import MaxFlow
+from trust.maxflow_backends import MaxflowCache
+
+
+def test_unversioned_graph_is_not_cached():
+    cache = MaxflowCache()
+    graph = two_path_graph()
+    assert MaxFlow(graph, cache=cache).compute('s', 't') == 4
+    swap_weights(graph)
+    assert MaxFlow(graph, cache=cache).compute('s', 't') == 8
+    assert len(cache) == 0
+
+
+def test_unversioned_graph_with_default_cache():
+    graph = two_path_graph()
+    assert MaxFlow(graph).compute('s', 't') == 4
+    swap_weights(graph)
+    assert MaxFlow(graph).compute('s', 't') == 8
+
+
+def test_versioned_graph_is_invalidated_by_version():
+    cache = MaxflowCache()
+    graph = two_path_graph(version=0)
+    assert MaxFlow(graph, cache=cache).compute('s', 't') == 4
+    assert MaxFlow(graph, cache=cache).compute('s', 't') == 4
+    assert cache.stats()['hits'] == 1
+
+    swap_weights(graph)
+    graph.graph['version'] += 1
+    assert MaxFlow(graph, cache=cache).compute('s', 't') == 8
+    assert cache.stats()['misses'] == 2
+
+
+def test_eviction_by_entries_and_bytes():
+    graph = two_path_graph(version=0)
+    cache = MaxflowCache(max_entries=2, max_bytes=None)
+    for target in ('a', 'b', 't'):
+        cache.get_or_compute(graph, 's', target, (), lambda: 1.0)
+    assert len(cache) == 2
+    assert cache.stats()['evictions'] == 1
+
+    cache = MaxflowCache(max_entries=None, max_bytes=1)
+    cache.get_or_compute(graph, 's', 't', (), lambda: 1.0)
+    assert len(cache) == 0
+    assert cache.bytes == 0
+
+
+def test_default_cache_has_a_byte_budget():
+    assert MaxflowCache().max_bytes is not None
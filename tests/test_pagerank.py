@@ -0,0 +1,73 @@
+import networkx as nx
+import numpy as np
+import pytest
+
+from trust import ForwardPushPageRank, PersonalizedPageRank
+
+
+def edgeless_graph() -> nx.DiGraph:
+    graph = nx.DiGraph()
+    graph.add_nodes_from(range(4))
+    return graph
+
+
+def weighted_graph() -> nx.DiGraph:
+    graph = nx.DiGraph()
+    graph.add_weighted_edges_from([(0, 1, 3), (1, 2, 1), (2, 0, 2), (1, 3, 5), (3, 3, 1), (2, 4, 1)])
+    # 4 is dangling, 5 is isolated
+    graph.add_node(5)
+    return graph
+
+
+def nx_vector(graph: nx.DiGraph, seed_node) -> np.ndarray:
+    rank = nx.pagerank(graph, personalization={seed_node: 1.0}, tol=1.0e-10, max_iter=1000)
+    return np.array([rank[x] for x in graph], dtype=np.float64)
+
+
+@pytest.mark.parametrize('graph', [edgeless_graph(), weighted_graph()], ids=['edgeless', 'weighted'])
+@pytest.mark.parametrize('solver', ['power', 'gmres'])
+def test_matches_networkx(graph, solver):
+    trust = PersonalizedPageRank(graph, solver=solver, tol=1.0e-10, max_iter=1000)
+    for seed_node in graph:
+        assert trust.compute_all(seed_node) == pytest.approx(nx_vector(graph, seed_node), abs=1.0e-6)
+        assert trust.compute(seed_node, 0) == pytest.approx(nx_vector(graph, seed_node)[0], abs=1.0e-6)
+    expected = np.array([nx_vector(graph, seed_node) for seed_node in graph])
+    assert trust.compute_matrix(list(graph)) == pytest.approx(expected, abs=1.0e-6)
+
+
+def test_empty_graph():
+    graph = nx.DiGraph()
+    trust = PersonalizedPageRank(graph)
+    assert len(trust.compute_all(0)) == 0
+    assert trust.compute_matrix([0, 1]).shape == (2, 0)
+    assert len(nx.pagerank(graph)) == 0
+
+
+@pytest.mark.parametrize('versioned', [False, True])
+@pytest.mark.parametrize('graph', [nx.DiGraph(), edgeless_graph(), weighted_graph()],
+                         ids=['empty', 'edgeless', 'weighted'])
+def test_forward_push_matches_networkx(graph, versioned):
+    # Unversioned graphs are pushed over their dicts, versioned ones over the CSR snapshot
+    graph = graph.copy()
+    if versioned:
+        graph.graph['version'] = 0
+    trust = ForwardPushPageRank(graph, epsilon=1.0e-9)
+    for seed_node in graph:
+        assert trust.compute_all(seed_node) == pytest.approx(nx_vector(graph, seed_node), abs=1.0e-6)
+        assert trust.compute(seed_node, 0) == pytest.approx(nx_vector(graph, seed_node)[0], abs=1.0e-6)
+    assert len(trust.compute_all(0)) == len(graph)
+
+
+@pytest.mark.parametrize('versioned', [False, True])
+def test_forward_push_follows_graph_changes(versioned):
+    graph = weighted_graph()
+    if versioned:
+        graph.graph['version'] = 0
+    trust = ForwardPushPageRank(graph, epsilon=1.0e-9)
+    trust.compute_all(0)
+    graph[1][3]['weight'] = 1
+    graph.add_edge(4, 5, weight=2)
+    if versioned:
+        graph.graph['version'] += 1
+    assert trust.compute_all(0) == pytest.approx(nx_vector(graph, 0), abs=1.0e-6)
+    assert trust.compute(0, 5) == pytest.approx(nx_vector(graph, 0)[5], abs=1.0e-6)
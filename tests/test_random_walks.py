@@ -0,0 +1,221 @@
+from math import ceil
+
+import networkx as nx
+import numpy as np
+import pytest
+
+from conftest import ring_graph
+from trust import BiasStrategies, PersonalizedHittingTime, RandomWalks, TrustRank
+
+
+@pytest.mark.parametrize('batch', [False, True])
+def test_random_seed_gives_the_same_walks_with_and_without_executor(executor, batch):
+    graph = ring_graph()
+    local = RandomWalks(graph, retain_walks=False, random_seed=7)
+    local.run(0, 10000, batch=batch)
+    parallel = RandomWalks(graph, retain_walks=False, random_seed=7)
+    parallel.run(0, 10000, batch=batch, executor=executor)
+    assert (local.counters[0].counts == parallel.counters[0].counts).all()
+    assert (local.hits[0].counts == parallel.hits[0].counts).all()
+
+
+def test_random_seed_makes_trust_functions_reproducible(executor):
+    graph = ring_graph()
+    first = TrustRank(graph, number_random_walks=5000, random_seed=42)
+    second = TrustRank(graph, number_random_walks=5000, random_seed=42, executor=executor)
+    assert [first.compute(0, t) for t in range(1, 12)] == [second.compute(0, t) for t in range(1, 12)]
+
+    first = PersonalizedHittingTime(graph, number_random_walks=5000, random_seed=3, retain_walks=True)
+    second = PersonalizedHittingTime(graph, number_random_walks=5000, random_seed=3, retain_walks=True)
+    assert [first.compute(0, t) for t in range(1, 12)] == [second.compute(0, t) for t in range(1, 12)]
+
+
+def test_update_keeps_tallies_on_their_nodes():
+    graph = nx.DiGraph()
+    graph.add_weighted_edges_from([('a', 'b', 1), ('b', 'c', 2), ('c', 'a', 1)])
+    trust = PersonalizedHittingTime(graph, seed_node='x', number_random_walks=5000, retain_walks=True,
+                                    random_seed=1)
+    # The seed joins the graph, so the node ids of the snapshot are not a prefix extension of the old ones
+    graph.add_edge('x', 'a', weight=1)
+    trust.update([('x', 'a')])
+    fresh = PersonalizedHittingTime(graph, seed_node='x', number_random_walks=5000, random_seed=1)
+    assert trust.compute('x', 'a') <= 1.0
+    assert trust.compute('x', 'a') == pytest.approx(fresh.compute('x', 'a'), abs=0.03)
+
+    walks = trust.random_walks
+    assert dict(walks.counters['x']) == dict(walks.random_walks['x'].visit_counts())
+    assert dict(walks.hits['x']) == dict(walks.random_walks['x'].hit_counts())
+
+
+def test_update_matches_a_fresh_run():
+    graph = ring_graph()
+    patched = RandomWalks(graph, random_seed=5)
+    patched.run(0, 20000, 0.2)
+    graph.add_edge(3, 7, weight=10)
+    graph.add_edge(11, 'new', weight=4)
+    patched.update([(3, 7), (11, 'new')])
+    fresh = RandomWalks(graph, random_seed=6)
+    fresh.run(0, 20000, 0.2)
+
+    assert dict(patched.counters[0]) == dict(patched.random_walks[0].visit_counts())
+    for node in graph:
+        assert patched.get_number_of_hits(0, node) / 20000 == \
+               pytest.approx(fresh.get_number_of_hits(0, node) / 20000, abs=0.02)
+
+
+def expected_visits(graph: nx.DiGraph, seed_node, reset_probability: float, back_random_walk: bool,
+                    alpha=None) -> np.ndarray:
+    """Exact expected visits of a walk from seed_node that makes another step with probability 1 - reset."""
+    weights = nx.to_numpy_array(graph, weight='weight')
+    if alpha is not None:
+        weights = np.maximum(alpha * weights - weights.T, 0)
+    if back_random_walk:
+        weights = weights.T
+    totals = weights.sum(axis=1, keepdims=True)
+    transitions = np.divide(weights, totals, out=np.zeros_like(weights), where=totals > 0)
+    start = np.zeros(len(graph))
+    start[list(graph).index(seed_node)] = 1.0
+    return np.linalg.solve((np.eye(len(graph)) - (1 - reset_probability) * transitions).T, start)
+
+
+@pytest.mark.parametrize('batch', [False, True])
+@pytest.mark.parametrize('back_random_walk', [False, True])
+@pytest.mark.parametrize('bias_strategy', [BiasStrategies.EDGE_WEIGHT, BiasStrategies.ALPHA_DIFF])
+def test_walks_follow_the_exact_visit_distribution(batch, back_random_walk, bias_strategy):
+    graph = ring_graph()
+    graph.add_edge(3, 'dangling', weight=4)
+    walks = RandomWalks(graph, alpha=2.0, random_seed=11)
+    walks.run(0, 40000, 0.3, back_random_walk, bias_strategy, batch=batch)
+    alpha = 2.0 if bias_strategy == BiasStrategies.ALPHA_DIFF else None
+    expected = expected_visits(graph, 0, 0.3, back_random_walk, alpha)
+    visits = np.array([walks.counters[0].get(node, 0) for node in graph]) / 40000
+    assert visits == pytest.approx(expected, abs=0.03)
+
+
+def test_streamed_tallies_match_stored_walks():
+    graph = ring_graph()
+    stored = RandomWalks(graph, random_seed=4)
+    stored.run(0, 10000, batch=True)
+    streamed = RandomWalks(graph, retain_walks=False, random_seed=4)
+    streamed.run(0, 10000, batch=True)
+    assert (stored.counters[0].counts == streamed.counters[0].counts).all()
+    assert (stored.hits[0].counts == streamed.hits[0].counts).all()
+
+    # The flat storage gives back the walks as node lists with the same tallies
+    walk_lists = list(stored.random_walks[0])
+    assert len(walk_lists) == 10000
+    assert all(walk[0] == 0 for walk in walk_lists)
+    assert sum(len(walk) for walk in walk_lists) == stored.counters[0].total()
+    assert sum(0 in walk for walk in walk_lists) == stored.hits[0][0]
+
+
+def test_run_until_starts_over_on_a_new_graph_version():
+    graph = nx.DiGraph(version=0)
+    graph.add_weighted_edges_from([(0, 1, 100), (0, 2, 1)])
+    walks = RandomWalks(graph, random_seed=2)
+    walks.run_until(0, 0.02)
+    graph[0][1]['weight'], graph[0][2]['weight'] = 1, 100
+    graph.graph['version'] += 1
+    used = walks.run_until(0, 0.02)
+    assert used == walks.number_of_walks[0]
+    assert walks.get_number_of_hits(0, 1) / used == pytest.approx(0.01, abs=0.02)
+    assert walks.get_number_of_hits(0, 2) / used == pytest.approx(0.66, abs=0.04)
+
+
+def test_run_until_continues_only_with_the_same_penalties():
+    graph = ring_graph()
+    graph.graph['version'] = 0
+    walks = RandomWalks(graph, random_seed=2)
+    first = walks.run_until(0, 0.02, targets=[1], round_size=500)
+    assert walks.run_until(0, 0.02, targets=[1], round_size=500) == first
+    walks.run_until(0, 0.05, targets=[1], round_size=500, penalties={1: 3})
+    assert walks.run_params[0]['penalties'] == {1: 3}
+    assert walks.number_of_walks[0] < first
+
+
+def scanned_penalties(walks: list, target, value: float) -> dict:
+    """Penalties of one target by a scan over every walk as a list of nodes."""
+    encounters = {}
+    for walk in walks:
+        for v in (i for i, x in enumerate(walk) if x == target):
+            for node in walk[1:v + 1]:
+                encounters[node] = encounters.get(node, 0) + 1
+    return {node: ceil(value * count / encounters[target]) for node, count in encounters.items()}
+
+
+def test_penalties_match_a_scan_of_the_walks():
+    graph = ring_graph()
+    graph.add_edge(4, 'dangling', weight=3)
+    walks = RandomWalks(graph, random_seed=8)
+    walks.run(0, 3000, 0.1)
+    walk_lists = list(walks.random_walks[0])
+    values = {1: 7, 5: 2.5, 0: 4, 'dangling': 11, 'missing': 3}
+
+    expected = {}
+    for target, value in values.items():
+        for node, penalty in scanned_penalties(walk_lists, target, value).items():
+            expected[node] = expected.get(node, 0) + penalty
+    assert dict(walks.compute_penalties(0, values)) == expected
+    assert dict(walks.compute_penalties(0, {5: 2.5})) == scanned_penalties(walk_lists, 5, 2.5)
+    assert dict(walks.compute_penalties(0, {'missing': 3})) == {}
+
+
+@pytest.mark.parametrize('versioned', [False, True])
+def test_bounded_walks_use_every_edge_up_to_its_weight(versioned):
+    graph = ring_graph()
+    if versioned:
+        graph.graph['version'] = 0
+    walks = RandomWalks(graph, alpha=2.0, base_number_random_walks=3, random_seed=9)
+    penalties = {5: 2, 7: 5}
+    if versioned:
+        # Fenwick trees over the open edges of the snapshot
+        walks.run(0, 3000, 0.2, bias_strategy=BiasStrategies.EDGE_WEIGHT_BOUNDED, penalties=penalties)
+    else:
+        # Single walks over the adjacency dicts with edge_weight_bounded
+        walks.penalties = penalties
+        for _ in range(3000):
+            walks.run_one_walk(0, 0.2, bias_strategy=BiasStrategies.EDGE_WEIGHT_BOUNDED)
+
+    # Every edge is open until its walks and the penalty walks of its target reach base * weight
+    for u, v, weight in graph.edges(data='weight'):
+        capacity = max(3 * weight - 3 * int(penalties.get(v, 0) / 2.0), 0)
+        assert walks.num_edge_walks.get((u, v), 0) <= capacity
+    # The walks far outnumber the capacities, so the edges out of the seed are used up
+    for _, v, weight in graph.out_edges(0, data='weight'):
+        assert walks.num_edge_walks[(0, v)] == 3 * weight - 3 * int(penalties.get(v, 0) / 2.0)
+
+
+def exact_hit_probability(graph: nx.DiGraph, seed_node, target_node, reset_probability: float,
+                          back_random_walk: bool = False, alpha=None) -> float:
+    """Probability that a walk from the seed visits the target, v(s, t) / v(t, t) of the expected visits v."""
+    target = list(graph).index(target_node)
+    return expected_visits(graph, seed_node, reset_probability, back_random_walk, alpha)[target] \
+        / expected_visits(graph, target_node, reset_probability, back_random_walk, alpha)[target]
+
+
+@pytest.mark.parametrize('back_random_walk', [False, True])
+@pytest.mark.parametrize('bias_strategy', [BiasStrategies.EDGE_WEIGHT, BiasStrategies.ALPHA_DIFF])
+def test_bidirectional_estimates_match_the_exact_values(back_random_walk, bias_strategy):
+    graph = ring_graph()
+    graph.add_edge(3, 'dangling', weight=4)
+    graph.graph['version'] = 0
+    alpha = 2.0 if bias_strategy == BiasStrategies.ALPHA_DIFF else None
+    walks = RandomWalks(graph, alpha=2.0, random_seed=12)
+    params = dict(reset_probability=0.3, back_random_walk=back_random_walk, bias_strategy=bias_strategy,
+                  relative_error=0.02, residual_threshold=1.0e-2)
+    expected = expected_visits(graph, 0, 0.3, back_random_walk, alpha)
+    for target in [0, 2, 6, 'dangling']:
+        assert walks.estimate_visits(0, target, **params) == \
+               pytest.approx(expected[list(graph).index(target)], rel=0.06, abs=1.0e-3)
+        assert walks.estimate_hit_probability(0, target, **params) == \
+               pytest.approx(exact_hit_probability(graph, 0, target, 0.3, back_random_walk, alpha),
+                             rel=0.06, abs=1.0e-3)
+
+
+def test_bidirectional_trust_rank_matches_the_exact_values():
+    graph = ring_graph()
+    trust = TrustRank(graph, number_random_walks=50000, random_seed=5, bidirectional=True, relative_error=0.02)
+    expected = [exact_hit_probability(graph, 0, t, 0.33) - exact_hit_probability(graph, 0, t, 0.33, True)
+                for t in range(1, 12)]
+    assert trust.compute_many(0, list(range(1, 12))) == pytest.approx(expected, abs=0.02)
+    assert trust.compute(0, 4) == pytest.approx(expected[3], abs=0.02)
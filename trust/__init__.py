@@ -1,8 +1,9 @@
 from .maxflow_based import BarterCast, RawBarterCast, PenaltyCast, BoundedBarterCast, MaxFlow
 from .hitting_time import PersonalizedHittingTime, BiasedPHT
 from .maxflow_based import Netflow
-from .pagerank import PersonalizedPageRank
+from .pagerank import PersonalizedPageRank, ForwardPushPageRank
 from .pagerank import TrustRank
 from .random_walks import RandomWalks, BiasStrategies
 from .pagerank import ReciprocalScaledPageRank, SBPPageRank, WBPPageRank
 from .hitting_time import RSBHittingTime, BiasedRSBHittingTime
+from .all_pairs import AllPairsScores
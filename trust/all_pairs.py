@@ -0,0 +1,163 @@
+"""
+All-pairs score matrices of the trust functions, computed in tiles of seed rows into a memory-mapped file.
+The matrix never has to fit in memory, and an interrupted computation continues with the tiles it did not finish.
+"""
+import hashlib
+import inspect
+import json
+import os
+from concurrent.futures import Executor, as_completed
+from typing import Dict, List, Optional, Tuple, Type
+
+import networkx as nx
+import numpy as np
+
+from .csr_graph import CSRGraph, graph_nodes, graph_version
+
+
+class AllPairsScores:
+
+    def __init__(self, graph: nx.DiGraph, trust_function: Type, path: str, tile_size: int = 256,
+                 executor: Optional[Executor] = None, **params) -> None:
+        """Score matrix of a trust function over all pairs of nodes, stored as float32 in a numpy.memmap file.
+        Row i holds the scores from seed nodes[i] to every node, columns in the same node order, see graph_nodes.
+        The rows are computed in tiles of tile_size seeds with compute_all, or with compute_matrix where the trust
+        function has it. The end row of every finished tile is recorded in the file path + '.tiles', so a computation
+        that was interrupted resumes with the first unfinished tile. The file path + '.json' describes the computation
+        (trust function, parameters, tile size and a digest of the graph), and files of a different computation are
+        never resumed or overwritten.
+        @param graph: networkx directed graph, or igraph graph for trust functions that take one
+        @param trust_function: trust function class, e.g. BoundedBarterCast
+        @param path: file of the score matrix
+        @param tile_size: The number of seed rows per tile (default: 256).
+        @param executor: Process pool to compute the tiles on, one task per tile (default: None).
+        @param params: Parameters of the trust function.
+        """
+        self.graph = graph
+        self.trust_function = trust_function
+        self.path = path
+        self.tile_size = tile_size
+        self.executor = executor
+        self.params = params
+
+        self.nodes = graph_nodes(graph)
+
+    @property
+    def tiles_path(self) -> str:
+        return self.path + '.tiles'
+
+    @property
+    def header_path(self) -> str:
+        return self.path + '.json'
+
+    @property
+    def shape(self) -> Tuple[int, int]:
+        return len(self.nodes), len(self.nodes)
+
+    def tiles(self) -> List[Tuple[int, int]]:
+        """Start and end row of every tile."""
+        n = len(self.nodes)
+        return [(start, min(start + self.tile_size, n)) for start in range(0, n, self.tile_size)]
+
+    def header(self) -> Dict:
+        """Description of the computation, a resumed matrix must have been started with the same one."""
+        trust_function = '%s.%s' % (self.trust_function.__module__, self.trust_function.__qualname__)
+        # Parameters that are not plain values, like an executor or a cache, only count by their type
+        params = json.loads(json.dumps(self.params, sort_keys=True, default=lambda x: type(x).__qualname__))
+        version = graph_version(self.graph) if isinstance(self.graph, nx.Graph) else None
+        return dict(trust_function=trust_function, params=params, tile_size=self.tile_size, shape=list(self.shape),
+                    graph=_graph_digest(self.graph), graph_version=None if version is None else repr(version))
+
+    def _open(self) -> np.ndarray:
+        """The end rows of the finished tiles, starting over if the files of this computation are incomplete.
+        @raise ValueError: if the files belong to another computation
+        """
+        header = self.header()
+        if os.path.exists(self.header_path):
+            with open(self.header_path) as f:
+                stored = json.load(f)
+            if stored != header:
+                changed = sorted(k for k in set(header) | set(stored) if header.get(k) != stored.get(k))
+                raise ValueError('%s holds the scores of another computation (%s differ), remove it or choose another '
+                                 'path' % (self.path, ', '.join(changed)))
+            size = int(np.prod(self.shape)) * np.dtype(np.float32).itemsize
+            if os.path.exists(self.path) and os.path.getsize(self.path) == size and os.path.exists(self.tiles_path):
+                finished = np.load(self.tiles_path, allow_pickle=False)
+                if len(finished) == len(self.tiles()):
+                    return finished
+        elif os.path.exists(self.path) or os.path.exists(self.tiles_path):
+            raise ValueError('%s has no description of its computation in %s, remove it or choose another path'
+                             % (self.path, self.header_path))
+
+        # The description comes first, so that incomplete files of this computation are recognized and started over
+        with open(self.header_path + '.tmp', 'w') as f:
+            json.dump(header, f)
+        os.replace(self.header_path + '.tmp', self.header_path)
+        np.memmap(self.path, dtype=np.float32, mode='w+', shape=self.shape).flush()
+        finished = np.zeros(len(self.tiles()), dtype=np.int64)
+        np.save(self.tiles_path, finished, allow_pickle=False)
+        os.replace(self.tiles_path + '.npy', self.tiles_path)
+        return finished
+
+    def _mark_finished(self, finished: np.ndarray, tile: int, end: int) -> None:
+        finished[tile] = end
+        # Written to a temporary file first, so that an interruption never leaves a broken record behind
+        np.save(self.tiles_path + '.tmp', finished, allow_pickle=False)
+        os.replace(self.tiles_path + '.tmp.npy', self.tiles_path)
+
+    def pending_tiles(self) -> List[int]:
+        """Tiles that are not finished yet."""
+        finished = self._open()
+        return [tile for tile, (_, end) in enumerate(self.tiles()) if finished[tile] != end]
+
+    def compute(self) -> np.memmap:
+        """Compute the unfinished tiles of the score matrix.
+        @return: the score matrix, memory-mapped read-only
+        """
+        finished = self._open()
+        tiles = self.tiles()
+        pending = [tile for tile, (_, end) in enumerate(tiles) if finished[tile] != end]
+        if self.executor is None:
+            for tile in pending:
+                _compute_tile(self.graph, self.trust_function, self.params, self.path, self.shape, self.nodes,
+                              *tiles[tile])
+                self._mark_finished(finished, tile, tiles[tile][1])
+        else:
+            futures = {self.executor.submit(_compute_tile, self.graph, self.trust_function, self.params, self.path,
+                                            self.shape, self.nodes, *tiles[tile]): tile for tile in pending}
+            for future in as_completed(futures):
+                future.result()
+                self._mark_finished(finished, futures[future], tiles[futures[future]][1])
+        return np.memmap(self.path, dtype=np.float32, mode='r', shape=self.shape)
+
+
+def _compute_tile(graph: nx.DiGraph, trust_function: Type, params: Dict, path: str, shape: Tuple[int, int],
+                  nodes: List, start: int, end: int) -> None:
+    seed_nodes = nodes[start:end]
+    if 'seed_node' in inspect.signature(trust_function).parameters and 'seed_node' not in params:
+        # Trust functions that are built around a seed start with the first seed of the tile
+        params = dict(params, seed_node=seed_nodes[0])
+    trust = trust_function(graph, **params)
+
+    matrix = np.memmap(path, dtype=np.float32, mode='r+', shape=shape)
+    rows = matrix[start:end]
+    if hasattr(trust, 'compute_matrix'):
+        trust.compute_matrix(seed_nodes, out=rows)
+    else:
+        for row, seed_node in enumerate(seed_nodes):
+            rows[row] = trust.compute_all(seed_node)
+    matrix.flush()
+
+
+def _graph_digest(graph) -> str:
+    """SHA-256 of the nodes, edges and weights of a networkx or igraph graph."""
+    digest = hashlib.sha256()
+    if isinstance(graph, nx.Graph):
+        csr = CSRGraph.frozen(graph)
+        digest.update(repr(csr.nodes).encode())
+        for array in (csr.forward.offsets, csr.forward.indices, csr.forward.weights):
+            digest.update(np.ascontiguousarray(array).tobytes())
+    else:
+        digest.update(repr((graph.vcount(), graph.get_edgelist(),
+                            graph.es['weight'] if 'weight' in graph.es.attributes() else None)).encode())
+    return digest.hexdigest()
@@ -0,0 +1,460 @@
+"""
+Frozen compressed sparse row (CSR) snapshots of networkx work graphs.
+The snapshot replaces per-step networkx dict lookups in the trust functions with flat NumPy arrays.
+"""
+import weakref
+from abc import ABC, abstractmethod
+from typing import Hashable, List, Optional, Tuple
+
+import networkx as nx
+import numpy as np
+import scipy.sparse as sp
+from scipy.sparse.csgraph import breadth_first_order
+
+
+def graph_version(graph: nx.DiGraph) -> Optional[Hashable]:
+    """Version tag of a graph, the explicit 'version' counter in its graph attributes.
+    WorkGraphStorage maintains the counter of its graphs, any other owner has to bump it on every change.
+    Graphs without the counter have no version: an in-place change cannot be detected cheaply, so nothing
+    derived from them (snapshots, conversions, cached maxflows) is reused between calls.
+    @param graph: networkx directed graph
+    @return: hashable version tag that changes whenever the graph changes, None if the graph has none
+    """
+    return graph.graph.get('version')
+
+
+def is_current(version: Optional[Hashable], graph: nx.DiGraph) -> bool:
+    """Whether data derived from a graph at the given version is still up to date, never for unversioned graphs."""
+    return version is not None and version == graph_version(graph)
+
+
+class AliasTable:
+
+    def __init__(self, offsets: np.ndarray, weights: np.ndarray) -> None:
+        """Vose alias tables for O(1) sampling of an edge out of a node, proportional to the edge weights.
+        The table of a row is built the first time the row is sampled from.
+        @param offsets: row offsets of the adjacency
+        @param weights: float64 edge weights aligned with the adjacency indices
+        """
+        self.offsets = offsets
+        self.weights = weights
+        self.prob = np.ones(len(weights), dtype=np.float64)
+        self.alias = np.arange(len(weights), dtype=np.int64)
+        self.built = np.zeros(len(offsets) - 1, dtype=bool)
+
+    def build(self, nodes: np.ndarray) -> None:
+        """Build the tables of the given rows that are not built yet."""
+        for node in np.unique(nodes[~self.built[nodes]]):
+            self._build_row(int(node))
+
+    def _build_row(self, node: int) -> None:
+        start, end = int(self.offsets[node]), int(self.offsets[node + 1])
+        self.built[node] = True
+        total = self.weights[start:end].sum()
+        if total <= 0:
+            return
+        scaled = (self.weights[start:end] * ((end - start) / total)).tolist()
+        small = [i for i, p in enumerate(scaled) if p < 1]
+        large = [i for i, p in enumerate(scaled) if p >= 1]
+        while small and large:
+            less, more = small.pop(), large[-1]
+            self.prob[start + less] = scaled[less]
+            self.alias[start + less] = start + more
+            scaled[more] += scaled[less] - 1
+            if scaled[more] < 1:
+                small.append(large.pop())
+        # Whatever is left over is 1 up to rounding errors, prob and alias keep their defaults
+
+    def sample(self, node: int, rng) -> int:
+        """Sample the position in the adjacency of one edge out of a node with at least one positive weight.
+        @param rng: random.Random like generator
+        """
+        if not self.built[node]:
+            self._build_row(node)
+        start = self.offsets[node]
+        k = start + int(rng.random() * (self.offsets[node + 1] - start))
+        return k if rng.random() < self.prob[k] else int(self.alias[k])
+
+    def sample_many(self, nodes: np.ndarray, rng: np.random.Generator) -> np.ndarray:
+        """Vectorized version of sample, one edge out of every given node."""
+        self.build(nodes)
+        start = self.offsets[nodes].astype(np.int64)
+        k = start + (rng.random(len(nodes)) * (self.offsets[nodes + 1] - start)).astype(np.int64)
+        return np.where(rng.random(len(nodes)) < self.prob[k], k, self.alias[k])
+
+
+class FenwickRows:
+
+    def __init__(self, offsets: np.ndarray, weights: np.ndarray) -> None:
+        """One Fenwick tree per row over changing edge weights, for O(log degree) sampling and updates.
+        The tree of a row is built the first time the row is used.
+        @param offsets: row offsets of the adjacency
+        @param weights: float64 initial edge weights aligned with the adjacency indices, updated in place by set
+        """
+        self.offsets = offsets
+        self.weights = weights
+        self.tree = np.zeros(len(weights), dtype=np.float64)
+        self.totals = np.zeros(len(offsets) - 1, dtype=np.float64)
+        # Exact number of edges with a positive weight, the float totals may keep rounding errors
+        self.positive = np.zeros(len(offsets) - 1, dtype=np.int64)
+        self.built = np.zeros(len(offsets) - 1, dtype=bool)
+
+    def _build_row(self, node: int) -> None:
+        start, end = int(self.offsets[node]), int(self.offsets[node + 1])
+        tree = self.weights[start:end].tolist()
+        for i in range(1, end - start + 1):
+            parent = i + (i & -i)
+            if parent <= end - start:
+                tree[parent - 1] += tree[i - 1]
+        self.tree[start:end] = tree
+        self.totals[node] = self.weights[start:end].sum()
+        self.positive[node] = np.count_nonzero(self.weights[start:end] > 0)
+        self.built[node] = True
+
+    def has_weight(self, node: int) -> bool:
+        """True if the row of the node has at least one edge with a positive weight."""
+        if not self.built[node]:
+            self._build_row(node)
+        return self.positive[node] > 0
+
+    def set(self, node: int, position: int, value: float) -> None:
+        """Change the weight of the edge at the given position in the row of the node."""
+        if not self.built[node]:
+            self._build_row(node)
+        start, size = int(self.offsets[node]), int(self.offsets[node + 1] - self.offsets[node])
+        delta = value - self.weights[position]
+        self.positive[node] += int(value > 0) - int(self.weights[position] > 0)
+        self.weights[position] = value
+        self.totals[node] += delta
+        i = position - start + 1
+        while i <= size:
+            self.tree[start + i - 1] += delta
+            i += i & -i
+
+    def find(self, node: int, value: float) -> int:
+        """Position of the first edge in the row whose prefix sum reaches the value, as np.searchsorted does."""
+        if not self.built[node]:
+            self._build_row(node)
+        start, size = int(self.offsets[node]), int(self.offsets[node + 1] - self.offsets[node])
+        position, step = 0, 1 << (size.bit_length() - 1)
+        while step:
+            if position + step <= size and self.tree[start + position + step - 1] < value:
+                position += step
+                value -= self.tree[start + position - 1]
+            step >>= 1
+        return start + min(position, size - 1)
+
+
+class CSRAdjacency:
+
+    def __init__(self, offsets: np.ndarray, indices: np.ndarray,
+                 weights: np.ndarray, back_weights: np.ndarray) -> None:
+        """Adjacency of one walk direction.
+        The neighbors of node i are indices[offsets[i]:offsets[i + 1]].
+        @param offsets: int32 row offsets, length number of nodes + 1
+        @param indices: int32 neighbor ids
+        @param weights: float64 weight of the edge taken when walking to the neighbor
+        @param back_weights: float64 weight of the opposite edge (0 if there is none)
+        """
+        self.offsets = offsets
+        self.indices = indices
+        self.weights = weights
+        self.back_weights = back_weights
+        self.sources = np.repeat(np.arange(len(offsets) - 1, dtype=np.int32), np.diff(offsets))
+        self.cum_weights = self.row_cumsum(weights)
+        self._alpha_diff = {}
+        self._alias = {}
+
+    def row_cumsum(self, weights: np.ndarray) -> np.ndarray:
+        """Cumulative sums of edge weights restarted at every row.
+        @param weights: float64 array aligned with indices
+        @return: array where the last entry of each row is the total weight of the row
+        """
+        # One cumsum over all edges, minus the running total before the start of every row
+        cum_weights = np.cumsum(weights)
+        return cum_weights - np.repeat(np.r_[0, cum_weights][self.offsets[:-1]], np.diff(self.offsets))
+
+    def alpha_diff(self, alpha: float) -> Tuple[np.ndarray, np.ndarray]:
+        """ALPHA_DIFF bias table max(alpha * w(u, v) - w(v, u), 0) of every edge, computed once per alpha.
+        The table lives as long as the snapshot, so it is shared by all seeds and invalidated with the graph version.
+        @param alpha: alpha of the bias
+        @return: the biased weights and their row cumulative sums
+        """
+        table = self._alpha_diff.get(alpha)
+        if table is None:
+            weights = np.maximum(alpha * self.weights - self.back_weights, 0)
+            table = self._alpha_diff[alpha] = (weights, self.row_cumsum(weights))
+        return table
+
+    def alias_table(self, alpha: Optional[float] = None) -> AliasTable:
+        """Lazily built alias table of the plain edge weights, or of the ALPHA_DIFF weights for the given alpha."""
+        table = self._alias.get(alpha)
+        if table is None:
+            weights = self.weights if alpha is None else self.alpha_diff(alpha)[0]
+            table = self._alias[alpha] = AliasTable(self.offsets, weights)
+        return table
+
+    def row_totals(self, cum_weights: np.ndarray, nodes: np.ndarray) -> np.ndarray:
+        """Total row weight of every given node, 0 for nodes without neighbors."""
+        start, end = self.offsets[nodes], self.offsets[nodes + 1]
+        totals = np.zeros(len(nodes), dtype=np.float64)
+        has_edges = end > start
+        totals[has_edges] = cum_weights[end[has_edges] - 1]
+        return totals
+
+    def strengths(self) -> np.ndarray:
+        """Total positive edge weight of every row, the out-strength of every node for the forward adjacency."""
+        return np.bincount(self.sources, weights=np.maximum(self.weights, 0), minlength=len(self.offsets) - 1)
+
+    def reachable(self, node: int) -> np.ndarray:
+        """Boolean mask of the nodes reachable from node over edges of positive weight, node included."""
+        n = len(self.offsets) - 1
+        positive = self.weights > 0
+        matrix = sp.csr_matrix((np.ones(int(positive.sum()), dtype=np.int8),
+                                (self.sources[positive], self.indices[positive])), shape=(n, n))
+        mask = np.zeros(n, dtype=bool)
+        mask[breadth_first_order(matrix, node, directed=True, return_predecessors=False)] = True
+        return mask
+
+    def degree(self, node: int) -> int:
+        return int(self.offsets[node + 1] - self.offsets[node])
+
+    def neighbors(self, node: int) -> np.ndarray:
+        return self.indices[self.offsets[node]:self.offsets[node + 1]]
+
+
+class CSRGraph:
+    _frozen = weakref.WeakKeyDictionary()
+
+    def __init__(self, graph: nx.DiGraph) -> None:
+        """Freeze a networkx graph into forward (successors) and reverse (predecessors) CSR arrays.
+        Nodes are mapped to integer ids in the graph iteration order.
+        @param graph: networkx directed graph with 'weight' edge attribute
+        """
+        self.version = graph_version(graph)
+        self.nodes: List = list(graph.nodes())
+        self.index = {n: i for i, n in enumerate(self.nodes)}
+        self.forward = self._adjacency(graph, reverse=False)
+        self.reverse = self._adjacency(graph, reverse=True)
+        self._transition = None
+
+    @classmethod
+    def frozen(cls, graph: nx.DiGraph) -> 'CSRGraph':
+        """Get the CSR snapshot of a graph, rebuilding it only when the graph version changed.
+        A graph without a version gets a new snapshot on every call, see graph_version.
+        @param graph: networkx directed graph
+        @return: CSR snapshot shared by every user of the graph
+        """
+        if graph_version(graph) is None:
+            return cls(graph)
+        csr = cls._frozen.get(graph)
+        if csr is None or not is_current(csr.version, graph):
+            csr = cls(graph)
+            cls._frozen[graph] = csr
+        return csr
+
+    def __len__(self) -> int:
+        return len(self.nodes)
+
+    def adjacency(self, back_random_walk: bool = False) -> CSRAdjacency:
+        return self.reverse if back_random_walk else self.forward
+
+    def transition_matrix(self) -> Tuple[sp.csr_matrix, np.ndarray]:
+        """Column-stochastic transition matrix of the forward edges, built once per snapshot.
+        Entry (v, u) is w(u, v) / out-weight(u). Columns of nodes without out-weight are zero.
+        @return: the sparse matrix and the boolean mask of the dangling nodes
+        """
+        if self._transition is None:
+            adj = self.forward
+            # bincount returns int64 for a graph without edges
+            out_weights = np.bincount(adj.sources, weights=adj.weights,
+                                      minlength=len(self.nodes)).astype(np.float64)
+            dangling = out_weights == 0
+            scale = np.divide(1.0, out_weights, out=np.zeros_like(out_weights), where=~dangling)
+            matrix = sp.csr_matrix((adj.weights * scale[adj.sources], (adj.indices, adj.sources)),
+                                   shape=(len(self.nodes), len(self.nodes)))
+            self._transition = (matrix, dangling)
+        return self._transition
+
+    def _adjacency(self, graph: nx.DiGraph, reverse: bool) -> CSRAdjacency:
+        # adj[u][v] holds the data of the edge walked from u to v, back[u][v] the data of the opposite edge
+        adj, back_adj = (graph.pred, graph.succ) if reverse else (graph.succ, graph.pred)
+        offsets = np.zeros(len(self.nodes) + 1, dtype=np.int32)
+        indices, weights, back_weights = [], [], []
+        for i, u in enumerate(self.nodes):
+            for v, data in adj[u].items():
+                indices.append(self.index[v])
+                weights.append(data.get('weight', 1))
+                back = back_adj[u].get(v)
+                back_weights.append(0 if back is None else back.get('weight', 1))
+            offsets[i + 1] = len(indices)
+        return CSRAdjacency(offsets,
+                            np.array(indices, dtype=np.int32),
+                            np.array(weights, dtype=np.float64),
+                            np.array(back_weights, dtype=np.float64))
+
+
+class NodeStrengths:
+
+    def __init__(self, graph: nx.DiGraph, capacity: int = 64) -> None:
+        """Weighted out- and in-strength of every node of a graph, kept up to date edge by edge.
+        The owner of the graph reports every weight change through add_weight, which costs O(1) amortized.
+        Use attach to build the strengths of a graph and publish them in its 'strengths' graph attribute.
+        @param graph: the networkx directed graph the strengths belong to
+        @param capacity: initial length of the strength arrays, they double when full (default: 64).
+        """
+        # Copies of the graph share its graph attributes, the reference tells them apart from the graph itself
+        self._graph = weakref.ref(graph)
+        self.nodes: List = []
+        self.index = {}
+        self._out = np.zeros(capacity, dtype=np.float64)
+        self._in = np.zeros(capacity, dtype=np.float64)
+
+    @classmethod
+    def attach(cls, graph: nx.DiGraph) -> 'NodeStrengths':
+        """Strengths of the current edges of a graph, stored in its 'strengths' graph attribute."""
+        strengths = cls(graph)
+        for node in graph.nodes():
+            strengths._node_id(node)
+        for u, v, weight in graph.edges(data='weight', default=1):
+            strengths.add_weight(u, v, weight)
+        graph.graph['strengths'] = strengths
+        return strengths
+
+    def belongs_to(self, graph: nx.DiGraph) -> bool:
+        return self._graph is not None and self._graph() is graph
+
+    def __getstate__(self) -> dict:
+        # A pickled graph is a different object, its strengths are not trusted after loading
+        state = dict(self.__dict__)
+        state['_graph'] = None
+        return state
+
+    def _node_id(self, node: Hashable) -> int:
+        i = self.index.get(node)
+        if i is None:
+            i = self.index[node] = len(self.nodes)
+            self.nodes.append(node)
+            if i == len(self._out):
+                self._out = np.concatenate((self._out, np.zeros_like(self._out)))
+                self._in = np.concatenate((self._in, np.zeros_like(self._in)))
+        return i
+
+    def add_weight(self, u: Hashable, v: Hashable, delta: float) -> None:
+        """Account for the weight of the edge from u to v growing by delta (negative if it shrank)."""
+        self._out[self._node_id(u)] += delta
+        self._in[self._node_id(v)] += delta
+
+    def out_strength(self, node: Hashable) -> float:
+        i = self.index.get(node)
+        return 0.0 if i is None else float(self._out[i])
+
+    def in_strength(self, node: Hashable) -> float:
+        i = self.index.get(node)
+        return 0.0 if i is None else float(self._in[i])
+
+    def arrays(self, nodes: List) -> Tuple[np.ndarray, np.ndarray]:
+        """Out- and in-strengths of the given nodes, 0 for unknown nodes."""
+        return _select(self.index, self._out, self._in, nodes)
+
+
+def _select(index: dict, out_strengths: np.ndarray, in_strengths: np.ndarray,
+            nodes: List) -> Tuple[np.ndarray, np.ndarray]:
+    ids = np.fromiter((index.get(node, -1) for node in nodes), dtype=np.int64, count=len(nodes))
+    known = ids >= 0
+    result = np.zeros(len(nodes)), np.zeros(len(nodes))
+    result[0][known], result[1][known] = out_strengths[ids[known]], in_strengths[ids[known]]
+    return result
+
+
+def _attached_strengths(graph: nx.DiGraph) -> Optional[NodeStrengths]:
+    strengths = graph.graph.get('strengths')
+    return strengths if strengths is not None and strengths.belongs_to(graph) else None
+
+
+def out_strength(graph: nx.DiGraph, node: Hashable) -> float:
+    """Weighted out-degree of a node, read from the attached NodeStrengths if the graph has them.
+    Zero for a node that is not in the graph.
+    """
+    strengths = _attached_strengths(graph)
+    if strengths is None:
+        return graph.out_degree(node, weight='weight') if node in graph else 0.0
+    return strengths.out_strength(node)
+
+
+def in_strength(graph: nx.DiGraph, node: Hashable) -> float:
+    """Weighted in-degree of a node, read from the attached NodeStrengths if the graph has them.
+    Zero for a node that is not in the graph.
+    """
+    strengths = _attached_strengths(graph)
+    if strengths is None:
+        return graph.in_degree(node, weight='weight') if node in graph else 0.0
+    return strengths.in_strength(node)
+
+
+def node_strengths(graph: nx.DiGraph, nodes: Optional[List] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """Weighted out- and in-degrees of many nodes at once.
+    Read from the attached NodeStrengths if the graph has them, otherwise summed over the CSR snapshot.
+    @param graph: networkx directed graph
+    @param nodes: the nodes, all nodes of the graph in graph order if none (default: None).
+    @return: out- and in-strength arrays aligned with the nodes
+    """
+    if nodes is None:
+        nodes = list(graph.nodes())
+    strengths = _attached_strengths(graph)
+    if strengths is not None:
+        return strengths.arrays(nodes)
+    csr = CSRGraph.frozen(graph)
+    out_strengths = np.bincount(csr.forward.sources, weights=csr.forward.weights, minlength=len(csr))
+    in_strengths = np.bincount(csr.reverse.sources, weights=csr.reverse.weights, minlength=len(csr))
+    return _select(csr.index, out_strengths, in_strengths, nodes)
+
+
+class NetContribMixin(ABC):
+    """net_contrib and its vectorized form for trust functions that scale by the strengths of a node.
+    Subclasses define the formula _net_contrib(out_strength, in_strength), elementwise for arrays.
+    """
+    graph: nx.DiGraph
+
+    @abstractmethod
+    def _net_contrib(self, out_deg, in_deg):
+        """Net contribution of nodes with the given out- and in-strengths."""
+
+    def net_contrib(self, node: Hashable) -> float:
+        return self._net_contrib(out_strength(self.graph, node), in_strength(self.graph, node))
+
+    def net_contribs(self, nodes: Optional[List] = None) -> np.ndarray:
+        """Net contribution of many nodes at once, all nodes of the graph in graph order if none (default: None)."""
+        return self._net_contrib(*node_strengths(self.graph, nodes))
+
+
+def graph_nodes(graph) -> List:
+    """Nodes of a networkx graph in graph order (the node ids of the CSR snapshot), vertex ids of an igraph graph."""
+    if isinstance(graph, nx.Graph):
+        return list(graph.nodes())
+    return list(range(graph.vcount()))
+
+
+class BatchComputeMixin:
+    """compute_many and compute_all for trust functions that score one target at a time with compute.
+    The default calls compute once per target, trust functions override compute_many with a batched form.
+    """
+    graph: nx.DiGraph
+
+    def node_index(self) -> List:
+        """The nodes scored by compute_all, see graph_nodes."""
+        return graph_nodes(self.graph)
+
+    def compute_many(self, seed_node: Hashable, target_nodes: List) -> np.ndarray:
+        """Scores of many target nodes at once.
+        @param seed_node: The seed node.
+        @param target_nodes: The target nodes.
+        @return: float64 array aligned with target_nodes
+        """
+        target_nodes = list(target_nodes)
+        return np.fromiter((self.compute(seed_node, target) for target in target_nodes),
+                           dtype=np.float64, count=len(target_nodes))
+
+    def compute_all(self, seed_node: Hashable) -> np.ndarray:
+        """Scores of every node of the graph, aligned with node_index."""
+        return self.compute_many(seed_node, self.node_index())
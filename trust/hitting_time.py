@@ -5,67 +5,129 @@ Based on the ideas described in:
 https://dash.harvard.edu/bitstream/handle/1/33009675/liu_aamas16.pdf?sequence=1
 """
 from collections import defaultdict
-from math import ceil
+from concurrent.futures import Executor
+from typing import List, Optional
 
 import networkx as nx
+import numpy as np
 
+from .csr_graph import BatchComputeMixin, NetContribMixin
 from .random_walks import RandomWalks, BiasStrategies
 
 
-class PersonalizedHittingTime:
+class PersonalizedHittingTime(BatchComputeMixin):
 
     def __init__(self, graph: nx.Graph, seed_node: int = None, number_random_walks: int = 10000,
-                 reset_probability: float = 0.1) -> None:
+                 reset_probability: float = 0.1, executor: Optional[Executor] = None,
+                 random_seed: Optional[int] = None, retain_walks: bool = False,
+                 epsilon: Optional[float] = None, confidence: float = 0.95, top_k: Optional[int] = None) -> None:
         """This class implements a Monte Carlo implementation of the hitting time algorithm
         by running random walks in a networkx graph.
         @param graph: The networkx graph to run the random walks on.
         @param seed_node: The node to start the random walks from.
-        @param number_random_walks: The number of random walks to run.
+        @param number_random_walks: The number of random walks to run. In adaptive mode the maximum number of walks.
         @param reset_probability: The probability of resetting the random walk.
+        @param executor: Process pool to run the walks on (default: None).
+        @param random_seed: Seed of the RNG streams of the walks (default: None).
+        @param retain_walks: Keep the walks so that update() patches them instead of running them again (default: False).
+        @param epsilon: If set, run walks in rounds until the confidence intervals of the scores of the queried
+        target (or of the top_k nodes) are at most epsilon wide on each side (default: None).
+        @param confidence: The confidence level of the adaptive mode (default: 0.95).
+        @param top_k: In adaptive mode, track the top k nodes instead of the queried target (default: None).
         """
         self.graph = graph
         self.number_random_walks = number_random_walks
         self.reset_probability = reset_probability
         self.seed_node = seed_node
-
-        self.random_walks = RandomWalks(self.graph)
-        self.random_walks.run(seed_node, int(self.number_random_walks), self.reset_probability)
-
-    def compute(self, seed_node: int, target_node: int) -> float:
-        if not self.random_walks.has_node(seed_node):
+        self.executor = executor
+        self.epsilon = epsilon
+        self.confidence = confidence
+        self.top_k = top_k
+
+        self.random_walks = RandomWalks(self.graph, retain_walks=retain_walks, random_seed=random_seed)
+        if self.epsilon is not None:
+            self._run_adaptive(seed_node, None)
+        else:
+            self.random_walks.run(seed_node, int(self.number_random_walks), self.reset_probability, batch=True,
+                                  executor=self.executor)
+
+    def _run_adaptive(self, seed_node: int, target_nodes: Optional[List]) -> None:
+        targets = None if target_nodes is None or self.top_k is not None else target_nodes
+        self.random_walks.run_until(seed_node, self.epsilon, self.confidence, targets=targets, top_k=self.top_k,
+                                    max_random_walks=int(self.number_random_walks), executor=self.executor,
+                                    reset_probability=self.reset_probability, batch=True)
+
+    def walks_used(self, seed_node: int) -> int:
+        """Number of random walks run from the seed node."""
+        return self.random_walks.number_of_walks.get(seed_node, 0)
+
+    def _prepare(self, seed_node: int, target_nodes: List) -> None:
+        if self.epsilon is not None:
+            self._run_adaptive(seed_node, target_nodes)
+        elif not self.random_walks.has_node(seed_node):
             self.random_walks.run(seed_node,
                                   int(self.number_random_walks),
-                                  self.reset_probability)
+                                  self.reset_probability,
+                                  batch=True,
+                                  executor=self.executor)
 
-        return self.random_walks.get_number_of_hits(seed_node, target_node) / self.number_random_walks
+    def compute(self, seed_node: int, target_node: int) -> float:
+        self._prepare(seed_node, [target_node])
+        return self.random_walks.get_number_of_hits(seed_node, target_node) / self.walks_used(seed_node)
 
+    def compute_many(self, seed_node: int, target_nodes: List) -> np.ndarray:
+        """Scores of many target nodes from the hit counts of one run, in adaptive mode all targets are tracked."""
+        target_nodes = list(target_nodes)
+        self._prepare(seed_node, target_nodes)
+        return self.random_walks.get_number_of_hits_many(seed_node, target_nodes) / self.walks_used(seed_node)
 
-class BiasedPHT:
+    def update(self, changed_edges) -> None:
+        """Update the walks after edges of the graph were added or changed, see RandomWalks.update."""
+        self.random_walks.update(changed_edges)
+
+
+class BiasedPHT(BatchComputeMixin):
     
     def __init__(self, graph: nx.Graph, seed_node: int = None, number_random_walks: int = 10000,
-                 reset_probability: float = 0.1, alpha: float = 1.0) -> None:
+                 reset_probability: float = 0.1, alpha: float = 1.0, executor: Optional[Executor] = None,
+                 random_seed: Optional[int] = None, retain_walks: bool = False) -> None:
         """This class implements a Monte Carlo implementation of the hitting time algorithm
         """
         self.graph = graph
         self.number_random_walks = number_random_walks
         self.reset_probability = reset_probability
         self.seed_node = seed_node
+        self.executor = executor
 
-        self.random_walks = RandomWalks(self.graph, alpha)
-        self.random_walks.run(seed_node, int(self.number_random_walks), self.reset_probability)
+        self.random_walks = RandomWalks(self.graph, alpha, retain_walks=retain_walks, random_seed=random_seed)
+        self.random_walks.run(seed_node, int(self.number_random_walks), self.reset_probability, batch=True,
+                              executor=self.executor)
 
-    def compute(self, seed_node: int, target_node: int) -> float:
+    def _prepare(self, seed_node: int) -> None:
         if not self.random_walks.has_node(seed_node):
             self.random_walks.run(seed_node,
                                   int(self.number_random_walks),
                                   self.reset_probability,
-                                  bias_strategy=BiasStrategies.ALPHA_DIFF
+                                  bias_strategy=BiasStrategies.ALPHA_DIFF,
+                                  batch=True,
+                                  executor=self.executor
                                   )
 
+    def compute(self, seed_node: int, target_node: int) -> float:
+        self._prepare(seed_node)
         return self.random_walks.get_number_of_hits(seed_node, target_node) / self.number_random_walks
 
+    def compute_many(self, seed_node: int, target_nodes: List) -> np.ndarray:
+        target_nodes = list(target_nodes)
+        self._prepare(seed_node)
+        return self.random_walks.get_number_of_hits_many(seed_node, target_nodes) / self.number_random_walks
 
-class RSBHittingTime:
+    def update(self, changed_edges) -> None:
+        """Update the walks after edges of the graph were added or changed, see RandomWalks.update."""
+        self.random_walks.update(changed_edges)
+
+
+class RSBHittingTime(NetContribMixin, BatchComputeMixin):
 
     def __init__(self, graph: nx.DiGraph,
                  base_number_random_walks: int = 10,
@@ -82,13 +144,12 @@ class RSBHittingTime:
         self.number_random_walks = base_number_random_walks
         self.reset_probability = reset_probability
 
-        self.random_walks = RandomWalks(self.graph, alpha, self.number_random_walks)
-
-    def net_contrib(self, node: int) -> float:
-        return min(self.graph.out_degree(node, weight='weight'), 1000)
+        self.random_walks = RandomWalks(self.graph, alpha, self.number_random_walks, retain_walks=False)
 
-    def compute(self, seed_node: int, target_node: int) -> float:
+    def _net_contrib(self, out_deg, in_deg):
+        return np.minimum(out_deg, 1000)
 
+    def _run_seed(self, seed_node: int) -> None:
         if not self.random_walks.has_node(seed_node):
             self.random_walks.run(seed_node,
                                   int(self.number_random_walks * self.net_contrib(seed_node)),
@@ -96,17 +157,29 @@ class RSBHittingTime:
                                   bias_strategy=BiasStrategies.EDGE_WEIGHT_BOUNDED
                                   )
 
-        if not self.random_walks.has_node(target_node):
-            self.random_walks.run(target_node,
-                                  int(self.number_random_walks * self.net_contrib(target_node)),
-                                  self.reset_probability,
-                                  bias_strategy=BiasStrategies.EDGE_WEIGHT_BOUNDED
-                                  )
+    def _run_target(self, target_node: int) -> None:
+        self._run_seed(target_node)
 
-        pr1 = self.random_walks.get_number_of_hits(seed_node, target_node)
-        pr2 = self.random_walks.get_number_of_hits(target_node, seed_node)
+    def _score(self, seed_node: int, target_nodes: List, pr1: np.ndarray, pr2: np.ndarray) -> np.ndarray:
         return pr1 / (1 + pr2)
 
+    def compute(self, seed_node: int, target_node: int) -> float:
+        return float(self.compute_many(seed_node, [target_node])[0])
+
+    def compute_many(self, seed_node: int, target_nodes: List) -> np.ndarray:
+        """Scores of many target nodes. The hits of the seed walks are read at once,
+        the hits of the seed on the walks of every target one by one.
+        """
+        target_nodes = list(target_nodes)
+        self._run_seed(seed_node)
+        for target_node in target_nodes:
+            self._run_target(target_node)
+
+        pr1 = self.random_walks.get_number_of_hits_many(seed_node, target_nodes)
+        pr2 = np.fromiter((self.random_walks.get_number_of_hits(x, seed_node) for x in target_nodes),
+                          dtype=np.float64, count=len(target_nodes))
+        return self._score(seed_node, target_nodes, pr1, pr2)
+
 
 class BiasedRSBHittingTime(RSBHittingTime):
 
@@ -129,21 +202,11 @@ class BiasedRSBHittingTime(RSBHittingTime):
         self.self_manage_penalties = self_manage_penalties
         self.alpha = 1.0
         super().__init__(graph, base_number_random_walks, reset_probability, alpha)
+        # Penalties are computed from the stored walks of the seed node
+        self.random_walks.retain_walks = True
 
     def calculate_penalty(self, s, t, value):
-        encounters = defaultdict(int)
-        penalties = defaultdict(int)
-        for k in self.random_walks.random_walks[s]:
-            indexes = [i for i, x in enumerate(k) if x == t]
-            if indexes:
-                start_val = 1
-                for v in indexes:
-                    for p in range(start_val, v + 1):
-                        encounters[k[p]] += 1
-        # calculate fractions
-        for k, v in encounters.items():
-            penalties[k] += ceil(value * v / encounters[t])
-        return penalties
+        return self.random_walks.compute_penalties(s, {t: value})
 
     def add_penalties(self, seed_node, penalties):
         self.penalties[seed_node] = penalties
@@ -151,16 +214,12 @@ class BiasedRSBHittingTime(RSBHittingTime):
     def get_penalties(self, seed_node):
         if seed_node not in self.penalties:
             self.penalties[seed_node] = defaultdict(int)
-        for e, _, w in self.graph.in_edges(seed_node, data=True):
-            pen = self.calculate_penalty(seed_node, e, w['weight'])
-            for k, v in pen.items():
-                self.penalties[seed_node][k] += v
+        in_weights = {e: w['weight'] for e, _, w in self.graph.in_edges(seed_node, data=True)}
+        for k, v in self.random_walks.compute_penalties(seed_node, in_weights).items():
+            self.penalties[seed_node][k] += v
         return self.penalties[seed_node]
 
-    def net_contrib(self, node: int) -> float:
-        return min(self.graph.out_degree(node, weight='weight'), 1000)
-
-    def compute(self, seed_node: int, target_node: int) -> float:
+    def _run_seed(self, seed_node: int) -> None:
         if not self.random_walks.has_node(seed_node):
             self.random_walks.run(seed_node,
                                   int(self.number_random_walks * self.net_contrib(seed_node)),
@@ -180,6 +239,7 @@ class BiasedRSBHittingTime(RSBHittingTime):
                                       update_weight=True
                                       )
 
+    def _run_target(self, target_node: int) -> None:
         if not self.random_walks.has_node(target_node):
             self.random_walks.run(target_node,
                                   int(self.number_random_walks * self.net_contrib(target_node)),
@@ -189,7 +249,9 @@ class BiasedRSBHittingTime(RSBHittingTime):
                                   update_weight=True
                                   )
 
-        penalty = 0.0 if not self.penalties.get(seed_node) else self.penalties[seed_node].get(target_node, 0)
-        pr1 = self.random_walks.get_number_of_hits(seed_node, target_node) - penalty/self.alpha
-        pr2 = self.random_walks.get_number_of_hits(target_node, seed_node)
+    def _score(self, seed_node: int, target_nodes: List, pr1: np.ndarray, pr2: np.ndarray) -> np.ndarray:
+        penalties = self.penalties.get(seed_node)
+        if penalties:
+            pr1 = pr1 - np.fromiter((penalties.get(target_node, 0) for target_node in target_nodes),
+                                    dtype=np.float64, count=len(target_nodes)) / self.alpha
         return pr1 - pr2
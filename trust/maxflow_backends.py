@@ -0,0 +1,489 @@
+"""
+Maxflow backends for the maxflow based trust functions.
+The igraph and scipy backends convert a networkx graph once per graph version, using the node ids of its CSR snapshot.
+All backends also accept an OverlayGraph, a networkx graph with changed capacities on the out-edges of one node.
+"""
+import sys
+import weakref
+from abc import ABC, abstractmethod
+from collections import OrderedDict, deque
+from itertools import chain, count
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple, Union
+
+import igraph as ig
+import networkx as nx
+import numpy as np
+import scipy.sparse as sp
+from scipy.sparse.csgraph import maximum_flow
+
+from .csr_graph import CSRGraph, graph_version, is_current
+
+
+class OverlayGraph:
+
+    def __init__(self, graph: nx.DiGraph, node: Hashable) -> None:
+        """Copy-on-write view of a graph in which the capacities of the out-edges of one node are shifted by deltas.
+        Only the deltas are stored, the maxflow backends apply them to their view of the base graph while computing.
+        Capacities that drop to zero or below remove the edge, as they do for the networkx maxflow.
+        @param graph: base networkx graph, it is not changed
+        @param node: node whose out-edge capacities are overlaid
+        """
+        self.graph = graph
+        self.node = node
+        self.deltas = {}
+        # Bumped on every change, part of the cache key together with the version of the base graph
+        self.version = 0
+
+    def add_delta(self, target: Hashable, delta: float) -> None:
+        """Shift the capacity of the edge from the overlaid node to target, ignored if there is no such edge."""
+        if target in self.graph.adj[self.node]:
+            self.deltas[target] = self.deltas.get(target, 0) + delta
+            self.version += 1
+
+    def weight(self, target: Hashable) -> float:
+        """Capacity of the edge from the overlaid node to target in the overlay."""
+        return self.graph.adj[self.node][target]['weight'] + self.deltas.get(target, 0)
+
+    def edge_positions(self, csr: CSRGraph) -> Tuple[np.ndarray, np.ndarray]:
+        """Positions of the overlaid edges in the forward adjacency of a snapshot of the base graph.
+        @return: edge positions and the overlay capacities of those edges, clipped at zero
+        """
+        s = csr.index.get(self.node)
+        if s is None or not self.deltas:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        start, end = csr.forward.offsets[s], csr.forward.offsets[s + 1]
+        row = dict(zip(csr.forward.indices[start:end].tolist(), range(start, end)))
+        targets = [(row[csr.index[v]], d) for v, d in self.deltas.items() if csr.index.get(v) in row]
+        positions = np.array([p for p, _ in targets], dtype=np.int64)
+        deltas = np.array([d for _, d in targets], dtype=np.float64)
+        return positions, np.maximum(csr.forward.weights[positions] + deltas, 0)
+
+
+def _base_graph(graph: Union[nx.DiGraph, OverlayGraph]) -> nx.DiGraph:
+    return graph.graph if isinstance(graph, OverlayGraph) else graph
+
+
+class MaxflowBackend(ABC):
+    name = None
+
+    def __getstate__(self) -> Dict:
+        # Conversions and kept flows belong to one process, a backend shipped to a worker starts without them
+        state = {k: v for k, v in self.__dict__.items() if not isinstance(v, weakref.WeakKeyDictionary)}
+        state['_per_process'] = [k for k, v in self.__dict__.items() if isinstance(v, weakref.WeakKeyDictionary)]
+        return state
+
+    def __setstate__(self, state: Dict) -> None:
+        for name in state.pop('_per_process'):
+            setattr(self, name, weakref.WeakKeyDictionary())
+        self.__dict__.update(state)
+
+    def maxflow_value(self, graph: nx.DiGraph, source: Hashable, sink: Hashable) -> float:
+        """Value of the maximum flow from source to sink with the 'weight' edge attribute as capacity."""
+        return self.maximum_flow(graph, source, sink)[0]
+
+    @abstractmethod
+    def maximum_flow(self, graph: nx.DiGraph, source: Hashable, sink: Hashable) -> Tuple[float, Dict]:
+        """Maximum flow from source to sink with the 'weight' edge attribute as capacity.
+        @return: the flow value and the total outgoing flow of every node
+        """
+
+
+class NetworkxBackend(MaxflowBackend):
+    name = 'networkx'
+
+    def __init__(self) -> None:
+        # Residual networks of the base graphs of overlays, reused by the networkx flow functions
+        self._residuals = weakref.WeakKeyDictionary()
+
+    def maxflow_value(self, graph: Union[nx.DiGraph, OverlayGraph], source: Hashable, sink: Hashable) -> float:
+        if isinstance(graph, OverlayGraph):
+            return self._overlay_flow(graph, source, sink, nx.maximum_flow_value)
+        return nx.maximum_flow_value(graph, source, sink, capacity='weight')
+
+    def maximum_flow(self, graph: Union[nx.DiGraph, OverlayGraph], source: Hashable,
+                     sink: Hashable) -> Tuple[float, Dict]:
+        if isinstance(graph, OverlayGraph):
+            value, flows = self._overlay_flow(graph, source, sink, nx.maximum_flow)
+        else:
+            value, flows = nx.maximum_flow(graph, source, sink, capacity='weight')
+        return value, {k: sum(v.values()) for k, v in flows.items()}
+
+    def _residual(self, graph: nx.DiGraph) -> nx.DiGraph:
+        cached = self._residuals.get(graph)
+        if cached is None or not is_current(cached[0], graph):
+            cached = (graph_version(graph), nx.algorithms.flow.build_residual_network(graph, 'weight'))
+            self._residuals[graph] = cached
+        return cached[1]
+
+    def _overlay_flow(self, graph: OverlayGraph, source: Hashable, sink: Hashable, flow: Callable) -> Any:
+        # The flow functions reset the flows of a given residual network, only the overlaid capacities are swapped
+        residual = self._residual(graph.graph)
+        edges = [(graph.node, v) for v in graph.deltas if v in residual.adj.get(graph.node, {})]
+        if not graph.graph.is_directed():
+            edges += [(v, u) for u, v in edges]
+        saved = [residual[u][v]['capacity'] for u, v in edges]
+        try:
+            for u, v in edges:
+                target = v if u == graph.node else u
+                residual[u][v]['capacity'] = max(graph.weight(target), 0)
+            return flow(graph.graph, source, sink, capacity='weight', flow_func=nx.algorithms.flow.preflow_push,
+                        residual=residual)
+        finally:
+            for (u, v), capacity in zip(edges, saved):
+                residual[u][v]['capacity'] = capacity
+
+
+class _ConvertedBackend(MaxflowBackend):
+
+    def __init__(self) -> None:
+        self._converted = weakref.WeakKeyDictionary()
+
+    @abstractmethod
+    def _convert(self, csr: CSRGraph):
+        """Conversion of a snapshot into the graph type of the backend."""
+
+    def converted(self, graph: Union[nx.DiGraph, OverlayGraph]) -> Tuple[CSRGraph, object]:
+        """CSR snapshot of a graph and its conversion, rebuilt only when the graph version changed.
+        For an overlay these are the snapshot and conversion of its base graph.
+        """
+        graph = _base_graph(graph)
+        csr = CSRGraph.frozen(graph)
+        cached = self._converted.get(graph)
+        if cached is None or cached[0] is not csr:
+            cached = (csr, self._convert(csr))
+            self._converted[graph] = cached
+        return cached
+
+    @staticmethod
+    def _node_ids(csr: CSRGraph, source: Hashable, sink: Hashable) -> Tuple[int, int]:
+        for node in (source, sink):
+            if node not in csr.index:
+                raise nx.NetworkXError('node %s not in graph' % str(node))
+        return csr.index[source], csr.index[sink]
+
+
+class IgraphBackend(_ConvertedBackend):
+    name = 'igraph'
+
+    def _convert(self, csr: CSRGraph) -> ig.Graph:
+        adj = csr.forward
+        graph = ig.Graph(n=len(csr), edges=list(zip(adj.sources.tolist(), adj.indices.tolist())), directed=True)
+        graph.es['weight'] = adj.weights.tolist()
+        return graph
+
+    @staticmethod
+    def _run(graph: Union[nx.DiGraph, OverlayGraph], csr: CSRGraph, converted: ig.Graph, run: Callable) -> Any:
+        # Edge ids of the converted graph are the CSR positions, overlaid weights are swapped in and restored
+        if not isinstance(graph, OverlayGraph):
+            return run()
+        positions, capacities = graph.edge_positions(csr)
+        edges = converted.es[positions.tolist()]
+        edges['weight'] = capacities.tolist()
+        try:
+            return run()
+        finally:
+            edges['weight'] = csr.forward.weights[positions].tolist()
+
+    def maxflow_value(self, graph: Union[nx.DiGraph, OverlayGraph], source: Hashable, sink: Hashable) -> float:
+        csr, converted = self.converted(graph)
+        s, t = self._node_ids(csr, source, sink)
+        return self._run(graph, csr, converted, lambda: converted.maxflow_value(s, t, capacity='weight'))
+
+    def maximum_flow(self, graph: Union[nx.DiGraph, OverlayGraph], source: Hashable,
+                     sink: Hashable) -> Tuple[float, Dict]:
+        csr, converted = self.converted(graph)
+        s, t = self._node_ids(csr, source, sink)
+        flow = self._run(graph, csr, converted, lambda: converted.maxflow(s, t, capacity='weight'))
+        out_flows = np.bincount(csr.forward.sources, weights=np.maximum(flow.flow, 0), minlength=len(csr))
+        return flow.value, {csr.nodes[i]: out_flows[i] for i in np.flatnonzero(out_flows)}
+
+
+class ScipyBackend(_ConvertedBackend):
+    name = 'scipy'
+
+    def __init__(self, scale: Union[int, None] = None) -> None:
+        """Maxflow of scipy.sparse.csgraph, which only supports int32 capacities.
+        Rounding moves every scaled capacity by at most 0.5, so the flow value is off by at most 0.5 / scale per edge
+        of the minimum cut. Weights whose scaled capacities do not fit in int32 raise a ValueError.
+        @param scale: Factor applied to the weights before rounding them to integers. If none, integer weights are
+        kept as they are and other weights are scaled by 1000 (default: None).
+        """
+        super().__init__()
+        self.scale = scale
+
+    def _convert(self, csr: CSRGraph, weights: Optional[np.ndarray] = None) -> Tuple[sp.csr_matrix, int]:
+        adj = csr.forward
+        weights = adj.weights if weights is None else weights
+        scale = self.scale
+        if scale is None:
+            scale = 1 if np.array_equal(weights, np.round(weights)) else 1000
+        capacities = np.round(weights * scale).astype(np.int64)
+        if len(capacities) and capacities.max() > np.iinfo(np.int32).max:
+            raise ValueError('capacity %d of the weights scaled by %s exceeds the int32 range of the scipy maxflow, '
+                             'use a smaller scale or another backend' % (capacities.max(), scale))
+        capacities = capacities.astype(np.int32)
+        # eliminate_zeros works in place, it must not touch the index arrays of the snapshot
+        matrix = sp.csr_matrix((capacities, adj.indices.copy(), adj.offsets.copy()), shape=(len(csr), len(csr)))
+        matrix.eliminate_zeros()
+        return matrix, scale
+
+    def _matrix(self, graph: Union[nx.DiGraph, OverlayGraph]) -> Tuple[CSRGraph, sp.csr_matrix, int]:
+        csr, (matrix, scale) = self.converted(graph)
+        if isinstance(graph, OverlayGraph) and graph.deltas:
+            # The integer capacities and their scale depend on the overlaid weights, so overlays convert a copy
+            positions, capacities = graph.edge_positions(csr)
+            weights = csr.forward.weights.copy()
+            weights[positions] = capacities
+            matrix, scale = self._convert(csr, weights)
+        return csr, matrix, scale
+
+    def maxflow_value(self, graph: Union[nx.DiGraph, OverlayGraph], source: Hashable, sink: Hashable) -> float:
+        csr, matrix, scale = self._matrix(graph)
+        s, t = self._node_ids(csr, source, sink)
+        return maximum_flow(matrix, s, t).flow_value / scale
+
+    def maximum_flow(self, graph: Union[nx.DiGraph, OverlayGraph], source: Hashable,
+                     sink: Hashable) -> Tuple[float, Dict]:
+        csr, matrix, scale = self._matrix(graph)
+        s, t = self._node_ids(csr, source, sink)
+        result = maximum_flow(matrix, s, t)
+        # Older scipy versions call the flow matrix residual
+        flow = getattr(result, 'flow', None)
+        if flow is None:
+            flow = result.residual
+        flow = sp.csr_matrix(flow)
+        out_flows = np.asarray(flow.maximum(0).sum(axis=1)).ravel() / scale
+        return result.flow_value / scale, {csr.nodes[i]: out_flows[i] for i in np.flatnonzero(out_flows)}
+
+
+class _FlowStates:
+
+    def __init__(self) -> None:
+        # Graph version and edge weights the flows were last checked against
+        self.version = None
+        self.weights = {}
+        # (source, sink) -> [flow value, net flow u -> v -> f with f(u, v) = -f(v, u), graph version of the flow]
+        self.flows = OrderedDict()
+
+
+class IncrementalBackend(MaxflowBackend):
+    name = 'incremental'
+
+    # Residual capacities up to this are treated as saturated, to stop augmenting on rounding noise
+    tolerance = 1e-9
+
+    def __init__(self, max_pairs: Optional[int] = 4096) -> None:
+        """Warm-started maxflow for graphs whose capacities mostly grow, like the min work graph of the ledger.
+        The flow of every (source, sink) pair is kept. When the graph changed, the kept flow is still feasible as long
+        as no edge carrying it lost capacity, and only new augmenting paths are searched (Edmonds-Karp).
+        Flows over an edge whose capacity dropped below them are computed again from scratch.
+        Overlay graphs are not kept, they are computed by the networkx backend. Neither are graphs without a version,
+        whose changes cannot be detected (see graph_version): their flows are computed from scratch.
+        @param max_pairs: number of flows kept per graph, the least recently used are dropped, None for no limit
+        (default: 4096).
+        """
+        self.max_pairs = max_pairs
+        self._states = weakref.WeakKeyDictionary()
+
+    def maxflow_value(self, graph: Union[nx.DiGraph, OverlayGraph], source: Hashable, sink: Hashable) -> float:
+        if isinstance(graph, OverlayGraph):
+            return get_maxflow_backend('networkx').maxflow_value(graph, source, sink)
+        return self._flow(graph, source, sink)[0]
+
+    def maximum_flow(self, graph: Union[nx.DiGraph, OverlayGraph], source: Hashable,
+                     sink: Hashable) -> Tuple[float, Dict]:
+        if isinstance(graph, OverlayGraph):
+            return get_maxflow_backend('networkx').maximum_flow(graph, source, sink)
+        value, flow = self._flow(graph, source, sink)
+        out_flows = {u: sum(f for f in row.values() if f > 0) for u, row in flow.items()}
+        return value, {u: f for u, f in out_flows.items() if f > 0}
+
+    def _flow(self, graph: nx.DiGraph, source: Hashable, sink: Hashable) -> Tuple[float, Dict]:
+        for node in (source, sink):
+            if node not in graph:
+                raise nx.NetworkXError('node %s not in graph' % str(node))
+        if graph_version(graph) is None:
+            # Changes of an unversioned graph cannot be detected, so there is no flow to start from
+            return self._net_flow(graph, source, sink)
+        state = self._sync(graph)
+        entry = state.flows.get((source, sink))
+        if entry is None:
+            entry = state.flows[(source, sink)] = self._initial_flow(graph, source, sink)
+            while self.max_pairs is not None and len(state.flows) > self.max_pairs:
+                state.flows.popitem(last=False)
+        else:
+            state.flows.move_to_end((source, sink))
+            if entry[2] != state.version:
+                entry[0] += self._augment(graph, source, sink, entry[1])
+                entry[2] = state.version
+        return entry[0], entry[1]
+
+    def _sync(self, graph: nx.DiGraph) -> _FlowStates:
+        """Flow states of the graph, with the flows that became infeasible since the last call dropped."""
+        state = self._states.get(graph)
+        if state is None:
+            state = self._states[graph] = _FlowStates()
+        version = graph_version(graph)
+        if state.version == version:
+            return state
+
+        weights = {(u, v): w for u, v, w in graph.edges(data='weight', default=0)}
+        if not graph.is_directed():
+            weights.update({(v, u): w for (u, v), w in weights.items()})
+        lowered = [(u, v, weights.get((u, v), 0)) for (u, v), w in state.weights.items()
+                   if weights.get((u, v), 0) < w]
+        for key, (_, flow, _) in list(state.flows.items()):
+            if any(flow.get(u, {}).get(v, 0) > max(w, 0) + self.tolerance for u, v, w in lowered):
+                del state.flows[key]
+        state.version, state.weights = version, weights
+        return state
+
+    @staticmethod
+    def _net_flow(graph: nx.DiGraph, source: Hashable, sink: Hashable) -> Tuple[float, Dict]:
+        value, flows = nx.maximum_flow(graph, source, sink, capacity='weight')
+        net = {}
+        for u, row in flows.items():
+            for v, f in row.items():
+                if f > 0:
+                    net.setdefault(u, {})[v] = net.get(u, {}).get(v, 0) + f
+                    net.setdefault(v, {})[u] = net.get(v, {}).get(u, 0) - f
+        return value, net
+
+    def _initial_flow(self, graph: nx.DiGraph, source: Hashable, sink: Hashable) -> List:
+        return [*self._net_flow(graph, source, sink), self._states[graph].version]
+
+    def _residual(self, graph: nx.DiGraph, flow: Dict, u: Hashable, v: Hashable) -> float:
+        capacity = graph.adj[u][v].get('weight', 0) if v in graph.adj[u] else 0
+        return max(capacity, 0) - flow.get(u, {}).get(v, 0)
+
+    def _augment(self, graph: nx.DiGraph, source: Hashable, sink: Hashable, flow: Dict) -> float:
+        """Push flow along shortest augmenting paths of the residual graph until there are none.
+        @return: the added flow value
+        """
+        neighbors = (lambda u: chain(graph.succ[u], graph.pred[u])) if graph.is_directed() else graph.adj.__getitem__
+        added = 0
+        while True:
+            parents = {source: None}
+            queue = deque([source])
+            while queue and sink not in parents:
+                u = queue.popleft()
+                for v in neighbors(u):
+                    if v not in parents and self._residual(graph, flow, u, v) > self.tolerance:
+                        parents[v] = u
+                        queue.append(v)
+            if sink not in parents:
+                return added
+
+            path = []
+            v = sink
+            while parents[v] is not None:
+                path.append((parents[v], v))
+                v = parents[v]
+            bottleneck = min(self._residual(graph, flow, u, v) for u, v in path)
+            for u, v in path:
+                flow.setdefault(u, {})[v] = flow.get(u, {}).get(v, 0) + bottleneck
+                flow.setdefault(v, {})[u] = flow.get(v, {}).get(u, 0) - bottleneck
+            added += bottleneck
+
+
+class MaxflowCache:
+
+    def __init__(self, max_entries: Optional[int] = 100000, max_bytes: Optional[int] = 256 * 2 ** 20) -> None:
+        """Memo of maxflow results shared by the maxflow based trust functions.
+        Entries are keyed by (graph, graph version, source, sink, params), so results of an older version of a graph
+        are never returned, they age out instead. Only graphs that carry an explicit 'version' graph attribute, bumped
+        on every change as WorkGraphStorage does, are cached: changes to any other graph cannot be detected.
+        The least recently used entries are evicted once there are more than max_entries entries or their estimated
+        size exceeds max_bytes.
+        @param max_entries: maximal number of entries, None for no limit (default: 100000).
+        @param max_bytes: maximal estimated size of the entries in bytes, None for no limit (default: 256 MiB).
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.bytes = 0
+
+        self._entries = OrderedDict()
+        self._tokens = weakref.WeakKeyDictionary()
+        self._next_token = count()
+
+    def get_or_compute(self, graph: nx.DiGraph, source: Hashable, sink: Hashable, params: Tuple,
+                       compute: Callable[[], Any]) -> Any:
+        """Cached result for the key, computed and stored on a miss.
+        Graphs without a 'version' graph attribute and igraph graphs are not cached.
+        @param graph: networkx graph or overlay graph the result is computed on
+        @param source: source node
+        @param sink: sink node
+        @param params: everything else the result depends on, e.g. the backend name
+        @param compute: computes the result on a miss
+        """
+        base = _base_graph(graph)
+        if not isinstance(base, nx.Graph) or graph_version(base) is None:
+            return compute()
+        version = (graph_version(base), graph.version) if isinstance(graph, OverlayGraph) else graph_version(graph)
+        token = self._tokens.get(graph)
+        if token is None:
+            token = self._tokens[graph] = next(self._next_token)
+        key = (token, version, source, sink, params)
+        entry = self._entries.get(key)
+        if entry is not None:
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return entry[0]
+
+        self.misses += 1
+        value = compute()
+        size = _sizeof(key) + _sizeof(value)
+        self._entries[key] = (value, size)
+        self.bytes += size
+        while self._entries and ((self.max_entries is not None and len(self._entries) > self.max_entries)
+                                 or (self.max_bytes is not None and self.bytes > self.max_bytes)):
+            _, (_, evicted_size) = self._entries.popitem(last=False)
+            self.bytes -= evicted_size
+            self.evictions += 1
+        return value
+
+    def stats(self) -> Dict:
+        """Hit, miss and eviction counts, the number of entries and their estimated size in bytes."""
+        return dict(hits=self.hits, misses=self.misses, evictions=self.evictions, entries=len(self._entries),
+                    bytes=self.bytes)
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self.bytes = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+def _sizeof(value: Any) -> int:
+    """Estimated size in bytes of a cached key or value, containers are measured one level deep."""
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(sys.getsizeof(k) + sys.getsizeof(v) for k, v in value.items())
+    elif isinstance(value, tuple):
+        size += sum(_sizeof(v) for v in value)
+    return size
+
+
+# Cache shared by all maxflow based trust functions unless they are given their own
+MAXFLOW_CACHE = MaxflowCache()
+
+MAXFLOW_BACKENDS = {backend.name: backend for backend in (NetworkxBackend, IgraphBackend, ScipyBackend,
+                                                         IncrementalBackend)}
+_backends = {}
+
+
+def get_maxflow_backend(backend: Union[str, MaxflowBackend]) -> MaxflowBackend:
+    """Backend by name ('networkx', 'igraph', 'scipy' or 'incremental').
+    Named backends are shared, so are their conversions and kept flows.
+    """
+    if isinstance(backend, MaxflowBackend):
+        return backend
+    if backend not in MAXFLOW_BACKENDS:
+        raise ValueError('Unknown maxflow backend %s, expected one of %s' % (backend, ', '.join(MAXFLOW_BACKENDS)))
+    if backend not in _backends:
+        _backends[backend] = MAXFLOW_BACKENDS[backend]()
+    return _backends[backend]
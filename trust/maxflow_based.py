@@ -2,23 +2,302 @@
 The code in this file is an implementation of the MaxFlow-Based Trust Functions.
 used as a reputation mechanism in P2P networks.
 """
+import os
+import pickle
+import shutil
+import tempfile
+import weakref
+
 import igraph as ig
 import networkx as nx
 import numpy as np
 
-from typing import Union
-
-
-class MaxFlow:
-
-    def __init__(self, graph: nx.DiGraph, alpha: float = 1.0) -> None:
-        """Maxflow score trust function. Uses networkx's maxflow implementation
+from collections import OrderedDict
+from concurrent.futures import Executor
+from math import ceil
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+from .csr_graph import BatchComputeMixin, CSRGraph, NetContribMixin, graph_version
+from .maxflow_backends import MAXFLOW_CACHE, MaxflowBackend, MaxflowCache, OverlayGraph, get_maxflow_backend
+
+# Files shared with the workers of parallel_maxflow_values live in memory where the platform allows it
+_SHARED_DIR = '/dev/shm' if os.path.isdir('/dev/shm') else None
+# CSR snapshot -> directory of its shared arrays, removed together with the snapshot
+_SHARED_ARRAYS = weakref.WeakKeyDictionary()
+# Worker side: directory of shared arrays -> (graph built from them, backends run on it), most recent last
+_WORKER_GRAPHS = OrderedDict()
+_WORKER_GRAPHS_SIZE = 2
+
+
+def hop_bounded_maxflow(graph: Union[nx.DiGraph, ig.Graph], source: int, sink: int, max_hops: int,
+                        backend: Optional[MaxflowBackend] = None) -> float:
+    """Maxflow from source to sink over paths of at most max_hops edges.
+    Paths of one and two hops share no edges, so up to two hops the flow has the closed form
+    w(s, t) + sum_i min(w(s, i), w(i, t)). For more hops the maxflow is computed by the backend on the subgraph of
+    the edges that lie on a path of at most max_hops edges.
+    @param graph: networkx directed graph or igraph graph
+    @param source: source node id
+    @param sink: sink node id, different from the source
+    @param max_hops: maximal number of edges of a path
+    @param backend: maxflow backend of the subgraph of a networkx graph, networkx if none (default: None).
+    @return: hop bounded maxflow value
+    """
+    if isinstance(graph, ig.Graph):
+        return _igraph_hop_bounded_maxflow(graph, source, sink, max_hops)
+    if max_hops <= 2:
+        if graph_version(graph) is None:
+            # An unversioned graph would be frozen again for every pair, its adjacency dicts give the same sums
+            return _nx_two_hop_maxflow(graph, source, sink, max_hops)
+        csr = CSRGraph.frozen(graph)
+        s, t = csr.index.get(source), csr.index.get(sink)
+        if s is None or t is None:
+            return 0.0
+        out_start, out_end = csr.forward.offsets[s], csr.forward.offsets[s + 1]
+        in_start, in_end = csr.reverse.offsets[t], csr.reverse.offsets[t + 1]
+        out_nodes, out_weights = csr.forward.indices[out_start:out_end], csr.forward.weights[out_start:out_end]
+        in_nodes, in_weights = csr.reverse.indices[in_start:in_end], csr.reverse.weights[in_start:in_end]
+        flow = out_weights[out_nodes == t].sum()
+        if max_hops == 2:
+            middle, i_out, i_in = np.intersect1d(out_nodes, in_nodes, assume_unique=True, return_indices=True)
+            keep = (middle != s) & (middle != t)
+            flow += np.minimum(out_weights[i_out[keep]], in_weights[i_in[keep]]).sum()
+        return float(flow)
+
+    if source not in graph or sink not in graph:
+        return 0.0
+    from_source = nx.single_source_shortest_path_length(graph, source, cutoff=max_hops)
+    to_sink = nx.single_source_shortest_path_length(graph.reverse(copy=False), sink, cutoff=max_hops)
+    if sink not in from_source:
+        return 0.0
+    subgraph = nx.DiGraph()
+    subgraph.add_edges_from((u, v, data) for u in from_source for v, data in graph.succ[u].items()
+                            if v in to_sink and from_source[u] + 1 + to_sink[v] <= max_hops)
+    return (backend or get_maxflow_backend('networkx')).maxflow_value(subgraph, source, sink)
+
+
+def maxflow_value(graph: Union[nx.DiGraph, ig.Graph, OverlayGraph], source: int, sink: int, backend: MaxflowBackend,
+                  max_hops: Optional[int] = None, cache: Optional[MaxflowCache] = None) -> float:
+    """Maxflow value from source to sink. An igraph graph uses its own maxflow, a networkx graph the backend.
+    @param max_hops: only count flow over paths of at most max_hops edges, see hop_bounded_maxflow (default: None).
+    @param cache: memo to look the value up in first, None to always compute it (default: None).
+    """
+    def compute() -> float:
+        if max_hops is not None:
+            return hop_bounded_maxflow(graph, source, sink, max_hops, backend)
+        if isinstance(graph, ig.Graph):
+            return graph.maxflow_value(source, sink, capacity='weight')
+        return backend.maxflow_value(graph, source, sink)
+
+    if cache is None:
+        return compute()
+    return cache.get_or_compute(graph, source, sink, ('value', backend.name, max_hops), compute)
+
+
+def maxflow_bounds(graph: nx.DiGraph, source: int, reverse: bool = False) -> Tuple[CSRGraph, np.ndarray, np.ndarray]:
+    """Lower and upper bounds of the maxflows from source to every node, or from every node to source if reverse.
+    The upper bound is min(out-strength of the sending node, in-strength of the receiving node), zero for nodes that
+    are not reachable. The lower bound is the flow over paths of at most two hops, see hop_bounded_maxflow.
+    @param graph: networkx directed graph
+    @param source: source node id, the sink if reverse
+    @param reverse: bound the maxflows towards source instead (default: False).
+    @return: the CSR snapshot of the graph and the lower and upper bound of every node id in it
+    """
+    csr = CSRGraph.frozen(graph)
+    if source not in csr.index:
+        raise nx.NetworkXError('node %s not in graph' % source)
+    s = csr.index[source]
+    # Flows towards the source are flows from the source in the reversed graph
+    out_adj, in_adj = (csr.reverse, csr.forward) if reverse else (csr.forward, csr.reverse)
+    upper = np.minimum(out_adj.strengths()[s], in_adj.strengths())
+    upper[~out_adj.reachable(s)] = 0
+
+    start, end = out_adj.offsets[s], out_adj.offsets[s + 1]
+    first, first_weights = out_adj.indices[start:end], np.maximum(out_adj.weights[start:end], 0)
+    lower = np.bincount(first, weights=first_weights, minlength=len(csr))
+    keep = first != s
+    first, first_weights = first[keep], first_weights[keep]
+    # Edge positions of the second hops, the rows of the first hop neighbors concatenated
+    starts, lengths = out_adj.offsets[first], out_adj.offsets[first + 1] - out_adj.offsets[first]
+    positions = np.arange(lengths.sum()) + np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+    middle_weights = np.repeat(first_weights, lengths)
+    second = out_adj.indices[positions]
+    keep = (second != out_adj.sources[positions]) & (second != s)
+    lower += np.bincount(second[keep], weights=np.minimum(middle_weights[keep],
+                                                          np.maximum(out_adj.weights[positions[keep]], 0)),
+                         minlength=len(csr))
+    return csr, np.minimum(lower, upper), upper
+
+
+def maxflow_values(graph: nx.DiGraph, source: int, targets: Iterable[int], backend: MaxflowBackend,
+                   reverse: bool = False, cache: Optional[MaxflowCache] = None,
+                   executor: Optional[Executor] = None) -> Tuple[Dict[int, float], int]:
+    """Maxflows from source to every target, or from every target to source if reverse.
+    Maxflows settled by maxflow_bounds are not run: a zero upper bound gives zero, and a lower bound that meets the
+    upper bound gives that value.
+    @param targets: node ids other than the source
+    @param cache: memo to look the computed values up in first, not used with an executor (default: None).
+    @param executor: Process pool to run the remaining maxflows on, see parallel_maxflow_values (default: None).
+    @return: maxflow value of every target and the number of maxflows that were not run
+    """
+    if source not in graph:
+        # A source that is not in the graph yet has no flows
+        values = dict.fromkeys(targets, 0.0)
+        return values, len(values)
+    csr, lower, upper = maxflow_bounds(graph, source, reverse)
+    values, pending = {}, []
+    for target in targets:
+        i = csr.index.get(target)
+        if i is not None and lower[i] >= upper[i] - 1e-9 * max(upper[i], 1.0):
+            values[target] = float(lower[i])
+        else:
+            pending.append(target)
+
+    pairs = [(target, source) if reverse else (source, target) for target in pending]
+    if executor is not None:
+        flows = parallel_maxflow_values(executor, graph, pairs, backend)
+    else:
+        flows = [maxflow_value(graph, s, t, backend, cache=cache) for s, t in pairs]
+    values.update(zip(pending, flows))
+    return values, len(values) - len(pending)
+
+
+def _maxflow_array(graph: Union[nx.DiGraph, ig.Graph], source: int, targets: List[int], backend: MaxflowBackend,
+                   max_hops: Optional[int] = None, cache: Optional[MaxflowCache] = None,
+                   reverse: bool = False, executor: Optional[Executor] = None) -> np.ndarray:
+    """Maxflows from source to every target, or from every target to source if reverse, aligned with targets.
+    On a networkx graph without max_hops the maxflows settled by the bounds are skipped and the others run on the
+    executor if given, see maxflow_values. The source itself gets zero, as does everything when the source is not
+    in the graph yet.
+    """
+    if not targets or isinstance(graph, nx.Graph) and source not in graph \
+            or isinstance(graph, ig.Graph) and not 0 <= source < graph.vcount():
+        return np.zeros(len(targets), dtype=np.float64)
+    others = [target for target in targets if target != source]
+    if max_hops is None and isinstance(graph, nx.Graph):
+        values, _ = maxflow_values(graph, source, others, backend, reverse, cache, executor)
+    else:
+        values = {target: maxflow_value(graph, *((target, source) if reverse else (source, target)), backend,
+                                        max_hops, cache) for target in others}
+    return np.fromiter((values.get(target, 0.0) for target in targets), dtype=np.float64, count=len(targets))
+
+
+def _seed_mask(seed_node: int, target_nodes: List[int]) -> np.ndarray:
+    return np.fromiter((target == seed_node for target in target_nodes), dtype=bool, count=len(target_nodes))
+
+
+def parallel_maxflow_values(executor: Executor, graph: nx.DiGraph, pairs: Sequence[Tuple[int, int]],
+                            backend: MaxflowBackend, chunk_size: Optional[int] = None) -> List[float]:
+    """Maxflow values of (source, sink) pairs computed on a process pool.
+    The forward CSR arrays of the graph are written once per snapshot to memory-mapped files, and the tasks only carry
+    their directory and the pairs as node ids. Every worker loads the arrays and builds its graph once per snapshot,
+    and keeps its backend conversions and flows for the later tasks on it.
+    @param executor: Process pool to run the chunks on
+    @param graph: networkx directed graph
+    @param pairs: (source, sink) node id pairs
+    @param backend: maxflow backend run by the workers
+    @param chunk_size: number of pairs per task (default: None, one chunk per CPU).
+    @return: maxflow value of every pair, in order
+    """
+    if not pairs:
+        return []
+    if chunk_size is None:
+        # Executors do not expose their number of workers, a pool of the default size has one per CPU
+        chunk_size = max(1, ceil(len(pairs) / (os.cpu_count() or 1)))
+    csr = CSRGraph.frozen(graph)
+    for node in {node for pair in pairs for node in pair}:
+        if node not in csr.index:
+            raise nx.NetworkXError('node %s not in graph' % str(node))
+    path = _shared_arrays(csr)
+    id_pairs = [(csr.index[s], csr.index[t]) for s, t in pairs]
+    futures = [executor.submit(_run_maxflow_pairs, path, backend, id_pairs[i:i + chunk_size])
+               for i in range(0, len(id_pairs), chunk_size)]
+    return [value for future in futures for value in future.result()]
+
+
+def _shared_arrays(csr: CSRGraph) -> str:
+    """Directory with the forward CSR arrays of a snapshot, written on first use."""
+    path = _SHARED_ARRAYS.get(csr)
+    if path is None:
+        path = tempfile.mkdtemp(prefix='csr-', dir=_SHARED_DIR)
+        for name in ('offsets', 'indices', 'weights'):
+            np.save(os.path.join(path, name + '.npy'), getattr(csr.forward, name))
+        weakref.finalize(csr, shutil.rmtree, path, True)
+        _SHARED_ARRAYS[csr] = path
+    return path
+
+
+def _run_maxflow_pairs(path: str, backend: MaxflowBackend, pairs: Sequence[Tuple[int, int]]) -> List[float]:
+    """Worker side of parallel_maxflow_values: run the maxflows on the graph of the shared arrays in path."""
+    entry = _WORKER_GRAPHS.get(path)
+    if entry is None:
+        offsets, indices, weights = (np.load(os.path.join(path, name + '.npy'), mmap_mode='r')
+                                     for name in ('offsets', 'indices', 'weights'))
+        # The directory names the snapshot, so it versions the graph and its conversions are reused
+        graph = nx.DiGraph(version=path)
+        graph.add_nodes_from(range(len(offsets) - 1))
+        sources = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+        graph.add_weighted_edges_from(zip(sources.tolist(), indices.tolist(), weights.tolist()))
+        entry = _WORKER_GRAPHS[path] = (graph, {})
+        while len(_WORKER_GRAPHS) > _WORKER_GRAPHS_SIZE:
+            _WORKER_GRAPHS.popitem(last=False)
+    _WORKER_GRAPHS.move_to_end(path)
+    graph, backends = entry
+    # Backends arrive without their per-process state, the one kept in this worker for the same backend is used
+    backend = backends.setdefault(pickle.dumps(backend), backend)
+    return [backend.maxflow_value(graph, s, t) for s, t in pairs]
+
+
+def _nx_two_hop_maxflow(graph: nx.DiGraph, source: int, sink: int, max_hops: int) -> float:
+    if source not in graph or sink not in graph:
+        return 0.0
+    out_weights = {v: data.get('weight', 1) for v, data in graph.succ[source].items()}
+    in_weights = {u: data.get('weight', 1) for u, data in graph.pred[sink].items()}
+    flow = out_weights.get(sink, 0.0)
+    if max_hops == 2:
+        flow += sum(min(w, in_weights[i]) for i, w in out_weights.items()
+                    if i in in_weights and i != source and i != sink)
+    return float(flow)
+
+
+def _igraph_hop_bounded_maxflow(graph: ig.Graph, source: int, sink: int, max_hops: int) -> float:
+    if max_hops <= 2:
+        out_weights = {e.target: e['weight'] for e in graph.es.select(_source=source)}
+        in_weights = {e.source: e['weight'] for e in graph.es.select(_target=sink)}
+        flow = out_weights.get(sink, 0.0)
+        if max_hops == 2:
+            flow += sum(min(w, in_weights[i]) for i, w in out_weights.items()
+                        if i in in_weights and i != source and i != sink)
+        return float(flow)
+
+    from_source = graph.distances(source=source, mode='out')[0]
+    to_sink = graph.distances(source=sink, mode='in')[0]
+    if from_source[sink] > max_hops:
+        return 0.0
+    edges = [e.index for e in graph.es if from_source[e.source] + 1 + to_sink[e.target] <= max_hops]
+    return graph.subgraph_edges(edges, delete_vertices=False).maxflow_value(source, sink, capacity='weight')
+
+
+class MaxFlow(BatchComputeMixin):
+
+    def __init__(self, graph: nx.DiGraph, alpha: float = 1.0, max_hops: Optional[int] = None,
+                 backend: Union[str, MaxflowBackend] = 'networkx',
+                 cache: Optional[MaxflowCache] = MAXFLOW_CACHE, executor: Optional[Executor] = None) -> None:
+        """Maxflow score trust function. Uses networkx's maxflow implementation by default
         https://networkx.org/documentation/stable/reference/algorithms/generated/networkx.algorithms.flow.maximum_flow.html.
         @param graph: networkx directed graph
         @param alpha: weight of maxflow score
+        @param max_hops: only count flow over paths of at most max_hops edges, see hop_bounded_maxflow (default: None).
+        @param backend: maxflow backend, 'networkx', 'igraph', 'scipy' or 'incremental' (default: 'networkx').
+        @param cache: memo of maxflow values shared between trust functions, None to disable (default: MAXFLOW_CACHE).
+        @param executor: Process pool to run the maxflows of compute_many and compute_all on, see
+        parallel_maxflow_values (default: None).
         """
         self.alpha = alpha
         self.graph = graph
+        self.max_hops = max_hops
+        self.backend = get_maxflow_backend(backend)
+        self.cache = cache
+        self.executor = executor
 
     def compute(self, seed_node: int, target_node: int) -> float:
         """Compute maxflow score of target node from perspective of seed_node.
@@ -28,19 +307,45 @@ class MaxFlow:
         """
         if seed_node == target_node:
             return 1.0
-        maxflow_seed_target = nx.maximum_flow_value(self.graph, seed_node, target_node, capacity='weight')
+        maxflow_seed_target = maxflow_value(self.graph, seed_node, target_node, self.backend, self.max_hops, self.cache)
         return maxflow_seed_target * self.alpha
 
+    def compute_many(self, seed_node: int, target_nodes: List[int]) -> np.ndarray:
+        """Compute maxflow scores of many target nodes, skipping the maxflows settled by maxflow_bounds.
+        @param seed_node: seed node id in a graph (int)
+        @param target_nodes: target node ids in a graph
+        @return: maxflow scores aligned with target_nodes
+        """
+        target_nodes = list(target_nodes)
+        maxflow_seed_target = _maxflow_array(self.graph, seed_node, target_nodes, self.backend, self.max_hops,
+                                             self.cache, executor=self.executor)
+        scores = maxflow_seed_target * self.alpha
+        scores[_seed_mask(seed_node, target_nodes)] = 1.0
+        return scores
 
-class BarterCast:
 
-    def __init__(self, graph: Union[nx.Graph, ig.Graph], use_igraph: bool = False) -> None:
+class BarterCast(BatchComputeMixin):
+
+    def __init__(self, graph: Union[nx.Graph, ig.Graph], use_igraph: bool = False,
+                 max_hops: Optional[int] = None, backend: Union[str, MaxflowBackend] = 'networkx',
+                 cache: Optional[MaxflowCache] = MAXFLOW_CACHE, executor: Optional[Executor] = None) -> None:
         """Bartercast score trust function. https://ieeexplore.ieee.org/document/5160954
         @param graph: networkx graph or igraph graph
-        @param use_igraph: use igraph implementation of maxflow (default: False).
+        @param use_igraph: the graph is an igraph graph, use its maxflow implementation (default: False).
+        @param max_hops: only count flow over paths of at most max_hops edges, the original BarterCast uses 2.
+        See hop_bounded_maxflow (default: None).
+        @param backend: maxflow backend for a networkx graph, 'networkx', 'igraph', 'scipy' or 'incremental'
+        (default: 'networkx').
+        @param cache: memo of maxflow values shared between trust functions, None to disable (default: MAXFLOW_CACHE).
+        @param executor: Process pool to run the maxflows of compute_many and compute_all on, see
+        parallel_maxflow_values (default: None).
         """
         self.graph = graph
         self.use_igraph = use_igraph
+        self.max_hops = max_hops
+        self.backend = get_maxflow_backend(backend)
+        self.cache = cache
+        self.executor = executor
 
     def compute(self, seed_node: int, target_node: int) -> float:
         """Compute bartercast score of target node from perspective of seed_node.
@@ -50,26 +355,48 @@ class BarterCast:
         """
         if seed_node == target_node:
             return 1.0
-        if self.use_igraph:
-            maxflow_seed_target = self.graph.maxflow_value(seed_node, target_node, capacity='weight')
-            maxflow_target_seed = self.graph.maxflow_value(target_node, seed_node, capacity='weight')
-        else:
-            maxflow_seed_target = nx.maximum_flow(self.graph, seed_node, target_node, capacity='weight')[0]
-            maxflow_target_seed = nx.maximum_flow(self.graph, target_node, seed_node, capacity='weight')[0]
+        maxflow_seed_target = maxflow_value(self.graph, seed_node, target_node, self.backend, self.max_hops, self.cache)
+        maxflow_target_seed = maxflow_value(self.graph, target_node, seed_node, self.backend, self.max_hops, self.cache)
         values = float(np.arctan(maxflow_seed_target - maxflow_target_seed)) / float(0.5 * np.pi)
         return values
 
+    def compute_many(self, seed_node: int, target_nodes: List[int]) -> np.ndarray:
+        """Compute bartercast scores of many target nodes, skipping the maxflows settled by maxflow_bounds.
+        @param seed_node: seed node id in a graph (int)
+        @param target_nodes: target node ids in a graph
+        @return: bartercast scores aligned with target_nodes
+        """
+        target_nodes = list(target_nodes)
+        maxflow_seed_target = _maxflow_array(self.graph, seed_node, target_nodes, self.backend, self.max_hops,
+                                             self.cache, executor=self.executor)
+        maxflow_target_seed = _maxflow_array(self.graph, seed_node, target_nodes, self.backend, self.max_hops,
+                                             self.cache, reverse=True, executor=self.executor)
+        scores = np.arctan(maxflow_seed_target - maxflow_target_seed) / (0.5 * np.pi)
+        scores[_seed_mask(seed_node, target_nodes)] = 1.0
+        return scores
+
 
-class RawBarterCast:
+class RawBarterCast(BatchComputeMixin):
 
-    def __init__(self, graph: nx.DiGraph, alpha: float = 1.0) -> None:
+    def __init__(self, graph: nx.DiGraph, alpha: float = 1.0, max_hops: Optional[int] = None,
+                 backend: Union[str, MaxflowBackend] = 'networkx',
+                 cache: Optional[MaxflowCache] = MAXFLOW_CACHE, executor: Optional[Executor] = None) -> None:
         """A modification of Bartercast score trust function without arctan.
         Score = maxflow_seed_target - maxflow_target_seed.
         @param graph: networkx directed graph
         @param alpha: weight of bartercast score
+        @param max_hops: only count flow over paths of at most max_hops edges, see hop_bounded_maxflow (default: None).
+        @param backend: maxflow backend, 'networkx', 'igraph', 'scipy' or 'incremental' (default: 'networkx').
+        @param cache: memo of maxflow values shared between trust functions, None to disable (default: MAXFLOW_CACHE).
+        @param executor: Process pool to run the maxflows of compute_many and compute_all on, see
+        parallel_maxflow_values (default: None).
         """
         self.alpha = alpha
         self.graph = graph
+        self.max_hops = max_hops
+        self.backend = get_maxflow_backend(backend)
+        self.cache = cache
+        self.executor = executor
 
     def compute(self, seed_node: int, target_node: int) -> float:
         """Compute bartercast score of target node from perspective of seed_node
@@ -79,30 +406,56 @@ class RawBarterCast:
         """
         if seed_node == target_node:
             return 1.0
-        maxflow_seed_target = nx.maximum_flow(self.graph, seed_node, target_node, capacity='weight')[0]
-        maxflow_target_seed = nx.maximum_flow(self.graph, target_node, seed_node, capacity='weight')[0]
+        maxflow_seed_target = maxflow_value(self.graph, seed_node, target_node, self.backend, self.max_hops, self.cache)
+        maxflow_target_seed = maxflow_value(self.graph, target_node, seed_node, self.backend, self.max_hops, self.cache)
         values = float(maxflow_seed_target - maxflow_target_seed)
         return values
 
+    def compute_many(self, seed_node: int, target_nodes: List[int]) -> np.ndarray:
+        """Compute bartercast scores of many target nodes, skipping the maxflows settled by maxflow_bounds.
+        @param seed_node: seed node id in a graph (int)
+        @param target_nodes: target node ids in a graph
+        @return: bartercast scores aligned with target_nodes
+        """
+        target_nodes = list(target_nodes)
+        scores = _maxflow_array(self.graph, seed_node, target_nodes, self.backend, self.max_hops, self.cache,
+                                executor=self.executor) \
+            - _maxflow_array(self.graph, seed_node, target_nodes, self.backend, self.max_hops, self.cache, reverse=True,
+                             executor=self.executor)
+        scores[_seed_mask(seed_node, target_nodes)] = 1.0
+        return scores
 
-class BoundedBarterCast:
+
+class BoundedBarterCast(NetContribMixin, BatchComputeMixin):
 
     def __init__(self, graph: Union[nx.DiGraph, ig.Graph], 
                     alpha: float = 1.0, 
                     use_igraph: bool = False, 
-                    bound: float = 1000) -> None:
+                    bound: float = 1000,
+                    backend: Union[str, MaxflowBackend] = 'networkx',
+                    cache: Optional[MaxflowCache] = MAXFLOW_CACHE,
+                    executor: Optional[Executor] = None) -> None:
         """A modification of Bartercast score trust weighted by the net contribution of the target node and seed node.
         @param graph: networkx directed graph or igraph graph
         @param alpha: weight of bartercast score
-        @param use_igraph: use igraph implementation of maxflow (default: False).
+        @param use_igraph: the graph is an igraph graph, use its maxflow implementation (default: False).
         @param bound: bound of net contribution of a node (default: 1000)
+        @param backend: maxflow backend for a networkx graph, 'networkx', 'igraph', 'scipy' or 'incremental'
+        (default: 'networkx').
+        @param cache: memo of maxflow values shared between trust functions, None to disable (default: MAXFLOW_CACHE).
+        @param executor: Process pool to run the maxflows of compute_many and compute_all on, see
+        parallel_maxflow_values (default: None).
         """
         self.alpha = alpha
         self.graph = graph
 
         self.use_igraph = use_igraph
+        self.backend = get_maxflow_backend(backend)
+        self.cache = cache
+        self.executor = executor
 
-        self.scores = {}
+    def _net_contrib(self, out_deg, in_deg):
+        return np.minimum(self.alpha * (out_deg + 1) - in_deg, 1000)
 
     def net_contrib(self, node: int) -> float:
         """Compute net contribution of a node.
@@ -111,28 +464,20 @@ class BoundedBarterCast:
         @return: net contribution of a node
         """
         if self.use_igraph:
-            out_deg = self.graph.strength(node, mode='OUT', weights='weight')
-            in_deg = self.graph.strength(node, mode='IN', weights='weight')
-        else:
-            out_deg = self.graph.out_degree(node, weight='weight')
-            in_deg = self.graph.in_degree(node, weight='weight')
+            return self._net_contrib(self.graph.strength(node, mode='OUT', weights='weight'),
+                                     self.graph.strength(node, mode='IN', weights='weight'))
+        return super().net_contrib(node)
 
-        return min(self.alpha * (out_deg + 1) - in_deg, 1000)
-
-    def _calc(self, seed_node: int, target_node: int) -> None:
+    def net_contribs(self, nodes: Optional[List] = None) -> np.ndarray:
+        """Net contribution of many nodes at once, all nodes of the graph in graph order if none (default: None)."""
         if self.use_igraph:
-            val = self.graph.maxflow_value(seed_node, target_node, capacity='weight')
-        else:
-            val = nx.maximum_flow_value(self.graph, seed_node, target_node, capacity='weight')
-        self.scores[seed_node][target_node] = val
+            nodes = range(self.graph.vcount()) if nodes is None else nodes
+            return self._net_contrib(np.array(self.graph.strength(nodes, mode='OUT', weights='weight')),
+                                     np.array(self.graph.strength(nodes, mode='IN', weights='weight')))
+        return super().net_contribs(nodes)
 
     def calc(self, seed_node: int, target_node: int) -> float:
-        if seed_node not in self.scores:
-            self.scores[seed_node] = {}
-            self._calc(seed_node, target_node)
-        if target_node not in self.scores[seed_node]:
-            self._calc(seed_node, target_node)
-        return self.scores[seed_node][target_node]
+        return maxflow_value(self.graph, seed_node, target_node, self.backend, cache=self.cache)
 
     def compute(self, seed_node: int, target_node: int) -> float:
         """Compute score of target node from perspective of seed_node.
@@ -153,89 +498,123 @@ class BoundedBarterCast:
         values = float(p1 - p2)
         return values
 
-
-class PenaltyCast:
-
-    def __init__(self, graph: nx.DiGraph, alpha: float = 2.0) -> None:
+    def compute_many(self, seed_node: int, target_nodes: List[int]) -> np.ndarray:
+        """Compute scores of many target nodes. Only the maxflows with a positive net contribution are run,
+        and the ones settled by maxflow_bounds are skipped.
+        @param seed_node: seed node id in a graph (int)
+        @param target_nodes: target node ids in a graph
+        @return: trust scores aligned with target_nodes"""
+        target_nodes = list(target_nodes)
+        p1 = np.zeros(len(target_nodes), dtype=np.float64)
+        coef = self.net_contrib(seed_node)
+        if coef > 0:
+            p1 = coef * _maxflow_array(self.graph, seed_node, target_nodes, self.backend, cache=self.cache,
+                                       executor=self.executor)
+
+        p2 = np.zeros(len(target_nodes), dtype=np.float64)
+        coefs = self.net_contribs(target_nodes)
+        positive = np.flatnonzero(coefs > 0)
+        if len(positive):
+            p2[positive] = coefs[positive] * _maxflow_array(self.graph, seed_node, [target_nodes[i] for i in positive],
+                                                            self.backend, cache=self.cache, reverse=True,
+                                                            executor=self.executor)
+        scores = p1 - p2
+        scores[_seed_mask(seed_node, target_nodes)] = 1.0
+        return scores
+
+
+class PenaltyCast(BatchComputeMixin):
+
+    def __init__(self, graph: nx.DiGraph, alpha: float = 2.0, backend: Union[str, MaxflowBackend] = 'networkx',
+                 cache: Optional[MaxflowCache] = MAXFLOW_CACHE, max_aux_graphs: int = 128,
+                 executor: Optional[Executor] = None) -> None:
         """A modification of Bartercast score trust function with penalty.
         Score = maxflow_seed_target - maxflow_target_seed.
         Two maxflows are computed: one from seed_node to target_node and one from target_node to seed_node.
         The penalty is computed as the difference between the two maxflows.
         @param graph: networkx directed graph
         @param alpha: weight of bartercast score
+        @param backend: maxflow backend, 'networkx', 'igraph', 'scipy' or 'incremental' (default: 'networkx').
+        @param cache: memo of maxflows and their path counts, None to disable (default: MAXFLOW_CACHE).
+        @param max_aux_graphs: number of aux graphs to keep, the least recently used are dropped (default: 128).
+        @param executor: Process pool to run the maxflows towards the seed of compute_many and compute_all on, see
+        parallel_maxflow_values (default: None).
         """
         self.graph = graph
-
-        self.scores = {}
-        self.path_counts = {}
-
-        self.aux_scores = {}
+        self.backend = get_maxflow_backend(backend)
+        self.cache = cache
+        self.executor = executor
+        self.max_aux_graphs = max_aux_graphs
 
         self.penalites = {}
         self.alpha = alpha
 
-        self.auxes = {}
+        # seed node -> (graph version the aux graph was built from, aux graph)
+        self.auxes = OrderedDict()
 
-    def _calc(self, seed_node: int, target_node: int) -> None:
-        val = nx.maximum_flow(self.graph, seed_node, target_node, capacity='weight')
-        self.scores[seed_node][target_node] = val[0]
-
-        raw_count = {k: sum(v.values()) for k, v in val[1].items()}
-        total_sum = sum(raw_count.values()) - raw_count[seed_node]
+    def _maximum_flow(self, seed_node: int, target_node: int) -> Tuple[float, Dict]:
+        value, raw_count = self.backend.maximum_flow(self.graph, seed_node, target_node)
+        total_sum = sum(raw_count.values()) - raw_count.get(seed_node, 0)
         norm_count = {k: v / total_sum for k, v in raw_count.items() if v > 0 and k != seed_node}
-        self.path_counts[seed_node][target_node] = norm_count
+        return value, norm_count
+
+    def _flow(self, seed_node: int, target_node: int) -> Tuple[float, Dict]:
+        """Maxflow from seed_node to target_node and the normalized outgoing flow of every node on it."""
+        if self.cache is None:
+            return self._maximum_flow(seed_node, target_node)
+        return self.cache.get_or_compute(self.graph, seed_node, target_node, ('flow', self.backend.name),
+                                         lambda: self._maximum_flow(seed_node, target_node))
 
     def calc(self, seed_node: int, target_node: int) -> float:
-        if seed_node not in self.scores:
-            self.scores[seed_node] = {}
-            self.path_counts[seed_node] = {}
-            self._calc(seed_node, target_node)
-        if target_node not in self.scores[seed_node]:
-            self._calc(seed_node, target_node)
-        return self.scores[seed_node][target_node]
+        return self._flow(seed_node, target_node)[0]
+
+    def path_counts(self, seed_node: int, target_node: int) -> Dict:
+        return self._flow(seed_node, target_node)[1]
+
+    def _aux(self, seed_node: int) -> Optional[OverlayGraph]:
+        """Aux graph of the seed node if it was built from the current version of the graph.
+        Aux graphs of an unversioned graph are kept until they are evicted, their overlays apply the penalties to the
+        current weights of the graph.
+        """
+        entry = self.auxes.get(seed_node)
+        if entry is None or entry[0] != graph_version(self.graph):
+            return None
+        self.auxes.move_to_end(seed_node)
+        return entry[1]
 
     # build aux graph
-    def aux_graph(self, seed_node: int) -> float:
-        if seed_node in self.auxes:
-            return self.auxes[seed_node]
+    def aux_graph(self, seed_node: int) -> OverlayGraph:
+        """Graph with the out-edges of the seed node lowered by the penalties, an overlay of the graph."""
+        aux = self._aux(seed_node)
+        if aux is not None:
+            return aux
 
-        penalties = {}
+        aux = OverlayGraph(self.graph, seed_node)
         for k in self.graph.pred[seed_node]:
-            self.calc(seed_node, target_node=k)
             w = self.graph[k][seed_node]['weight']
 
-            for i, v in self.path_counts[seed_node][k].items():
-                if i not in penalties:
-                    penalties[i] = 0
-                penalties[i] += v * w / self.alpha
-
-        self.auxes[seed_node] = self.graph.copy()
-        for k, v in penalties.items():
-            if k in self.auxes[seed_node][seed_node]:
-                self.auxes[seed_node][seed_node][k]['weight'] -= v
-        return self.auxes[seed_node]
+            for i, v in self.path_counts(seed_node, k).items():
+                aux.add_delta(i, -v * w / self.alpha)
 
-    def _aux_calc(self, seed_node: int, target_node: int) -> None:
-        val = nx.maximum_flow_value(self.auxes[seed_node], seed_node, target_node, capacity='weight')
-        self.aux_scores[seed_node][target_node] = val
+        self.auxes[seed_node] = (graph_version(self.graph), aux)
+        self.auxes.move_to_end(seed_node)
+        while len(self.auxes) > self.max_aux_graphs:
+            self.auxes.popitem(last=False)
+        return aux
 
-    def recalc_penalites(self, seed_node: int, neigh_node: int) -> float:
-        self._calc(seed_node, target_node=neigh_node)
+    def recalc_penalites(self, seed_node: int, neigh_node: int) -> None:
+        if seed_node in self.auxes and self._aux(seed_node) is None:
+            # The graph changed since the aux graph was built, the rebuilt one already has the penalties of neigh_node
+            self.aux_graph(seed_node)
+            return
         w = self.graph[neigh_node][seed_node]['weight']
 
-        self.aux_graph(seed_node)
-        for i, v in self.path_counts[seed_node][neigh_node].items():
-            if i in self.auxes[seed_node][seed_node]:
-                self.auxes[seed_node][seed_node][i]['weight'] -= v * w / self.alpha
+        aux = self.aux_graph(seed_node)
+        for i, v in self.path_counts(seed_node, neigh_node).items():
+            aux.add_delta(i, -v * w / self.alpha)
 
     def aux_calc(self, seed_node: int, target_node: int) -> float:
-        self.aux_graph(seed_node)
-        if seed_node not in self.aux_scores:
-            self.aux_scores[seed_node] = {}
-            self._aux_calc(seed_node, target_node)
-        if target_node not in self.aux_scores[seed_node]:
-            self._aux_calc(seed_node, target_node)
-        return self.aux_scores[seed_node][target_node]
+        return maxflow_value(self.aux_graph(seed_node), seed_node, target_node, self.backend, cache=self.cache)
 
     def compute(self, seed_node: int, target_node: int) -> float:
         """Compute score of target node from perspective of seed_node
@@ -250,49 +629,96 @@ class PenaltyCast:
         values = maxflow_seed_target - maxflow_target_seed
         return values
 
-class Netflow:
-
-    def __init__(self, graph: nx.Graph, seed_node: int = None, alpha: float = 2) -> None:
+    def compute_many(self, seed_node: int, target_nodes: List[int]) -> np.ndarray:
+        """Compute scores of many target nodes. The maxflows towards the seed skip the ones settled by
+        maxflow_bounds, the maxflows on the aux graph of the seed are run one by one.
+        @param seed_node: seed node id in a graph (int)
+        @param target_nodes: target node ids in a graph
+        @return: scores aligned with target_nodes
+        """
+        target_nodes = list(target_nodes)
+        if seed_node not in self.graph:
+            # A seed without edges yet has no aux graph, and no flows to or from it
+            return _seed_mask(seed_node, target_nodes).astype(np.float64)
+        maxflow_target_seed = _maxflow_array(self.graph, seed_node, target_nodes, self.backend, cache=self.cache,
+                                             reverse=True, executor=self.executor)
+        maxflow_seed_target = np.fromiter((self.aux_calc(seed_node, target_node) if target_node != seed_node else 0.0
+                                           for target_node in target_nodes),
+                                          dtype=np.float64, count=len(target_nodes))
+        scores = maxflow_seed_target - maxflow_target_seed
+        scores[_seed_mask(seed_node, target_nodes)] = 1.0
+        return scores
+
+
+class Netflow(BatchComputeMixin):
+
+    def __init__(self, graph: nx.Graph, seed_node: int = None, alpha: float = 2,
+                 backend: Union[str, MaxflowBackend] = 'networkx', executor: Optional[Executor] = None) -> None:
         """
         This class implements the Netflow algorithm. As described in Trustchain paper. 
+        @param backend: maxflow backend, 'networkx', 'igraph', 'scipy' or 'incremental' (default: 'networkx').
+        @param executor: Process pool to run the maxflows of all nodes on, see parallel_maxflow_values (default: None).
         """
         self.graph = graph
         self.alpha = alpha
         self.seed_node = seed_node
+        self.backend = get_maxflow_backend(backend)
+        self.executor = executor
+
+        # Maxflows run and skipped by the last score computation
+        self.maxflows_computed = 0
+        self.maxflows_avoided = 0
+        self._contributions = {}
 
         self._compute_scores()
 
     def _prepare(self) -> None:
         self._graph = self.graph.copy()
 
-        for neighbour in self._graph.out_edges([self.seed_node], 'weight', 0):
-            cap = self._graph.adj[self.seed_node][neighbour[1]]['weight']
-            self._graph.adj[self.seed_node][neighbour[1]]['weight'] = float(cap) / float(self.alpha)
+        for _, neighbour, cap in self._graph.out_edges([self.seed_node], data='weight', default=0):
+            self._graph.adj[self.seed_node][neighbour]['weight'] = float(cap) / float(self.alpha)
+
+    def update(self, changed_edges) -> None:
+        """Apply added or changed edges of the graph to the prepared graph and compute the scores again.
+        With the 'incremental' backend the maxflows only search for new augmenting paths.
+        @param changed_edges: (source, target) pairs of the added or changed edges.
+        """
+        for u, v in changed_edges:
+            weight = self.graph[u][v]['weight']
+            if u == self.seed_node:
+                weight = float(weight) / float(self.alpha)
+            self._graph.add_edge(u, v, weight=weight)
+        if self._graph.graph.get('version') is not None:
+            self._graph.graph['version'] += 1
+        self._initial_step()
+        self._netflow_step()
 
     def _initial_step(self) -> None:
         """
-        In the intial step, all capactities are computed
+        In the intial step, all capactities are computed.
+        Maxflows settled by the reachability and strength bounds are skipped, see maxflow_values.
         """
-
-        for node in self._graph.nodes():
-            self._compute_capacity(node)
+        nodes = [node for node in self._graph.nodes() if node != self.seed_node]
+        contributions, avoided = maxflow_values(self._graph, self.seed_node, nodes, self.backend,
+                                                executor=self.executor)
+        consumptions, avoided_back = maxflow_values(self._graph, self.seed_node, nodes, self.backend, reverse=True,
+                                                    executor=self.executor)
+        self.maxflows_avoided = avoided + avoided_back
+        self.maxflows_computed = 2 * len(nodes) - self.maxflows_avoided
+
+        for node in nodes:
+            self._compute_capacity(node, contributions[node], consumptions[node])
+        self._contributions = contributions
         return self._graph
 
-    def _compute_capacity(self, node: int) -> None:
-        if node == self.seed_node:
-            return
-        contribution = nx.maximum_flow_value(self._graph, self.seed_node, node, 'weight')
-        consumption = nx.maximum_flow_value(self._graph, node, self.seed_node, 'weight')
-
+    def _compute_capacity(self, node: int, contribution: float, consumption: float) -> None:
         self._graph.add_node(node, weight=max(0, contribution - consumption))
         self._graph.add_node(node, bartercast=contribution - consumption)
 
     def _netflow_step(self):
-
-        compute_score = lambda node: nx.maximum_flow_value(self._graph, self.seed_node, node,
-                                                           'weight') if node != self.seed_node else 0
-
-        scores = {node: compute_score(node) for node in self._graph.nodes()}
+        # The maxflows ignore node attributes, so the scores are the contributions of the initial step
+        scores = {node: self._contributions.get(node, 0) for node in self._graph.nodes()}
+        self.maxflows_avoided += len(self._contributions)
         nx.set_node_attributes(self._graph, scores, 'score')
 
     def _compute_scores(self):
@@ -300,9 +726,17 @@ class Netflow:
         self._initial_step()
         self._netflow_step()
 
-    def compute(self, seed_node: int, target_node: int) -> float:
+    def _select_seed(self, seed_node: int) -> None:
         if seed_node != self.seed_node:
             self.seed_node = seed_node
             self._compute_scores()
+
+    def compute(self, seed_node: int, target_node: int) -> float:
+        self._select_seed(seed_node)
         scores = nx.get_node_attributes(self._graph, 'score')
         return scores[target_node]
+
+    def compute_many(self, seed_node: int, target_nodes: List[int]) -> np.ndarray:
+        self._select_seed(seed_node)
+        scores = nx.get_node_attributes(self._graph, 'score')
+        return np.array([scores[target_node] for target_node in target_nodes], dtype=np.float64)
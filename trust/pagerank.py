@@ -1,37 +1,312 @@
-from collections import defaultdict
-from math import ceil
+from collections import defaultdict, deque, OrderedDict
+from concurrent.futures import Executor
+from typing import Callable, Iterable, List, Optional, Tuple
 
 import networkx as nx
+import numpy as np
+from scipy.sparse.linalg import LinearOperator, gmres
 
+from .csr_graph import BatchComputeMixin, CSRGraph, NetContribMixin, graph_version
 from .random_walks import RandomWalks, BiasStrategies
 
+# Arguments of nx.pagerank supported by the sparse solver of PersonalizedPageRank
+SPARSE_PAGERANK_PARAMS = {'alpha', 'max_iter', 'tol'}
 
-class PersonalizedPageRank:
+
+class PersonalizedPageRank(BatchComputeMixin):
     """
     This class implements the personalized pagerank
     """
 
-    def __init__(self, graph: nx.Graph, seed_node: int = 0, seed_weight: float = 1.0, **kwargs) -> None:
+    def __init__(self, graph: nx.Graph, seed_node: int = 0, seed_weight: float = 1.0, solver: str = 'power',
+                 cache_size: int = 128, **kwargs) -> None:
+        """
+        @param graph: The networkx graph.
+        @param seed_node: The node to compute the pagerank of first.
+        @param seed_weight: The personalization weight of the seed node.
+        @param solver: 'power' for power iteration or 'gmres'. Both start from the vector of the previous seed
+        (default: 'power').
+        @param cache_size: The number of seeds whose pagerank vector is kept for the current graph version (default: 128).
+        @param kwargs: alpha, max_iter and tol as in nx.pagerank. Any other nx.pagerank argument makes every seed
+        fall back to nx.pagerank.
+        """
         self.graph = graph
         self.seed_node = seed_node
         self.seed_weight = seed_weight
+        self.solver = solver
+        self.cache_size = cache_size
 
         self.params = kwargs
+        self._csr = None
+        self._cache = OrderedDict()
+        self._last_vector = None
+        # Graph version self.rank was computed on
+        self._version = None
         self._recompute_pagerank()
 
     def _recompute_pagerank(self) -> float:
-        self.rank = nx.pagerank(self.graph, personalization={self.seed_node: self.seed_weight}, **self.params)
+        self._version = graph_version(self.graph)
+        if not set(self.params) <= SPARSE_PAGERANK_PARAMS:
+            self._csr = None
+            self.rank = nx.pagerank(self.graph, personalization={self.seed_node: self.seed_weight}, **self.params)
+            return
+        csr = CSRGraph.frozen(self.graph)
+        if csr is not self._csr:
+            # The transition matrix is shared per graph version, the vectors of an older version are stale
+            self._csr = csr
+            self._cache.clear()
+            if self._last_vector is not None and len(self._last_vector) != len(csr):
+                self._last_vector = None
+        vector = self._cache.get(self.seed_node)
+        if vector is None:
+            vector = self._solve(csr, self.seed_node)
+            self._cache[self.seed_node] = vector
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        else:
+            self._cache.move_to_end(self.seed_node)
+        self._last_vector = vector
+        self.rank = dict(zip(csr.nodes, vector.tolist()))
+
+    def _solve(self, csr: CSRGraph, seed_node: int) -> np.ndarray:
+        matrix, dangling = csr.transition_matrix()
+        if not len(csr) or seed_node not in csr.index or self.seed_weight == 0:
+            # Without personalization mass the pagerank vanishes
+            return np.zeros(len(csr), dtype=np.float64)
+        p = np.zeros(len(csr), dtype=np.float64)
+        p[csr.index[seed_node]] = 1.0
+        x0 = self._last_vector if self._last_vector is not None else np.full(len(csr), 1.0 / len(csr))
+        alpha, max_iter, tol = (self.params.get('alpha', 0.85), self.params.get('max_iter', 100),
+                                self.params.get('tol', 1.0e-6))
+
+        if self.solver == 'gmres':
+            # Solve (I - alpha * (A + p * dangling^T)) x = (1 - alpha) * p
+            operator = LinearOperator(matrix.shape, dtype=np.float64,
+                                      matvec=lambda x: x - alpha * (matrix @ x + x[dangling].sum() * p))
+            x, info = gmres(operator, (1 - alpha) * p, x0=x0, atol=tol, maxiter=max_iter)
+            if info != 0:
+                raise nx.PowerIterationFailedConvergence(max_iter)
+            return x / x.sum()
+
+        # Power iteration with the update rule and stopping criterion of nx.pagerank
+        x = x0
+        for _ in range(max_iter):
+            x_last = x
+            x = alpha * (matrix @ x + x[dangling].sum() * p) + (1 - alpha) * p
+            if np.abs(x - x_last).sum() < len(csr) * tol:
+                return x
+        raise nx.PowerIterationFailedConvergence(max_iter)
+
+    @property
+    def nodes(self) -> List:
+        """Nodes in the column order of compute_matrix."""
+        return CSRGraph.frozen(self.graph).nodes
+
+    def compute_matrix(self, seed_nodes: Iterable[int], chunk_size: int = 256,
+                       out: Optional[np.ndarray] = None) -> np.ndarray:
+        """Personalized pagerank of many seeds, solved together by power iteration on blocks of seeds.
+        The sparse matrix multiplies a dense (nodes x chunk_size) block of vectors, so the memory use of the solver
+        only grows with the chunk size.
+        @param seed_nodes: The seed nodes, one row each.
+        @param chunk_size: The number of seeds solved at once.
+        @param out: Array to write the rows into, e.g. a numpy.memmap when the result does not fit in memory
+        (default: a new float64 array).
+        @return: The seed x node array, columns in the order of self.nodes.
+        """
+        seed_nodes = list(seed_nodes)
+        csr = CSRGraph.frozen(self.graph)
+        if out is None:
+            out = np.zeros((len(seed_nodes), len(csr)), dtype=np.float64)
+        if not set(self.params) <= SPARSE_PAGERANK_PARAMS:
+            for row, seed_node in enumerate(seed_nodes):
+                rank = nx.pagerank(self.graph, personalization={seed_node: self.seed_weight}, **self.params)
+                out[row] = [rank[x] for x in csr.nodes]
+            return out
+
+        if not len(csr):
+            return out
+        matrix, dangling = csr.transition_matrix()
+        alpha, max_iter, tol = (self.params.get('alpha', 0.85), self.params.get('max_iter', 100),
+                                self.params.get('tol', 1.0e-6))
+        rows = [row for row, seed_node in enumerate(seed_nodes) if seed_node in csr.index and self.seed_weight != 0]
+        # Seeds outside of the graph have no personalization mass
+        out[np.setdiff1d(np.arange(len(seed_nodes)), rows)] = 0.0
+        for start in range(0, len(rows), chunk_size):
+            chunk = np.array(rows[start:start + chunk_size])
+            p = np.zeros((len(csr), len(chunk)), dtype=np.float64)
+            p[[csr.index[seed_nodes[row]] for row in chunk], np.arange(len(chunk))] = 1.0
+            x = np.full(p.shape, 1.0 / len(csr))
+            # Columns leave the block once they converged
+            active = np.arange(len(chunk))
+            for _ in range(max_iter):
+                x_last = x
+                x = alpha * (matrix @ x + x[dangling].sum(axis=0) * p) + (1 - alpha) * p
+                done = np.abs(x - x_last).sum(axis=0) < len(csr) * tol
+                out[chunk[active[done]]] = x[:, done].T
+                active, x, p = active[~done], x[:, ~done], p[:, ~done]
+                if not len(active):
+                    break
+            else:
+                raise nx.PowerIterationFailedConvergence(max_iter)
+        return out
+
+    def _select_seed(self, seed_node: int) -> None:
+        if self.seed_node != seed_node or self._version != graph_version(self.graph):
+            self.seed_node = seed_node
+            self._recompute_pagerank()
 
     def compute(self, seed_node: int, target_node: int) -> float:
         """Compute personal pagerank from seed_node to target_node"""
-        if self.seed_node != seed_node:
-            self.seed_node = seed_node
-            self._recompute_pagerank()
+        self._select_seed(seed_node)
         return self.rank[target_node]
 
+    def compute_many(self, seed_node: int, target_nodes: List) -> np.ndarray:
+        """Personal pagerank from seed_node to many target nodes, picked from the vector of the seed."""
+        self._select_seed(seed_node)
+        if self._csr is None:
+            return np.array([self.rank[x] for x in target_nodes], dtype=np.float64)
+        return self._last_vector[[self._csr.index[x] for x in target_nodes]]
+
+    def compute_all(self, seed_node: int) -> np.ndarray:
+        """The whole personal pagerank vector of seed_node, in the order of self.nodes."""
+        self._select_seed(seed_node)
+        if self._csr is None:
+            return super().compute_all(seed_node)
+        return self._last_vector.copy()
+
+
+class ForwardPushPageRank(BatchComputeMixin):
 
+    def __init__(self, graph: nx.DiGraph, alpha: float = 0.85, epsilon: float = 1.0e-4) -> None:
+        """
+        Local approximation of the personalized pagerank by forward push (Andersen, Chung and Lang).
+        Every seed keeps an estimate and a residual vector. A push moves the residual of a node into its estimate
+        and spreads the rest over its out-edges, so only nodes whose residual exceeds epsilon are ever touched.
+        The estimate of a node is below its personalized pagerank by at most the remaining residual mass.
+        @param graph: The networkx graph.
+        @param alpha: The damping factor as in nx.pagerank, the walk resets with probability 1 - alpha.
+        @param epsilon: The residual threshold. Lowering it later continues pushing from the kept residuals, as long
+        as the graph version does not change.
+        """
+        self.graph = graph
+        self.alpha = alpha
+        self.epsilon = epsilon
+
+        self._csr = None
+        self._probabilities = None
+        self._dangling = None
+        # seed -> [estimate, residual, epsilon pushed to]
+        self._states = {}
+
+    def _refresh(self) -> CSRGraph:
+        csr = CSRGraph.frozen(self.graph)
+        if csr is not self._csr:
+            self._csr = csr
+            self._states.clear()
+            _, self._dangling = csr.transition_matrix()
+            adj = csr.forward
+            out_weights = np.bincount(adj.sources, weights=adj.weights, minlength=len(csr)).astype(np.float64)
+            self._probabilities = adj.weights / np.where(self._dangling, 1.0, out_weights)[adj.sources]
+        return csr
+
+    def push(self, seed_node: int, epsilon: Optional[float] = None) -> None:
+        """Push the residuals of a seed until none exceeds epsilon.
+        @param seed_node: The seed node.
+        @param epsilon: The residual threshold (default: self.epsilon).
+        """
+        self._push(self._refresh(), seed_node, self.epsilon if epsilon is None else epsilon)
+
+    def _push(self, csr: CSRGraph, seed_node: int, epsilon: float) -> None:
+        state = self._states.get(seed_node)
+        if state is None:
+            seed_id = csr.index.get(seed_node)
+            state = self._states[seed_node] = [{}, {} if seed_id is None else {seed_id: 1.0}, float('inf')]
+        estimate, residual, pushed = state
+        if epsilon >= pushed:
+            return
+
+        adj, probabilities, dangling, seed_id = csr.forward, self._probabilities, self._dangling, csr.index.get(seed_node)
+
+        def spread(u):
+            if dangling[u]:
+                return [seed_id], [1.0]
+            start, end = adj.offsets[u], adj.offsets[u + 1]
+            return adj.indices[start:end].tolist(), probabilities[start:end].tolist()
+
+        _forward_push(estimate, residual, spread, self.alpha, epsilon)
+        state[2] = epsilon
+
+    def _push_dicts(self, seed_node: int) -> dict:
+        """Push over the adjacency dicts of an unversioned graph, keyed by node. Nothing is kept between calls."""
+        succ = self.graph.succ
+
+        def spread(u):
+            weights = [data.get('weight', 1) for data in succ[u].values()]
+            total = sum(weights)
+            if total == 0:
+                return [seed_node], [1.0]
+            return list(succ[u]), [w / total for w in weights]
+
+        estimate = {}
+        _forward_push(estimate, {seed_node: 1.0} if seed_node in succ else {}, spread, self.alpha, self.epsilon)
+        return estimate
+
+    def _estimate(self, seed_node: int) -> Tuple[dict, Callable]:
+        """The estimate of the seed and the function giving the key of a node in it."""
+        # A snapshot of an unversioned graph would be rebuilt on every call, it is pushed over its dicts instead
+        if graph_version(self.graph) is None:
+            return self._push_dicts(seed_node), lambda node: node
+        # The states of an older snapshot are dropped
+        csr = self._refresh()
+        state = self._states.get(seed_node)
+        if state is None or state[2] > self.epsilon:
+            self._push(csr, seed_node, self.epsilon)
+            state = self._states[seed_node]
+        return state[0], csr.index.get
 
-class TrustRank:
+    def compute(self, seed_node: int, target_node: int) -> float:
+        """Approximate personal pagerank from seed_node to target_node"""
+        estimate, key = self._estimate(seed_node)
+        return estimate.get(key(target_node), 0.0)
+
+    def compute_many(self, seed_node: int, target_nodes: List) -> np.ndarray:
+        target_nodes = list(target_nodes)
+        estimate, key = self._estimate(seed_node)
+        return np.fromiter((estimate.get(key(x), 0.0) for x in target_nodes),
+                           dtype=np.float64, count=len(target_nodes))
+
+    def compute_all(self, seed_node: int) -> np.ndarray:
+        """Approximate personal pagerank vector of seed_node, scattered from the touched nodes only."""
+        if graph_version(self.graph) is None:
+            return super().compute_all(seed_node)
+        estimate, _ = self._estimate(seed_node)
+        scores = np.zeros(len(self._csr), dtype=np.float64)
+        scores[list(estimate)] = list(estimate.values())
+        return scores
+
+
+def _forward_push(estimate: dict, residual: dict, spread: Callable, alpha: float, epsilon: float) -> None:
+    """Push the residuals until none exceeds epsilon.
+    @param estimate: node key -> estimate, updated in place
+    @param residual: node key -> residual, updated in place
+    @param spread: node key -> (out-neighbor keys, transition probabilities). Dangling nodes return their mass to
+    the seed, as nx.pagerank does with a personalization vector.
+    """
+    queue = deque(u for u, r in residual.items() if r > epsilon)
+    queued = set(queue)
+    while queue:
+        u = queue.popleft()
+        queued.discard(u)
+        r = residual.pop(u)
+        estimate[u] = estimate.get(u, 0.0) + (1 - alpha) * r
+        for v, probability in zip(*spread(u)):
+            rv = residual[v] = residual.get(v, 0.0) + alpha * r * probability
+            if rv > epsilon and v not in queued:
+                queue.append(v)
+                queued.add(v)
+
+
+class TrustRank(BatchComputeMixin):
 
     def __init__(self, graph: nx.Graph,
                  number_random_walks: int = 10000,
@@ -39,16 +314,34 @@ class TrustRank:
                  alpha: float = 1.0,
                  use_bias: bool = False,
                  update_weight: bool = False,
+                 executor: Optional[Executor] = None,
+                 random_seed: Optional[int] = None,
+                 retain_walks: bool = False,
+                 epsilon: Optional[float] = None,
+                 confidence: float = 0.95,
+                 top_k: Optional[int] = None,
+                 bidirectional: bool = False,
+                 relative_error: float = 0.1
                  ) -> None:
         """
         This class implements the personalized pagerank scaled by the net contribution of the seed node and deducts
         the personalized PageRank of the source node from the seed node, again scaled by its net contribution.
         @param graph: The networkx graph to run the random walks on.
-        @param number_random_walks: The number of random walks to run.
+        @param number_random_walks: The number of random walks to run. In adaptive mode the maximum number of walks.
         @param reset_probability: The probability of resetting the random walk.
         @param alpha: The alpha parameter for the biased random walks.
         @param use_bias: Whether to use biased random walks. Look ALPHA_DIFF strategy in RandomWalks for more details (default: false).
         @param update_weight: Keep track of the weight of the edges (default: False).
+        @param executor: Process pool to run the walks on (default: None).
+        @param random_seed: Seed of the RNG streams of the walks (default: None).
+        @param retain_walks: Keep the walks so that update() patches them instead of running them again (default: False).
+        @param epsilon: If set, run walks in rounds until the confidence intervals of the forward and reverse hit
+        probabilities of the queried target (or of the top_k nodes) are at most epsilon wide on each side (default: None).
+        @param confidence: The confidence level of the adaptive mode (default: 0.95).
+        @param top_k: In adaptive mode, track the top k nodes instead of the queried target (default: None).
+        @param bidirectional: If true, answer each pair with the bidirectional estimator of RandomWalks instead of
+        full walk runs from the seed. Not used together with update_weight (default: False).
+        @param relative_error: The relative error target of the bidirectional estimator (default: 0.1).
         """
         self.graph = graph
         self.number_random_walks = number_random_walks
@@ -56,71 +349,180 @@ class TrustRank:
         self.alpha = alpha
         self.use_bias = use_bias
         self.update_weight = update_weight
+        self.executor = executor
+        self.epsilon = epsilon
+        self.confidence = confidence
+        self.top_k = top_k
+        self.bidirectional = bidirectional
+        self.relative_error = relative_error
+
+        self.random_walks = RandomWalks(self.graph, alpha, retain_walks=retain_walks, random_seed=random_seed)
+        self.reverse_walks = RandomWalks(self.graph, alpha, retain_walks=retain_walks,
+                                         random_seed=None if random_seed is None else random_seed + 1)
+
+    def _run_adaptive(self, seed_node: int, target_nodes: List) -> None:
+        bias_strategy = BiasStrategies.ALPHA_DIFF if self.use_bias else BiasStrategies.EDGE_WEIGHT
+        targets = None if self.top_k is not None else target_nodes
+        for walks, back_random_walk in ((self.random_walks, False), (self.reverse_walks, True)):
+            walks.run_until(seed_node, self.epsilon, self.confidence, targets=targets, top_k=self.top_k,
+                            max_random_walks=self.number_random_walks, executor=self.executor,
+                            reset_probability=self.reset_probability, back_random_walk=back_random_walk,
+                            bias_strategy=bias_strategy, update_weight=self.update_weight, batch=True)
+
+    def walks_used(self, seed_node: int) -> int:
+        """Number of forward and reverse random walks run from the seed node."""
+        return self.random_walks.number_of_walks.get(seed_node, 0) + self.reverse_walks.number_of_walks.get(seed_node, 0)
+
+    def _compute_bidirectional(self, seed_node: int, target_node: int) -> float:
+        bias_strategy = BiasStrategies.ALPHA_DIFF if self.use_bias else BiasStrategies.EDGE_WEIGHT
+        pr1, pr2 = (walks.estimate_hit_probability(seed_node, target_node, reset_probability=self.reset_probability,
+                                                   back_random_walk=back_random_walk, bias_strategy=bias_strategy,
+                                                   relative_error=self.relative_error,
+                                                   max_random_walks=self.number_random_walks)
+                    for walks, back_random_walk in ((self.random_walks, False), (self.reverse_walks, True)))
+        return pr1 - pr2
 
-        self.random_walks = RandomWalks(self.graph, alpha)
-        self.reverse_walks = RandomWalks(self.graph, alpha)
-
-    def compute(self, seed_node: int, target_node: int) -> float:
-
-        if not self.random_walks.has_node(seed_node):
+    def _prepare(self, seed_node: int, target_nodes: List) -> None:
+        if self.epsilon is not None:
+            self._run_adaptive(seed_node, target_nodes)
+        elif not self.random_walks.has_node(seed_node):
             bias_strategy = BiasStrategies.ALPHA_DIFF if self.use_bias else BiasStrategies.EDGE_WEIGHT
             self.random_walks.run(seed_node, self.number_random_walks,
-                                  self.reset_probability, bias_strategy=bias_strategy, update_weight=self.update_weight)
+                                  self.reset_probability, bias_strategy=bias_strategy, update_weight=self.update_weight,
+                                  batch=True, executor=self.executor)
             self.reverse_walks.run(seed_node, self.number_random_walks, self.reset_probability,
-                                   back_random_walk=True,  bias_strategy=bias_strategy, update_weight=self.update_weight)
+                                   back_random_walk=True,  bias_strategy=bias_strategy, update_weight=self.update_weight,
+                                   batch=True, executor=self.executor)
+
+    def compute(self, seed_node: int, target_node: int) -> float:
+        if self.bidirectional and not self.update_weight:
+            return self._compute_bidirectional(seed_node, target_node)
 
+        self._prepare(seed_node, [target_node])
         # Process random walks with weighted PHT: number of hits of a target node
         pr1 = self.random_walks.get_number_of_hits(seed_node,
-                                                   target_node) / self.number_random_walks
-        pr2 = self.reverse_walks.get_number_of_hits(seed_node, target_node) / self.number_random_walks
+                                                   target_node) / self.random_walks.number_of_walks[seed_node]
+        pr2 = self.reverse_walks.get_number_of_hits(seed_node, target_node) / self.reverse_walks.number_of_walks[seed_node]
+        return pr1 - pr2
+
+    def compute_many(self, seed_node: int, target_nodes: List) -> np.ndarray:
+        """Scores of many target nodes from the hit counts of one forward and one reverse run of the seed.
+        The bidirectional estimator still answers target by target.
+        """
+        target_nodes = list(target_nodes)
+        if self.bidirectional and not self.update_weight:
+            # One snapshot for the whole batch, an unversioned graph is not refreezed per target
+            with self.random_walks.pinned(), self.reverse_walks.pinned():
+                return super().compute_many(seed_node, target_nodes)
+
+        self._prepare(seed_node, target_nodes)
+        pr1 = self.random_walks.get_number_of_hits_many(seed_node, target_nodes) \
+            / self.random_walks.number_of_walks[seed_node]
+        pr2 = self.reverse_walks.get_number_of_hits_many(seed_node, target_nodes) \
+            / self.reverse_walks.number_of_walks[seed_node]
         return pr1 - pr2
 
+    def update(self, changed_edges) -> None:
+        """Update the walks after edges of the graph were added or changed, see RandomWalks.update."""
+        changed_edges = list(changed_edges)
+        # The forward and the reverse walks of a seed must stay in sync
+        self.random_walks.update(changed_edges)
+        self.reverse_walks.update(changed_edges)
+        for seed_node in set(self.random_walks.number_of_walks) | set(self.reverse_walks.number_of_walks):
+            if not (self.random_walks.has_node(seed_node) and self.reverse_walks.has_node(seed_node)):
+                self.random_walks.forget(seed_node)
+                self.reverse_walks.forget(seed_node)
 
-class ReciprocalScaledPageRank:
+
+class ReciprocalScaledPageRank(NetContribMixin, BatchComputeMixin):
     
     def __init__(self, graph: nx.DiGraph,
                  base_number_of_walks: int = 10,
                  reset_probability: float = 0.1,
-                 alpha: float = 2.0
+                 alpha: float = 2.0,
+                 executor: Optional[Executor] = None,
+                 random_seed: Optional[int] = None,
+                 retain_walks: bool = False,
+                 bidirectional: bool = False,
+                 relative_error: float = 0.1
                  ) -> None:
         """
         This class implements the personalized pagerank scaled by the net contribution of the seed node and deducts
         the personalized PageRank of the source node from the seed node, again scaled by its net contribution.
+        With bidirectional set, each pair is answered by the bidirectional estimator of RandomWalks within the
+        relative error target, instead of full walk runs from both nodes.
         """
         self.graph = graph
         self.number_random_walks = base_number_of_walks
         self.reset_probability = reset_probability
         self.alpha = alpha
+        self.executor = executor
+        self.bidirectional = bidirectional
+        self.relative_error = relative_error
 
-        self.random_walks = RandomWalks(self.graph, alpha, base_number_of_walks)
+        self.random_walks = RandomWalks(self.graph, alpha, base_number_of_walks, retain_walks=retain_walks,
+                                        random_seed=random_seed)
 
-    def net_contrib(self, node: int) -> float:
-        return min(self.graph.out_degree(node, weight='weight'), 1000)
+    def _net_contrib(self, out_deg, in_deg):
+        return np.minimum(out_deg, 1000)
 
-    def compute(self, seed_node: int, target_node: int) -> float:
-        if not self.random_walks.has_node(seed_node):
-            self.random_walks.run(seed_node,
-                                  int(self.number_random_walks * self.net_contrib(seed_node)),
-                                  self.reset_probability)
+    def _scaled_visits(self, seed_node: int, target_node: int) -> float:
+        # Equals get_total_hits / number_random_walks of a full run of the seed node
+        number_of_walks = int(self.number_random_walks * self.net_contrib(seed_node))
+        visits = self.random_walks.estimate_visits(seed_node, target_node, self.reset_probability,
+                                                   relative_error=self.relative_error)
+        return number_of_walks * visits / self.number_random_walks
 
-        if not self.random_walks.has_node(target_node):
-            self.random_walks.run(target_node,
-                                  int(self.number_random_walks * self.net_contrib(target_node)),
-                                  self.reset_probability)
+    def compute(self, seed_node: int, target_node: int) -> float:
+        if self.bidirectional:
+            if seed_node == target_node:
+                return 0.0
+            with self.random_walks.pinned():
+                return self._scaled_visits(seed_node, target_node) - self._scaled_visits(target_node, seed_node)
+        return float(self.compute_many(seed_node, [target_node])[0])
+
+    def _run_node(self, node: int) -> None:
+        if not self.random_walks.has_node(node):
+            self.random_walks.run(node,
+                                  int(self.number_random_walks * self.net_contrib(node)),
+                                  self.reset_probability,
+                                  executor=self.executor)
 
-        pr1 = self.random_walks.get_total_hits(seed_node, target_node)
-        pr2 = self.random_walks.get_total_hits(target_node, seed_node)
+    def compute_many(self, seed_node: int, target_nodes: List) -> np.ndarray:
+        """Scores of many target nodes. The visits of the seed walks are read at once,
+        the visits of the seed on the walks of every target one by one.
+        """
+        target_nodes = list(target_nodes)
+        if self.bidirectional:
+            with self.random_walks.pinned():
+                return super().compute_many(seed_node, target_nodes)
+
+        self._run_node(seed_node)
+        for target_node in target_nodes:
+            self._run_node(target_node)
+
+        pr1 = self.random_walks.get_total_hits_many(seed_node, target_nodes)
+        pr2 = np.fromiter((self.random_walks.get_total_hits(target_node, seed_node) for target_node in target_nodes),
+                          dtype=np.float64, count=len(target_nodes))
         return pr1 / self.number_random_walks - pr2 / self.number_random_walks
 
+    def update(self, changed_edges) -> None:
+        """Update the walks after edges of the graph were added or changed, see RandomWalks.update."""
+        changed_edges = list(changed_edges)
+        # The number of walks of a seed depends on its net contribution, which changes with its own edges
+        for u, v in changed_edges:
+            self.random_walks.forget(u)
+            self.random_walks.forget(v)
+        self.random_walks.update(changed_edges)
+
 
 class WBPPageRank(ReciprocalScaledPageRank):
 
-    def net_contrib(self, node: int) -> float:
-        return min(self.alpha * (self.graph.out_degree(node, weight='weight') / 1000 + 1)
-                   - self.graph.in_degree(node, weight='weight') / 1000, 1000)
+    def _net_contrib(self, out_deg, in_deg):
+        return np.minimum(self.alpha * (out_deg / 1000 + 1) - in_deg / 1000, 1000)
 
 
-class SBPPageRank:
+class SBPPageRank(NetContribMixin, BatchComputeMixin):
 
     def __init__(self, graph: nx.DiGraph,
                  base_number_random_walks: int = 10,
@@ -141,25 +543,13 @@ class SBPPageRank:
         self.self_manage_penalties = self_manage_penalties
         self.alpha = alpha
 
-        self.random_walks = RandomWalks(self.graph, alpha, self.number_random_walks)
+        self.random_walks = RandomWalks(self.graph, alpha, self.number_random_walks, retain_walks=True)
 
-    def net_contrib(self, node: int) -> float:
-        return min(self.alpha * (self.graph.out_degree(node, weight='weight') + 1), 1000)
+    def _net_contrib(self, out_deg, in_deg):
+        return np.minimum(self.alpha * (out_deg + 1), 1000)
 
     def calculate_penalty(self, s, t, value):
-        encounters = defaultdict(int)
-        penalties = defaultdict(int)
-        for k in self.random_walks.random_walks[s]:
-            indexes = [i for i, x in enumerate(k) if x == t]
-            if indexes:
-                start_val = 1
-                for v in indexes:
-                    for p in range(start_val, v + 1):
-                        encounters[k[p]] += 1
-        # calculate fractions
-        for k, v in encounters.items():
-            penalties[k] += ceil(value * v / encounters[t])
-        return penalties
+        return self.random_walks.compute_penalties(s, {t: value})
 
     def add_penalties(self, seed_node, penalties):
         self.penalties[seed_node] = penalties
@@ -167,13 +557,12 @@ class SBPPageRank:
     def get_penalties(self, seed_node):
         if seed_node not in self.penalties:
             self.penalties[seed_node] = defaultdict(int)
-        for e, _, w in self.graph.in_edges(seed_node, data=True):
-            pen = self.calculate_penalty(seed_node, e, w['weight'])
-            for k, v in pen.items():
-                self.penalties[seed_node][k] += v
+        in_weights = {e: w['weight'] for e, _, w in self.graph.in_edges(seed_node, data=True)}
+        for k, v in self.random_walks.compute_penalties(seed_node, in_weights).items():
+            self.penalties[seed_node][k] += v
         return self.penalties[seed_node]
 
-    def compute(self, seed_node: int, target_node: int) -> float:
+    def _run_seed(self, seed_node: int) -> None:
         if not self.random_walks.has_node(seed_node):
             self.random_walks.run(seed_node,
                                   int(self.number_random_walks * self.net_contrib(seed_node)),
@@ -193,6 +582,7 @@ class SBPPageRank:
                                       update_weight=False
                                       )
 
+    def _run_target(self, target_node: int) -> None:
         if not self.random_walks.has_node(target_node):
             self.random_walks.run(target_node,
                                   int(self.number_random_walks * self.net_contrib(target_node)),
@@ -202,7 +592,23 @@ class SBPPageRank:
                                   update_weight=False
                                   )
 
-        penalty = 0.0 if not self.penalties.get(seed_node) else self.penalties[seed_node].get(target_node, 0)
-        pr1 = self.random_walks.get_total_hits(seed_node, target_node) - penalty / self.alpha
-        pr2 = self.random_walks.get_total_hits(target_node, seed_node)
+    def compute(self, seed_node: int, target_node: int) -> float:
+        return float(self.compute_many(seed_node, [target_node])[0])
+
+    def compute_many(self, seed_node: int, target_nodes: List) -> np.ndarray:
+        """Scores of many target nodes. The visits of the seed walks are read at once,
+        the visits of the seed on the walks of every target one by one.
+        """
+        target_nodes = list(target_nodes)
+        self._run_seed(seed_node)
+        for target_node in target_nodes:
+            self._run_target(target_node)
+
+        pr1 = self.random_walks.get_total_hits_many(seed_node, target_nodes).astype(np.float64)
+        penalties = self.penalties.get(seed_node)
+        if penalties:
+            pr1 -= np.fromiter((penalties.get(target_node, 0) for target_node in target_nodes),
+                               dtype=np.float64, count=len(target_nodes)) / self.alpha
+        pr2 = np.fromiter((self.random_walks.get_total_hits(target_node, seed_node) for target_node in target_nodes),
+                          dtype=np.float64, count=len(target_nodes))
         return pr1 - pr2
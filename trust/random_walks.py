@@ -1,12 +1,23 @@
 import networkx as nx
 import numpy as np
 
-from collections import Counter, defaultdict
+from collections import Counter, defaultdict, deque
+import os
 import random
-from typing import Callable, Optional, Dict, List
+from concurrent.futures import Executor
+from contextlib import contextmanager
+from math import ceil
+from statistics import NormalDist
+from typing import Dict, Iterable, List, Mapping, Optional, Tuple
 
 from enum import Enum
 
+from .csr_graph import AliasTable, CSRGraph, FenwickRows, graph_version, is_current
+from .walk_storage import EdgeCounts, NodeCounts, Walks
+
+# Number of walks generated at once by runs that do not retain their walks
+STREAM_CHUNK_SIZE = 4096
+
 
 class BiasStrategies(Enum):
     ALPHA_DIFF = 1
@@ -16,23 +27,38 @@ class BiasStrategies(Enum):
 
 class RandomWalks:
 
-    def __init__(self, graph: nx.DiGraph, alpha: float = 1.0, base_number_random_walks: int = 1000) -> None:
+    def __init__(self, graph: nx.DiGraph, alpha: float = 1.0, base_number_random_walks: int = 1000,
+                 retain_walks: bool = True, random_seed: Optional[int] = None) -> None:
         """Calcalate the random walks for a given graph.
         @param graph: The graph to calculate the random walks for.
         @param alpha: Score value used for the bias.
         @param base_number_random_walks: The number of random walks to run.
+        @param retain_walks: If false, only the visit and hit tallies of a run are kept (default: True).
+        @param random_seed: Seed of the RNG streams of the walks. If none, the streams are seeded from the global
+        random module (default: None).
         """
         self.alpha = alpha
         self.graph = graph
+        self.retain_walks = retain_walks
 
         self.random_walks = {}
         self.counters = {}
-        self.num_edge_walks = defaultdict(int)
         self.hits = {}
         self.number_of_walks = {}
+        self.run_params = {}
         self.base_number_of_random_walks = base_number_random_walks
 
         self.penalties = defaultdict(int)
+        self._csr = None
+        self._pinned = None
+        self._edge_walks = None
+        # Edge counts of the single walks over the adjacency dicts of an unversioned graph
+        self._dict_edge_walks = Counter()
+        self._bounded = None
+        self._seed_source = random if random_seed is None else random.Random(random_seed)
+        # Reverse push states of the bidirectional estimator, valid for one CSR snapshot
+        self._push_csr = None
+        self._push_states = {}
 
     def bias(self, u: int, v: int, cur_weight: float = None, revert: bool = False) -> float:
         """Score function for random walk.
@@ -75,7 +101,7 @@ class RandomWalks:
         @param revert: If true, make a reverse walk (default: False).
         @return: The score."""
         val = self.base_number_of_random_walks * self.weight(current_node, neigh, cur_weight, revert)
-        return 0.0 if self.num_edge_walks[(current_node, neigh)] \
+        return 0.0 if self.num_edge_walks.get((current_node, neigh), 0) \
                       + self.base_number_of_random_walks * int(
             self.penalties.get(neigh, 0) / self.alpha) >= val else val
 
@@ -85,41 +111,153 @@ class RandomWalks:
         except nx.NetworkXError as _:
             return []
 
+    @property
+    def num_edge_walks(self) -> Mapping:
+        """Number of walks of the current run over every edge, keyed by (from node, to node) in walk direction."""
+        return self._dict_edge_walks if self._edge_walks is None else self._edge_walks
+
+    def _edge_counts(self, csr: CSRGraph, back_random_walk: bool) -> EdgeCounts:
+        adj = csr.adjacency(back_random_walk)
+        if self._edge_walks is None:
+            self._edge_walks = EdgeCounts(csr.nodes, csr.index, adj)
+        elif self._edge_walks.adjacency is not adj:
+            self._edge_walks = self._edge_walks.rebase(csr.nodes, csr.index, adj)
+        return self._edge_walks
+
+    def _bounded_weights(self, csr: CSRGraph, back_random_walk: bool) -> 'BoundedWeights':
+        edge_counts = self._edge_counts(csr, back_random_walk)
+        if self._bounded is None or self._bounded.edge_counts is not edge_counts \
+                or self._bounded.penalties is not self.penalties:
+            self._bounded = BoundedWeights(edge_counts, self.base_number_of_random_walks, self.alpha, self.penalties)
+        return self._bounded
+
+    @property
+    def csr(self) -> CSRGraph:
+        """CSR snapshot of the graph, refreezed only when the graph changes (always for unversioned graphs),
+        unless a snapshot is pinned.
+        """
+        if self._pinned is not None:
+            return self._pinned
+        if self._csr is None or not is_current(self._csr.version, self.graph):
+            self._csr = CSRGraph.frozen(self.graph)
+        return self._csr
+
+    @contextmanager
+    def pinned(self):
+        """Use one CSR snapshot for every call inside the block, also on an unversioned graph.
+        The graph must not change inside the block. Nested blocks keep the outer snapshot.
+        """
+        if self._pinned is not None:
+            yield self._pinned
+            return
+        self._pinned = self.csr
+        try:
+            yield self._pinned
+        finally:
+            self._pinned = None
+
+    def _edge_weights(self, csr: CSRGraph, current: int, bias_strategy: BiasStrategies,
+                      cur_weight: float, back_random_walk: bool) -> np.ndarray:
+        """Vectorized version of the weight functions over all out-edges of the current node."""
+        if bias_strategy == BiasStrategies.EDGE_WEIGHT_BOUNDED:
+            return self._bounded_weights(csr, back_random_walk).weights(current, cur_weight)
+        adj = csr.adjacency(back_random_walk)
+        start, end = adj.offsets[current], adj.offsets[current + 1]
+        if bias_strategy == BiasStrategies.ALPHA_DIFF:
+            weights = adj.alpha_diff(self.alpha)[0][start:end]
+        else:
+            weights = adj.weights[start:end]
+        return np.minimum(weights, cur_weight)
+
     def _compute_random_walks(self,
-                              seed_node: int,
-                              weight_func: Callable[[int, int, Optional[float], Optional[bool]], float],
+                              seed_id: int,
+                              bias_strategy: BiasStrategies,
                               reset_probability: float,
-                              back_random_walk: bool = False,
-                              update_weight: bool = False
-                              ) -> List:
+                              back_random_walk: bool,
+                              update_weight: bool,
+                              csr: CSRGraph,
+                              rng: random.Random = random,
+                              cur_weight: float = float('inf')
+                              ) -> List[int]:
+        adj = csr.adjacency(back_random_walk)
+        random_walk = [seed_id]
+        current = seed_id
+        # Without weight bounds the edge weights never change during a walk, so the next hop is drawn in O(1)
+        # from a precomputed alias table. Otherwise the weights are recomputed and binary searched at every step.
+        static = bias_strategy != BiasStrategies.EDGE_WEIGHT_BOUNDED and not update_weight
+        if static:
+            cum_weights = self._batch_cum_weights(csr, bias_strategy, back_random_walk)
+            alias_table = self._alias_table(csr, bias_strategy, back_random_walk)
+        # Bounded walks only close the edge just taken, so their open weights are kept in Fenwick trees
+        bounded = self._bounded_weights(csr, back_random_walk) \
+            if bias_strategy == BiasStrategies.EDGE_WEIGHT_BOUNDED else None
+        edge_counts = self._edge_counts(csr, back_random_walk).counts
+        c = rng.uniform(0, 1)
+
+        while c > reset_probability and adj.offsets[current] < adj.offsets[current + 1]:
+            start = adj.offsets[current]
+            if static:
+                if cum_weights[adj.offsets[current + 1] - 1] == 0:
+                    break
+                position = alias_table.sample(current, rng)
+            elif bounded is not None and not update_weight:
+                position = bounded.sample(current, rng)
+                if position < 0:
+                    break
+            else:
+                current_edge_weights = self._edge_weights(csr, current, bias_strategy, cur_weight, back_random_walk)
+                cumulated_edge_weights = np.cumsum(current_edge_weights)
+                if cumulated_edge_weights[-1] == 0:
+                    break
+                random_id = int(np.searchsorted(cumulated_edge_weights,
+                                                rng.uniform(0, 1) * cumulated_edge_weights[-1]))
+                position = start + random_id
+                if update_weight:
+                    cur_weight = min(current_edge_weights[random_id], cur_weight)
+
+            next_id = int(adj.indices[position])
+            edge_counts[position] += 1
+            if bounded is not None:
+                bounded.update(position)
+            random_walk.append(next_id)
+            current = next_id
+
+            c = rng.uniform(0, 1)
+        return random_walk
+
+    def _compute_dict_walk(self,
+                           seed_node: int,
+                           bias_strategy: BiasStrategies,
+                           reset_probability: float,
+                           back_random_walk: bool,
+                           update_weight: bool,
+                           rng: random.Random = random) -> List:
+        """One walk over the networkx adjacency dicts with the score functions, for unversioned graphs."""
+        w_func = {BiasStrategies.ALPHA_DIFF: self.bias,
+                  BiasStrategies.EDGE_WEIGHT: self.weight,
+                  BiasStrategies.EDGE_WEIGHT_BOUNDED: self.edge_weight_bounded}[bias_strategy]
         random_walk = [seed_node]
-        cur_weight = float('inf')
-        c = random.uniform(0, 1)
-
-        while c > reset_probability and len(self.neigh(random_walk[-1], back_random_walk)) > 0:
-            current_node = random_walk[-1]
-            current_neighbors = self.neigh(current_node, back_random_walk)
-            current_edge_weights = np.array(
-                [weight_func(current_node, neighbor, cur_weight, back_random_walk) for neighbor in current_neighbors])
-            cumulated_edge_weights = np.cumsum(current_edge_weights)
+        current, cur_weight = seed_node, float('inf')
+        c = rng.uniform(0, 1)
 
+        while c > reset_probability:
+            neighbors = self.neigh(current, back_random_walk)
+            if not neighbors:
+                break
+            current_edge_weights = [w_func(current, v, cur_weight, back_random_walk) for v in neighbors]
+            cumulated_edge_weights = np.cumsum(current_edge_weights)
             if cumulated_edge_weights[-1] == 0:
                 break
-
-            random_id = list(
-                cumulated_edge_weights < (random.uniform(0, 1) * cumulated_edge_weights[-1])).index(
-                False)
-            next_node = current_neighbors[random_id]
+            random_id = int(np.searchsorted(cumulated_edge_weights, rng.uniform(0, 1) * cumulated_edge_weights[-1]))
             if update_weight:
                 cur_weight = min(current_edge_weights[random_id], cur_weight)
-            self.num_edge_walks[(current_node, next_node)] += 1
-            random_walk.append(next_node)
 
-            c = random.uniform(0, 1)
-        if seed_node not in self.random_walks:
-            self.random_walks[seed_node] = []
+            next_node = neighbors[random_id]
+            self._dict_edge_walks[(current, next_node)] += 1
+            random_walk.append(next_node)
+            current = next_node
 
-        self.random_walks[seed_node].append(random_walk)
+            c = rng.uniform(0, 1)
         return random_walk
 
     def run_one_walk(self,
@@ -138,20 +276,160 @@ class RandomWalks:
         @param penalties: The penalties for each node. (default: None)
         @return: The list of nodes in the random walk.
         """
-        w_func = None
-        if bias_strategy == BiasStrategies.ALPHA_DIFF:
-            w_func = self.bias
-        elif bias_strategy == BiasStrategies.EDGE_WEIGHT:
-            w_func = self.weight
-        elif bias_strategy == BiasStrategies.EDGE_WEIGHT_BOUNDED:
-            w_func = self.edge_weight_bounded
-
         if penalties:
             self.penalties = penalties
 
-        return self._compute_random_walks(seed_node, w_func,
-                                          reset_probability, back_random_walk,
-                                          update_weight)
+        if self._pinned is None and graph_version(self.graph) is None:
+            # A snapshot of an unversioned graph would be rebuilt for every walk, a single walk is cheaper on the dicts
+            random_walk = self._compute_dict_walk(seed_node, bias_strategy, reset_probability, back_random_walk,
+                                                  update_weight, self._seed_source)
+            nodes, index = [], {}
+        else:
+            csr = self.csr
+            nodes, index = csr.nodes, csr.index
+            seed_id = csr.index.get(seed_node)
+            if seed_id is None:
+                random_walk = [seed_node]
+            else:
+                random_walk = [csr.nodes[i] for i in self._compute_random_walks(seed_id, bias_strategy,
+                                                                                reset_probability, back_random_walk,
+                                                                                update_weight, csr,
+                                                                                self._seed_source)]
+        if not self.retain_walks:
+            return random_walk
+        if seed_node not in self.random_walks:
+            self.random_walks[seed_node] = Walks(nodes, index,
+                                                 np.empty(0, dtype=np.int32), np.zeros(1, dtype=np.int64))
+        self.random_walks[seed_node].append(random_walk)
+        return random_walk
+
+    def _batch_cum_weights(self, csr: CSRGraph, bias_strategy: BiasStrategies,
+                           back_random_walk: bool) -> np.ndarray:
+        adj = csr.adjacency(back_random_walk)
+        if bias_strategy == BiasStrategies.ALPHA_DIFF:
+            return adj.alpha_diff(self.alpha)[1]
+        return adj.cum_weights
+
+    def _alias_table(self, csr: CSRGraph, bias_strategy: BiasStrategies, back_random_walk: bool) -> AliasTable:
+        adj = csr.adjacency(back_random_walk)
+        return adj.alias_table(self.alpha if bias_strategy == BiasStrategies.ALPHA_DIFF else None)
+
+    def _compute_batch_walks(self,
+                             seed_id: int,
+                             num_random_walks: int,
+                             reset_probability: float,
+                             back_random_walk: bool,
+                             bias_strategy: BiasStrategies,
+                             csr: CSRGraph,
+                             rng: np.random.Generator
+                             ) -> Tuple[np.ndarray, np.ndarray]:
+        """Advance all walks of a batch in lock-step.
+        The number of steps before the reset of every walk is drawn up front from a geometric distribution.
+        Each iteration samples the next hop of all still active walks at once and drops the finished walks.
+        Only valid for strategies where the edge weights do not depend on the other walks.
+        @return: The flat node ids of all walks and the offsets of every walk.
+        """
+        adj = csr.adjacency(back_random_walk)
+        cum_weights = self._batch_cum_weights(csr, bias_strategy, back_random_walk)
+        alias_table = self._alias_table(csr, bias_strategy, back_random_walk)
+
+        # A walk makes a step with probability 1 - reset_probability
+        lengths = rng.geometric(reset_probability, num_random_walks) - 1
+        walk_ids = [np.arange(num_random_walks)]
+        node_ids = [np.full(num_random_walks, seed_id, dtype=np.int32)]
+        edge_ids = []
+        active = walk_ids[0][lengths > 0]
+        current = np.full(len(active), seed_id, dtype=np.int32)
+        step = 0
+        while len(active) > 0:
+            totals = adj.row_totals(cum_weights, current)
+            alive = totals > 0
+            active, current, totals = active[alive], current[alive], totals[alive]
+            positions = alias_table.sample_many(current, rng)
+            current = adj.indices[positions]
+            walk_ids.append(active)
+            node_ids.append(current)
+            edge_ids.append(positions)
+
+            step += 1
+            unfinished = lengths[active] > step
+            active, current = active[unfinished], current[unfinished]
+
+        if edge_ids:
+            self._edge_counts(csr, back_random_walk).counts += np.bincount(np.concatenate(edge_ids),
+                                                                           minlength=len(adj.indices))
+
+        # Sorting by walk id keeps the step order within every walk
+        walk_ids = np.concatenate(walk_ids)
+        order = np.argsort(walk_ids, kind='stable')
+        offsets = np.concatenate(([0], np.cumsum(np.bincount(walk_ids, minlength=num_random_walks))))
+        return np.concatenate(node_ids)[order], offsets
+
+    def _generate_walks(self,
+                        seed_node: int,
+                        num_random_walks: int,
+                        reset_probability: float,
+                        back_random_walk: bool,
+                        bias_strategy: BiasStrategies,
+                        update_weight: bool,
+                        batch: bool,
+                        csr: CSRGraph,
+                        seed_sequence: np.random.SeedSequence
+                        ) -> Walks:
+        """Generate a block of walks that draws from the RNG stream of its seed sequence."""
+        seed_id = csr.index.get(seed_node)
+        if seed_id is None:
+            # A seed outside of the graph only visits itself
+            return Walks([seed_node], {seed_node: 0},
+                         np.zeros(num_random_walks, dtype=np.int32), np.arange(num_random_walks + 1))
+        if batch and not update_weight and bias_strategy != BiasStrategies.EDGE_WEIGHT_BOUNDED:
+            node_ids, offsets = self._compute_batch_walks(seed_id, num_random_walks, reset_probability,
+                                                          back_random_walk, bias_strategy, csr,
+                                                          np.random.default_rng(seed_sequence))
+            return Walks(csr.nodes, csr.index, node_ids, offsets)
+        rng = random.Random(int(seed_sequence.generate_state(1, np.uint64)[0]))
+        return Walks.from_id_lists(csr.nodes, csr.index,
+                                   [self._compute_random_walks(seed_id, bias_strategy,
+                                                               reset_probability, back_random_walk,
+                                                               update_weight, csr, rng)
+                                    for _ in range(num_random_walks)])
+
+    def _walk_blocks(self, num_random_walks: int) -> Tuple[List[int], List[np.random.SeedSequence]]:
+        """Split the walks into blocks of STREAM_CHUNK_SIZE walks, each with its own RNG stream spawned from one seed.
+        Local and parallel runs use the same blocks, so a run gives the same walks with or without an executor.
+        """
+        sizes = [min(STREAM_CHUNK_SIZE, num_random_walks - start)
+                 for start in range(0, num_random_walks, STREAM_CHUNK_SIZE)]
+        return sizes, np.random.SeedSequence(self._seed_source.getrandbits(64)).spawn(len(sizes))
+
+    def _run_parallel(self,
+                      executor: Executor,
+                      seed_node: int,
+                      num_random_walks: int,
+                      reset_probability: float,
+                      back_random_walk: bool,
+                      bias_strategy: BiasStrategies,
+                      update_weight: bool,
+                      batch: bool,
+                      csr: CSRGraph,
+                      visits: np.ndarray,
+                      hits: np.ndarray) -> None:
+        """Run the blocks of walks on the executor and add up the tallies.
+        The blocks are grouped into one task per CPU, so the CSR snapshot is shipped about once per worker of a pool
+        of the default size. Executors do not expose their number of workers.
+        """
+        sizes, seed_sequences = self._walk_blocks(num_random_walks)
+        per_task = max(1, ceil(len(sizes) / (os.cpu_count() or 1)))
+        params = (seed_node, reset_probability, back_random_walk, bias_strategy, update_weight, batch)
+        futures = [executor.submit(_run_walk_blocks, csr, self.alpha, self.base_number_of_random_walks, params,
+                                   sizes[i:i + per_task], seed_sequences[i:i + per_task])
+                   for i in range(0, len(sizes), per_task)]
+        for future in futures:
+            block_visits, block_hits, edge_walks = future.result()
+            visits += block_visits
+            hits += block_hits
+            if edge_walks is not None:
+                self._edge_counts(csr, back_random_walk).counts += edge_walks
 
     def run(self,
             seed_node: int,
@@ -160,9 +438,13 @@ class RandomWalks:
             back_random_walk: bool = False,
             bias_strategy: BiasStrategies = BiasStrategies.EDGE_WEIGHT,
             update_weight: bool = False,
-            penalties: Dict[int, int] = None
+            penalties: Dict[int, int] = None,
+            batch: bool = False,
+            executor: Optional[Executor] = None
             ) -> None:
         """Run multiple random walks.
+        The walks are stored as flat arrays of node ids, see Walks. Without walk retention the walks are generated
+        in blocks that are folded into the visit and hit tallies and discarded right away.
         @param seed_node: The seed node.
         @param num_random_walks: The number of random walks to run.
         @param reset_probability: The probability of resetting the random walk.
@@ -170,20 +452,332 @@ class RandomWalks:
         @param bias_strategy: The strategy to use for the bias. (default: BiasStrategies.EDGE_WEIGHT)
         @param update_weight: If true, the weight bounds are used. (default: False)
         @param penalties: The penalties for each node. (default: None)
+        @param batch: If true, advance all walks together with NumPy. Only used for the EDGE_WEIGHT and ALPHA_DIFF
+        strategies without weight bounds, other runs fall back to one walk at a time. (default: False)
+        @param executor: Process pool to split the walks over. Every block of walks draws from its own RNG stream
+        spawned from one seed, so the result does not depend on the number of workers. Runs that retain their walks
+        or use the EDGE_WEIGHT_BOUNDED strategy, where walks depend on each other, run locally. (default: None)
+        """
+        self._edge_walks = None
+        self._dict_edge_walks = Counter()
+        self._bounded = None
+        if penalties:
+            self.penalties = penalties
+        csr = self.csr
+        if seed_node in csr.index:
+            nodes, index = csr.nodes, csr.index
+        else:
+            nodes, index = [seed_node], {seed_node: 0}
+
+        if self.retain_walks:
+            self.random_walks[seed_node] = Walks(nodes, index,
+                                                 np.empty(0, dtype=np.int32), np.zeros(1, dtype=np.int64))
+        else:
+            self.random_walks.pop(seed_node, None)
+        self.number_of_walks[seed_node] = 0
+        self.counters[seed_node] = NodeCounts(nodes, index, np.zeros(len(nodes), dtype=np.int64))
+        self.hits[seed_node] = NodeCounts(nodes, index, np.zeros(len(nodes), dtype=np.int64))
+        # The graph version and penalties are kept as well, run_until only continues runs that are still current
+        self.run_params[seed_node] = dict(num_random_walks=0, reset_probability=reset_probability,
+                                          back_random_walk=back_random_walk, bias_strategy=bias_strategy,
+                                          update_weight=update_weight, batch=batch,
+                                          penalties=None if penalties is None else dict(penalties),
+                                          version=csr.version)
+        self._add_walks(seed_node, num_random_walks, csr, executor)
+
+    def _add_walks(self, seed_node: int, num_random_walks: int, csr: CSRGraph,
+                   executor: Optional[Executor] = None) -> None:
+        """Generate more walks with the parameters of the run of a seed node and fold them into its tallies."""
+        params = self.run_params[seed_node]
+        visits, hits = self.counters[seed_node].counts, self.hits[seed_node].counts
+        walk_params = (params['reset_probability'], params['back_random_walk'], params['bias_strategy'],
+                       params['update_weight'], params['batch'])
+
+        if executor is not None and not self.retain_walks \
+                and params['bias_strategy'] != BiasStrategies.EDGE_WEIGHT_BOUNDED:
+            self._run_parallel(executor, seed_node, num_random_walks, *walk_params, csr, visits, hits)
+        else:
+            for size, seed_sequence in zip(*self._walk_blocks(num_random_walks)):
+                walks = self._generate_walks(seed_node, size, *walk_params, csr, seed_sequence)
+                visits += walks.visit_counts().counts
+                hits += walks.hit_counts().counts
+                if self.retain_walks:
+                    self.random_walks[seed_node].extend(walks)
+
+        self.number_of_walks[seed_node] += num_random_walks
+        params['num_random_walks'] = self.number_of_walks[seed_node]
+
+    def run_until(self,
+                  seed_node: int,
+                  epsilon: float,
+                  confidence: float = 0.95,
+                  targets: Optional[List] = None,
+                  top_k: Optional[int] = None,
+                  max_random_walks: int = 100000,
+                  round_size: int = 1000,
+                  executor: Optional[Executor] = None,
+                  **run_params) -> int:
+        """Run random walks in rounds until the hit probabilities of the tracked nodes are precise enough.
+        After every round the Wilson score interval of hits / walks is computed for the tracked nodes, and the run stops
+        once every interval half-width is at most epsilon or the walk budget is spent. A run of the seed node with the
+        same parameters and penalties on the current graph version is continued instead of started over, runs on an
+        unversioned graph always start over.
+        @param seed_node: The seed node.
+        @param epsilon: The target half-width of the confidence intervals.
+        @param confidence: The confidence level of the intervals (default: 0.95).
+        @param targets: The nodes to track. If none, the top_k nodes by hits or all nodes are tracked (default: None).
+        @param top_k: Track the k nodes with the most hits (default: None).
+        @param max_random_walks: The walk budget of the seed node (default: 100000).
+        @param round_size: The number of walks per round (default: 1000).
+        @param executor: Process pool to run the rounds on, see run (default: None).
+        @param run_params: Parameters of the walks, as for run.
+        @return: The number of walks used for the seed node.
+        """
+        params = dict(reset_probability=0.33, back_random_walk=False, bias_strategy=BiasStrategies.EDGE_WEIGHT,
+                      update_weight=False, penalties=None, batch=False)
+        params.update(run_params)
+        csr = self.csr
+        previous = self.run_params.get(seed_node)
+        if previous is None or not is_current(previous['version'], self.graph) \
+                or any(previous[k] != v for k, v in params.items()):
+            self.run(seed_node, 0, **params)
+        z = NormalDist().inv_cdf((1 + confidence) / 2)
+        while self.number_of_walks[seed_node] < max_random_walks \
+                and self._max_half_width(seed_node, z, targets, top_k) > epsilon:
+            self._add_walks(seed_node, min(round_size, max_random_walks - self.number_of_walks[seed_node]),
+                            csr, executor)
+        return self.number_of_walks[seed_node]
+
+    def _max_half_width(self, seed_node: int, z: float, targets: Optional[List], top_k: Optional[int]) -> float:
+        n = self.number_of_walks[seed_node]
+        if n == 0:
+            return float('inf')
+        if targets is not None:
+            tracked = np.array([self.get_number_of_hits(seed_node, t) for t in targets], dtype=np.float64)
+        elif top_k is not None:
+            counts = self.hits[seed_node].counts
+            tracked = np.sort(counts)[-top_k:].astype(np.float64)
+        else:
+            tracked = self.hits[seed_node].counts.astype(np.float64)
+        if len(tracked) == 0:
+            return 0.0
+        p = tracked / n
+        return float(np.max(z / (1 + z * z / n) * np.sqrt(p * (1 - p) / n + z * z / (4 * n * n))))
+
+    def _reverse_push(self, csr: CSRGraph, target_id: int, reset_probability: float, back_random_walk: bool,
+                      bias_strategy: BiasStrategies, residual_threshold: float) -> Dict:
+        """Reverse push from a target for the expected number of visits v(u, t) of the target by a walk from u.
+        Keeps the invariant v(u, t) = estimate[u] + sum_w V(u, w) * residual[w], where V(u, w) is the expected number
+        of visits of w by a walk from u, and pushes until no residual exceeds the threshold.
         """
-        self.num_edge_walks = defaultdict(int)
-        self.random_walks[seed_node] = []
-        for n in range(num_random_walks):
-            self.run_one_walk(seed_node, reset_probability,
-                              back_random_walk, bias_strategy,
-                              update_weight, penalties)
+        if self._push_csr is not csr:
+            self._push_csr, self._push_states = csr, {}
+        key = (target_id, reset_probability, back_random_walk, bias_strategy, residual_threshold)
+        state = self._push_states.get(key)
+        if state is not None:
+            return state
 
-        self.number_of_walks[seed_node] = num_random_walks
-        self.counters[seed_node] = Counter(x for xs in self.random_walks[seed_node] for x in xs)
-        self.hits[seed_node] = Counter(x for xs in self.random_walks[seed_node] for x in set(xs))
+        # The walk steps over the edges of one adjacency, the other one lists the same edges by their end node
+        walk_adj, in_adj = csr.adjacency(back_random_walk), csr.adjacency(not back_random_walk)
+        if bias_strategy == BiasStrategies.ALPHA_DIFF:
+            walk_weights, in_weights = walk_adj.alpha_diff(self.alpha)[0], in_adj.alpha_diff(self.alpha)[0]
+        else:
+            walk_weights, in_weights = walk_adj.weights, in_adj.weights
+        totals = np.bincount(walk_adj.sources, weights=walk_weights, minlength=len(csr))[in_adj.indices]
+        in_probabilities = (1 - reset_probability) * np.divide(in_weights, totals, out=np.zeros_like(totals),
+                                                               where=totals > 0)
+
+        estimate, residual = np.zeros(len(csr)), np.zeros(len(csr))
+        residual[target_id] = 1.0
+        queued = np.zeros(len(csr), dtype=bool)
+        queue = deque([target_id])
+        queued[target_id] = True
+        while queue:
+            w = queue.popleft()
+            queued[w] = False
+            r, residual[w] = residual[w], 0.0
+            estimate[w] += r
+            start, end = in_adj.offsets[w], in_adj.offsets[w + 1]
+            sources = in_adj.indices[start:end]
+            residual[sources] += r * in_probabilities[start:end]
+            new = sources[(residual[sources] > residual_threshold) & ~queued[sources]]
+            queued[new] = True
+            queue.extend(new.tolist())
+        state = self._push_states[key] = dict(estimate=estimate, residual=residual, self_visits=None)
+        return state
+
+    def estimate_visits(self,
+                        seed_node: int,
+                        target_node: int,
+                        reset_probability: float = 0.33,
+                        back_random_walk: bool = False,
+                        bias_strategy: BiasStrategies = BiasStrategies.EDGE_WEIGHT,
+                        relative_error: float = 0.1,
+                        confidence: float = 0.95,
+                        residual_threshold: float = 1.0e-3,
+                        round_size: int = 1000,
+                        max_random_walks: int = 100000) -> float:
+        """Bidirectional (BiPPR style) estimate of the expected number of visits of the target by one walk from the
+        seed, i.e. get_total_hits / number of walks of a full run.
+        A reverse push from the target, kept per target, leaves residuals of at most residual_threshold. Rounds of
+        forward walks from the seed then add up the residuals they visit, until the confidence interval of the
+        estimate is within relative_error of it or the walk budget is spent.
+        @param seed_node: The seed node.
+        @param target_node: The target node.
+        @param reset_probability: The probability of resetting the random walk.
+        @param back_random_walk: If true, estimate for reverse walks (default: False).
+        @param bias_strategy: EDGE_WEIGHT or ALPHA_DIFF (default: BiasStrategies.EDGE_WEIGHT)
+        @param relative_error: The target relative half-width of the confidence interval (default: 0.1).
+        @param confidence: The confidence level of the interval (default: 0.95).
+        @param residual_threshold: The residual threshold of the reverse push (default: 1e-3).
+        @param round_size: The number of forward walks per round (default: 1000).
+        @param max_random_walks: The forward walk budget (default: 100000).
+        @return: The estimated expected number of visits.
+        """
+        csr = self.csr
+        seed_id, target_id = csr.index.get(seed_node), csr.index.get(target_node)
+        if seed_id is None or target_id is None:
+            return float(seed_node == target_node)
+        state = self._reverse_push(csr, target_id, reset_probability, back_random_walk, bias_strategy,
+                                   residual_threshold)
+        estimate, residual = state['estimate'][seed_id], state['residual']
+        if not residual.any():
+            return float(estimate)
+
+        z = NormalDist().inv_cdf((1 + confidence) / 2)
+        rng = np.random.default_rng(self._seed_source.getrandbits(64))
+        n, total, total_sq = 0, 0.0, 0.0
+        while n < max_random_walks:
+            size = min(round_size, max_random_walks - n)
+            node_ids, offsets = self._compute_batch_walks(seed_id, size, reset_probability, back_random_walk,
+                                                          bias_strategy, csr, rng)
+            residual_sums = np.add.reduceat(residual[node_ids], offsets[:-1])
+            n, total, total_sq = n + size, total + residual_sums.sum(), total_sq + np.square(residual_sums).sum()
+            mean = total / n
+            if z * np.sqrt(max(total_sq / n - mean * mean, 0.0) / n) <= relative_error * (estimate + mean):
+                break
+        return float(estimate + total / n)
+
+    def estimate_hit_probability(self, seed_node: int, target_node: int, **estimate_params) -> float:
+        """Bidirectional estimate of the probability that a walk from the seed visits the target,
+        i.e. get_number_of_hits / number of walks of a full run. Equals v(s, t) / v(t, t) for the expected number
+        of visits v, see estimate_visits for the parameters.
+        """
+        if seed_node == target_node:
+            return 1.0
+        # Both estimates share the reverse push of one snapshot, also on a graph without a version
+        with self.pinned() as csr:
+            visits = self.estimate_visits(seed_node, target_node, **estimate_params)
+            if visits == 0:
+                return 0.0
+            state = self._push_states[(csr.index[target_node], estimate_params.get('reset_probability', 0.33),
+                                       estimate_params.get('back_random_walk', False),
+                                       estimate_params.get('bias_strategy', BiasStrategies.EDGE_WEIGHT),
+                                       estimate_params.get('residual_threshold', 1.0e-3))]
+            if state['self_visits'] is None:
+                state['self_visits'] = self.estimate_visits(target_node, target_node, **estimate_params)
+            return min(visits / state['self_visits'], 1.0)
+
+    def forget(self, seed_node: int) -> None:
+        """Drop the walks and tallies of a seed node."""
+        for store in (self.random_walks, self.counters, self.hits, self.number_of_walks, self.run_params):
+            store.pop(seed_node, None)
+
+    def update(self, changed_edges: Iterable[Tuple]) -> None:
+        """Bring the walks of all seeds up to date after edges of the graph were added or changed.
+        Only the stored walks that visit a node whose transition probabilities changed are re-sampled, starting from
+        their first visit of such a node, and the visit and hit tallies are patched in place.
+        Seeds whose walks were not retained or depend on each other (EDGE_WEIGHT_BOUNDED) are dropped instead,
+        so that has_node() is false and the trust functions run them again on demand. With retain_walks off, as the
+        trust functions default to, an update therefore only forgets the seeds and saves no walks.
+        @param changed_edges: (source, target) pairs of the added or changed edges.
+        """
+        changed_edges = list(changed_edges)
+        if not changed_edges:
+            return
+        csr = self.csr
+        for seed_node, params in list(self.run_params.items()):
+            walks = self.random_walks.get(seed_node)
+            if walks is None or params['bias_strategy'] == BiasStrategies.EDGE_WEIGHT_BOUNDED \
+                    or not walks.rebase(csr.nodes, csr.index):
+                self.forget(seed_node)
+            else:
+                self._patch_walks(seed_node, walks, changed_edges, csr, params)
+                params['version'] = csr.version
+
+    def _patch_walks(self, seed_node: int, walks: Walks, changed_edges: List[Tuple], csr: CSRGraph,
+                     params: Dict) -> None:
+        back_random_walk, bias_strategy = params['back_random_walk'], params['bias_strategy']
+        affected = set()
+        for u, v in changed_edges:
+            # Walking forward the edge changes the probabilities out of u, walking backward those out of v.
+            # The ALPHA_DIFF weight of an edge also depends on the opposite edge.
+            if bias_strategy == BiasStrategies.ALPHA_DIFF:
+                affected.update((u, v))
+            else:
+                affected.add(v if back_random_walk else u)
+        positions = [walks.visit_positions(csr.index[x]) for x in affected if x in csr.index]
+        positions = np.sort(np.concatenate(positions)) if positions else np.empty(0, dtype=np.int64)
+
+        # The tallies move to the node ids of the new snapshot like the walks did
+        visits = self.counters[seed_node].rebase(csr.nodes, csr.index).counts
+        hits = self.hits[seed_node].rebase(csr.nodes, csr.index).counts
+
+        # Cut every affected walk at its first visit of an affected node
+        walk_ids, first = np.unique(walks.walk_of(positions), return_index=True)
+        w_func = self.bias if bias_strategy == BiasStrategies.ALPHA_DIFF else self.weight
+        tails, removed, added = {}, [], []
+        for walk_id, cut in zip(walk_ids, positions[first]):
+            walk = walks.node_ids[walks.offsets[walk_id]:walks.offsets[walk_id + 1]]
+            prefix = walk[:cut + 1 - walks.offsets[walk_id]]
+            cur_weight = float('inf')
+            if params['update_weight']:
+                for a, b in zip(prefix[:-1], prefix[1:]):
+                    cur_weight = min(w_func(csr.nodes[a], csr.nodes[b], cur_weight, back_random_walk), cur_weight)
+            tail = self._compute_random_walks(int(prefix[-1]), bias_strategy, params['reset_probability'],
+                                              back_random_walk, params['update_weight'], csr,
+                                              self._seed_source, cur_weight)[1:]
+            np.subtract.at(visits, walk[len(prefix):], 1)
+            np.add.at(visits, np.asarray(tail, dtype=np.int64), 1)
+            old_hits, new_hits = set(walk.tolist()), set(prefix.tolist()) | set(tail)
+            removed.extend(old_hits - new_hits)
+            added.extend(new_hits - old_hits)
+            tails[int(walk_id)] = (int(cut), tail)
+        np.subtract.at(hits, np.asarray(removed, dtype=np.int64), 1)
+        np.add.at(hits, np.asarray(added, dtype=np.int64), 1)
+
+        if tails:
+            walks.splice(tails)
+        self.counters[seed_node] = NodeCounts(csr.nodes, csr.index, visits)
+        self.hits[seed_node] = NodeCounts(csr.nodes, csr.index, hits)
+
+    def compute_penalties(self, seed_node: int, values: Dict) -> Dict:
+        """Penalties of the nodes on the stored walks of a seed node that lead to the given target nodes.
+        For a target t with value w, a node k gets ceil(w * e_t(k) / e_t(t)), where e_t counts the visits at positions
+        1..v of every walk once per visit of t at position v, see Walks.target_encounters.
+        The penalties of all targets are computed in a single pass and added up.
+        @param seed_node: The seed node, its walks must be retained.
+        @param values: Target node -> value to distribute.
+        @return: Penalty of every node.
+        """
+        penalties = defaultdict(int)
+        walks = self.random_walks[seed_node]
+        targets = [t for t in values if t in walks.index]
+        if not targets:
+            return penalties
+        target_ids = np.array([walks.index[t] for t in targets])
+        groups, node_ids, counts = walks.target_encounters(target_ids)
+        own = node_ids == target_ids[groups]
+        target_counts = np.zeros(len(targets), dtype=np.int64)
+        target_counts[groups[own]] = counts[own]
+        target_values = np.array([values[t] for t in targets], dtype=np.float64)
+        scores = np.ceil(target_values[groups] * counts / target_counts[groups])
+        for k, v in zip(node_ids, scores):
+            penalties[walks.nodes[k]] += int(v)
+        return penalties
 
     def has_node(self, node: int) -> bool:
-        return node in self.random_walks
+        return node in self.number_of_walks or node in self.random_walks
 
     def get_total_hits(self, seed_node: int, target_node: int) -> float:
         """Get number of times the target node was visited in the run.
@@ -195,7 +789,7 @@ class RandomWalks:
         return self.counters[seed_node].get(target_node, 0)
 
     def get_total_sum(self, seed_node: int) -> float:
-        return sum(self.counters[seed_node].values())
+        return self.counters[seed_node].total()
 
     def get_number_of_hits(self, seed_node: int, target_node: int) -> float:
         """Get number of walks that hit the target node.
@@ -205,3 +799,78 @@ class RandomWalks:
         if seed_node == target_node:
             return self.number_of_walks[seed_node]
         return self.hits[seed_node].get(target_node, 0)
+
+    def _counts_of(self, counts: Dict, seed_node: int, target_nodes: List) -> np.ndarray:
+        values = counts[seed_node].counts_of(target_nodes)
+        values[[i for i, x in enumerate(target_nodes) if x == seed_node]] = self.number_of_walks[seed_node]
+        return values
+
+    def get_total_hits_many(self, seed_node: int, target_nodes: List) -> np.ndarray:
+        """get_total_hits of many target nodes at once, aligned with target_nodes."""
+        return self._counts_of(self.counters, seed_node, target_nodes)
+
+    def get_number_of_hits_many(self, seed_node: int, target_nodes: List) -> np.ndarray:
+        """get_number_of_hits of many target nodes at once, aligned with target_nodes."""
+        return self._counts_of(self.hits, seed_node, target_nodes)
+
+
+class BoundedWeights:
+
+    def __init__(self, edge_counts: EdgeCounts, base_number_random_walks: int, alpha: float, penalties: Dict) -> None:
+        """Edge weights of the EDGE_WEIGHT_BOUNDED strategy over one walk direction during a run.
+        An edge (u, v) keeps the weight base * w(u, v) until the walks over it plus base * int(penalty(v) / alpha)
+        reach that weight, afterwards it is closed. Without weight bounds the open weights are sampled from per-node
+        Fenwick trees, so a step costs O(log degree).
+        @param edge_counts: walks over every edge in the run so far, updated by the caller
+        @param base_number_random_walks: The number of walks per unit of weight.
+        @param alpha: Score value used for the bias.
+        @param penalties: The penalties for each node.
+        """
+        adj = edge_counts.adjacency
+        self.adjacency = adj
+        self.edge_counts = edge_counts
+        self.penalties = penalties
+        self.base = base_number_random_walks
+        self.capacity = base_number_random_walks * adj.weights
+        self.penalty_walks = base_number_random_walks * np.array([int(penalties.get(x, 0) / alpha)
+                                                                  for x in edge_counts.nodes], dtype=np.float64)
+        used = edge_counts.counts + self.penalty_walks[adj.indices]
+        self.tree = FenwickRows(adj.offsets, np.where(used >= self.capacity, 0.0, self.capacity))
+
+    def weights(self, node: int, cur_weight: float) -> np.ndarray:
+        """Bounded weights of all edges out of a node for a walk whose weight is capped at cur_weight."""
+        start, end = self.adjacency.offsets[node], self.adjacency.offsets[node + 1]
+        weights = self.base * np.minimum(self.adjacency.weights[start:end], cur_weight)
+        used = self.edge_counts.counts[start:end] + self.penalty_walks[self.adjacency.indices[start:end]]
+        return np.where(used >= weights, 0.0, weights)
+
+    def sample(self, node: int, rng: random.Random) -> int:
+        """Sample the position of an open edge out of a node, -1 if all its edges are closed."""
+        tree = self.tree
+        while tree.has_weight(node):
+            position = tree.find(node, rng.uniform(0, 1) * tree.totals[node])
+            # Only a rounding error in the tree can point to a closed edge, draw again in that case
+            if tree.weights[position] > 0:
+                return position
+        return -1
+
+    def update(self, position: int) -> None:
+        """Close the edge at the position if the walk just counted on it used up its weight."""
+        if self.tree.weights[position] > 0 and self.edge_counts.counts[position] \
+                + self.penalty_walks[self.adjacency.indices[position]] >= self.capacity[position]:
+            self.tree.set(int(self.adjacency.sources[position]), position, 0.0)
+
+
+def _run_walk_blocks(csr: CSRGraph, alpha: float, base_number_random_walks: int, params: Tuple,
+                     sizes: List[int], seed_sequences: List[np.random.SeedSequence]
+                     ) -> Tuple[np.ndarray, np.ndarray, Optional[np.ndarray]]:
+    """Worker side of RandomWalks.run with an executor: run blocks of walks and return only their tallies."""
+    seed_node, reset_probability, back_random_walk, bias_strategy, update_weight, batch = params
+    walker = RandomWalks(None, alpha, base_number_random_walks, retain_walks=False)
+    visits, hits = 0, 0
+    for size, seed_sequence in zip(sizes, seed_sequences):
+        walks = walker._generate_walks(seed_node, size, reset_probability, back_random_walk, bias_strategy,
+                                       update_weight, batch, csr, seed_sequence)
+        visits = visits + walks.visit_counts().counts
+        hits = hits + walks.hit_counts().counts
+    return visits, hits, None if walker._edge_walks is None else walker._edge_walks.counts
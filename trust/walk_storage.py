@@ -0,0 +1,266 @@
+"""
+Compact storage of random walks: one flat int32 array of node ids plus the offsets of every walk.
+"""
+from collections.abc import Mapping, Sequence
+from typing import Dict, Iterator, List, Tuple
+
+import numpy as np
+
+
+class NodeCounts(Mapping):
+
+    def __init__(self, nodes: List, index: Dict, counts: np.ndarray) -> None:
+        """Read-only node -> count mapping backed by a count array aligned with the node ids.
+        Nodes with a zero count are not part of the mapping, as in a Counter.
+        @param nodes: node objects by node id
+        @param index: node object -> node id
+        @param counts: count of every node id
+        """
+        self.nodes = nodes
+        self.index = index
+        self.counts = counts
+
+    def __getitem__(self, node) -> int:
+        i = self.index.get(node)
+        if i is None or i >= len(self.counts) or self.counts[i] == 0:
+            raise KeyError(node)
+        return int(self.counts[i])
+
+    def __iter__(self) -> Iterator:
+        return (self.nodes[i] for i in np.flatnonzero(self.counts))
+
+    def __len__(self) -> int:
+        return int(np.count_nonzero(self.counts))
+
+    def total(self) -> int:
+        return int(self.counts.sum())
+
+    def counts_of(self, nodes: List) -> np.ndarray:
+        """Counts of many nodes at once, zero for nodes that are not part of the mapping."""
+        ids = np.fromiter((self.index.get(node, -1) for node in nodes), dtype=np.int64, count=len(nodes))
+        known = (ids >= 0) & (ids < len(self.counts))
+        counts = np.zeros(len(nodes), dtype=np.int64)
+        counts[known] = self.counts[ids[known]]
+        return counts
+
+    def rebase(self, nodes: List, index: Dict) -> 'NodeCounts':
+        """Counts of the same nodes by the node ids of a newer graph snapshot, nodes that it lacks are dropped."""
+        counts = np.zeros(len(nodes), dtype=self.counts.dtype)
+        if len(nodes) >= len(self.nodes) and nodes[:len(self.nodes)] == self.nodes:
+            counts[:len(self.counts)] = self.counts
+        else:
+            remap = np.array([index.get(x, -1) for x in self.nodes], dtype=np.int64)
+            known = remap[:len(self.counts)] >= 0
+            counts[remap[:len(self.counts)][known]] = self.counts[known]
+        return NodeCounts(nodes, index, counts)
+
+
+class EdgeCounts(Mapping):
+
+    def __init__(self, nodes: List, index: Dict, adjacency, counts: np.ndarray = None) -> None:
+        """Read-only (from node, to node) -> count mapping backed by a count array aligned with the edge ids
+        of a CSR adjacency. Edges with a zero count are not part of the mapping.
+        @param nodes: node objects by node id
+        @param index: node object -> node id
+        @param adjacency: CSRAdjacency that defines the edge ids
+        @param counts: int64 count of every edge id (default: all zero)
+        """
+        self.nodes = nodes
+        self.index = index
+        self.adjacency = adjacency
+        self.counts = np.zeros(len(adjacency.indices), dtype=np.int64) if counts is None else counts
+
+    def edge_id(self, u, v) -> int:
+        """Edge id of the edge from u to v, -1 if there is none."""
+        i, j = self.index.get(u), self.index.get(v)
+        if i is None or j is None:
+            return -1
+        match = np.flatnonzero(self.adjacency.neighbors(i) == j)
+        return int(self.adjacency.offsets[i] + match[0]) if len(match) else -1
+
+    def __getitem__(self, edge: Tuple) -> int:
+        e = self.edge_id(*edge)
+        if e < 0 or self.counts[e] == 0:
+            raise KeyError(edge)
+        return int(self.counts[e])
+
+    def __iter__(self) -> Iterator:
+        return ((self.nodes[self.adjacency.sources[e]], self.nodes[self.adjacency.indices[e]])
+                for e in np.flatnonzero(self.counts))
+
+    def __len__(self) -> int:
+        return int(np.count_nonzero(self.counts))
+
+    def rebase(self, nodes: List, index: Dict, adjacency) -> 'EdgeCounts':
+        """Counts of the same edges by the edge ids of another adjacency, edges that it lacks are dropped."""
+        used = np.flatnonzero(self.counts)
+        remap = np.array([index.get(x, -1) for x in self.nodes], dtype=np.int64)
+        sources, targets = remap[self.adjacency.sources[used]], remap[self.adjacency.indices[used]]
+        known = (sources >= 0) & (targets >= 0)
+        keys = sources[known] * len(nodes) + targets[known]
+        new_keys = adjacency.sources.astype(np.int64) * len(nodes) + adjacency.indices
+        order = np.argsort(new_keys)
+        found = np.minimum(np.searchsorted(new_keys[order], keys), max(len(order) - 1, 0))
+        matched = new_keys[order][found] == keys if len(order) else np.zeros(len(keys), dtype=bool)
+        counts = np.zeros(len(new_keys), dtype=np.int64)
+        counts[order[found[matched]]] = self.counts[used[known][matched]]
+        return EdgeCounts(nodes, index, adjacency, counts)
+
+
+class Walks(Sequence):
+
+    def __init__(self, nodes: List, index: Dict, node_ids: np.ndarray, offsets: np.ndarray) -> None:
+        """Random walks of one seed stored as a flat array.
+        Walk i consists of the node ids node_ids[offsets[i]:offsets[i + 1]].
+        Indexing or iterating gives the walks lazily as lists of node objects.
+        @param nodes: node objects by node id
+        @param index: node object -> node id
+        @param node_ids: int32 node ids of all walks, concatenated
+        @param offsets: int64 start of every walk in node_ids, length number of walks + 1
+        """
+        self.nodes = nodes
+        self.index = index
+        self.node_ids = node_ids
+        self.offsets = offsets
+
+        self._visit_order = None
+        self._visit_offsets = None
+
+    @classmethod
+    def from_id_lists(cls, nodes: List, index: Dict, walks: List[List[int]]) -> 'Walks':
+        lengths = np.fromiter((len(w) for w in walks), dtype=np.int64, count=len(walks))
+        node_ids = np.fromiter((i for w in walks for i in w), dtype=np.int32, count=int(lengths.sum()))
+        return cls(nodes, index, node_ids, np.concatenate(([0], np.cumsum(lengths))))
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i: int) -> List:
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return [self.nodes[x] for x in self.node_ids[self.offsets[i]:self.offsets[i + 1]]]
+
+    def walk_ids(self) -> np.ndarray:
+        """Walk id of every entry of node_ids."""
+        return np.repeat(np.arange(len(self)), np.diff(self.offsets))
+
+    def append(self, walk: List) -> None:
+        """Add one walk given as a list of node objects.
+        Copies the flat arrays, meant for occasional single walks only.
+        """
+        if any(x not in self.index for x in walk):
+            self.nodes, self.index = list(self.nodes), dict(self.index)
+            for x in walk:
+                if x not in self.index:
+                    self.index[x] = len(self.nodes)
+                    self.nodes.append(x)
+        ids = np.array([self.index[x] for x in walk], dtype=np.int32)
+        self.node_ids = np.concatenate((self.node_ids, ids))
+        self.offsets = np.append(self.offsets, self.offsets[-1] + len(ids))
+        self._visit_order = None
+
+    def extend(self, walks: 'Walks') -> None:
+        """Add the walks of another Walks object over the same node ids."""
+        self.node_ids = np.concatenate((self.node_ids, walks.node_ids))
+        self.offsets = np.concatenate((self.offsets, self.offsets[-1] + walks.offsets[1:]))
+        self._visit_order = None
+
+    def rebase(self, nodes: List, index: Dict) -> bool:
+        """Switch to the node ids of a newer graph snapshot.
+        Cheap when the new snapshot only appends nodes, otherwise all node ids are remapped.
+        @param nodes: node objects by node id in the new snapshot
+        @param index: node object -> node id in the new snapshot
+        @return: False if a visited node is not part of the new snapshot
+        """
+        if len(nodes) < len(self.nodes) or nodes[:len(self.nodes)] != self.nodes:
+            remap = np.array([index.get(x, -1) for x in self.nodes], dtype=np.int32)
+            if len(self.node_ids) and remap[self.node_ids].min() < 0:
+                return False
+            self.node_ids = remap[self.node_ids]
+            self._visit_order = None
+        self.nodes, self.index = nodes, index
+        return True
+
+    def visit_positions(self, node_id: int) -> np.ndarray:
+        """Positions in node_ids of all visits of a node.
+        Uses an inverted node -> position index that is built on first use.
+        """
+        if self._visit_order is None:
+            self._visit_order = np.argsort(self.node_ids, kind='stable')
+            self._visit_offsets = np.concatenate(([0], np.cumsum(np.bincount(self.node_ids,
+                                                                              minlength=len(self.nodes)))))
+        if node_id >= len(self._visit_offsets) - 1:
+            return np.empty(0, dtype=np.int64)
+        return self._visit_order[self._visit_offsets[node_id]:self._visit_offsets[node_id + 1]]
+
+    def target_encounters(self, target_ids: List[int]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Count the nodes that lead to each target on the walks.
+        For every visit of a target at position v of a walk, each node at positions 1..v of that walk is counted once.
+        Only the walks that visit a target are touched, found through the inverted node -> position index.
+        @param target_ids: node ids of the targets
+        @return: target number, node id and count of every non-zero count
+        """
+        occurrences = [self.visit_positions(t) for t in target_ids]
+        sizes = np.fromiter((len(o) for o in occurrences), dtype=np.int64, count=len(occurrences))
+        if not sizes.sum():
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+        occurrences = np.concatenate(occurrences).astype(np.int64)
+        groups = np.repeat(np.arange(len(target_ids)), sizes)
+        # Visits sorted by (target, position), so that prefix counts are a binary search away
+        total = len(self.node_ids)
+        keys = groups * total + occurrences
+
+        walk_ids = self.walk_of(occurrences)
+        last = np.ones(len(keys), dtype=bool)
+        last[:-1] = (groups[1:] != groups[:-1]) | (walk_ids[1:] != walk_ids[:-1])
+        pair_groups, pair_walks, pair_last = groups[last], walk_ids[last], occurrences[last]
+        pair_end = np.flatnonzero(last) + 1
+
+        # Positions 1..v of every (target, walk) pair up to the last visit v of the target
+        starts = self.offsets[pair_walks] + 1
+        lengths = pair_last - starts + 1
+        positions = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths) \
+            + np.repeat(starts, lengths)
+        position_groups = np.repeat(pair_groups, lengths)
+        # Number of visits of the target at or after each position within the same walk
+        counts = np.repeat(pair_end, lengths) - np.searchsorted(keys, position_groups * total + positions)
+
+        n = len(self.nodes)
+        pairs, inverse = np.unique(position_groups * n + self.node_ids[positions], return_inverse=True)
+        return pairs // n, pairs % n, np.bincount(inverse, weights=counts).astype(np.int64)
+
+    def walk_of(self, positions: np.ndarray) -> np.ndarray:
+        """Walk id of every given position in node_ids."""
+        return np.searchsorted(self.offsets, positions, side='right') - 1
+
+    def splice(self, tails: Dict[int, Tuple[int, List[int]]]) -> None:
+        """Replace the ends of some walks.
+        @param tails: walk id -> (position in node_ids of the last kept node, node ids that follow it)
+        """
+        pieces, lengths, previous = [], np.diff(self.offsets), 0
+        for walk_id in sorted(tails):
+            cut, tail = tails[walk_id]
+            pieces.append(self.node_ids[previous:cut + 1])
+            pieces.append(np.asarray(tail, dtype=np.int32))
+            previous = self.offsets[walk_id + 1]
+            lengths[walk_id] = cut + 1 - self.offsets[walk_id] + len(tail)
+        pieces.append(self.node_ids[previous:])
+        self.node_ids = np.concatenate(pieces)
+        self.offsets = np.concatenate(([0], np.cumsum(lengths)))
+        self._visit_order = None
+
+    def visit_counts(self) -> NodeCounts:
+        """Number of visits of every node over all walks."""
+        counts = np.bincount(self.node_ids, minlength=len(self.nodes))
+        return NodeCounts(self.nodes, self.index, counts)
+
+    def hit_counts(self) -> NodeCounts:
+        """Number of walks that visit every node at least once."""
+        n = len(self.nodes)
+        visits = np.sort(self.walk_ids() * n + self.node_ids)
+        first = np.ones(len(visits), dtype=bool)
+        first[1:] = visits[1:] != visits[:-1]
+        counts = np.bincount(visits[first] % n, minlength=n)
+        return NodeCounts(self.nodes, self.index, counts)